@@ -0,0 +1,193 @@
+# Google Chat cards sent by the bot. Each card is compiled once into a template, so messages are rendered straight into JSON bytes.
+from CardTemplate import CardTemplate
+
+# Possible action methods in case of a card click event.
+ACTIONMETHOD_ACCEPT = "accept"
+ACTIONMETHOD_DECLINE = "decline"
+ACTIONMETHOD_DONE = "done"
+
+def get_new_bot_message(jiraId, managerId):
+    return {
+        "cards": [
+            {
+            "header": {
+                "title": "New RCA Notfication"
+            },
+            "sections": [
+                {
+                "widgets": [
+                    {
+                    "buttons": [
+                        {
+                        "textButton": {
+                            "text": jiraId,
+                            "onClick": {
+                            "openLink": {
+                                "url": f"https://jira.devfactory.com/browse/{jiraId}"
+                            }
+                            }
+                        }
+                        }
+                    ]
+                    }
+                ]
+                },
+                {
+                    "widgets": [
+                    {
+                        "buttons": [
+                        {
+                            "textButton": {
+                            "text": "Accept",
+                            "onClick": {
+                                "action": {
+                                "actionMethodName": ACTIONMETHOD_ACCEPT,
+                                "parameters": [
+                                    {
+                                    "key": "jiraId",
+                                    "value": jiraId
+                                    },
+                                    {
+                                    "key": "managerId",
+                                    "value": managerId
+                                    }
+                                ]
+                                }
+                            }
+                            }
+                        },
+                        {
+                            "textButton": {
+                            "text": "Decline",
+                            "onClick": {
+                                "action": {
+                                "actionMethodName": ACTIONMETHOD_DECLINE,
+                                "parameters": [
+                                    {
+                                    "key": "jiraId",
+                                    "value": jiraId
+                                    },
+                                    {
+                                    "key": "managerId",
+                                    "value": managerId
+                                    }
+                                ]
+                                }
+                            }
+                            }
+                        }
+                        ]
+                    }
+                ]
+                }
+            ]
+            }
+        ],
+        "text": f"<users/{managerId}>"
+    }
+
+def get_accept_bot_message(jiraId, managerId, managerName):
+    return {
+        "actionResponse":{
+            "type":"UPDATE_MESSAGE"
+        },
+        "cards": [
+            {
+            "header": {
+                "title": f"Assigned to {managerName}"
+            },
+            "sections": [
+                {
+                "widgets": [
+                    {
+                        "textParagraph": {
+                            "text": "Please work on"
+                        },
+                        "buttons": [
+                            {
+                            "textButton": {
+                                "text": jiraId,
+                                "onClick": {
+                                    "openLink": {
+                                        "url": f"https://jira.devfactory.com/browse/{jiraId}"
+                                    }
+                                }
+                            }
+                            }
+                        ]
+                    }
+                ]
+                },
+                {
+                    "widgets": [
+                    {
+                        "buttons": [
+                        {
+                            "textButton": {
+                            "text": "Done",
+                            "onClick": {
+                                "action": {
+                                "actionMethodName": ACTIONMETHOD_DONE,
+                                "parameters": [
+                                    {
+                                    "key": "jiraId",
+                                    "value": jiraId
+                                    },
+                                    {
+                                    "key": "managerId",
+                                    "value": managerId
+                                    }
+                                ]
+                                }
+                            }
+                            }
+                        }
+                        ]
+                    }
+                ]
+                }
+            ]
+            }
+        ],
+        "text": f"<users/{managerId}>"
+    }
+
+def get_declined_bot_message(jiraId, managerName):
+    return {
+        "actionResponse":{
+            "type":"UPDATE_MESSAGE"
+        },
+        "cards": [],
+        "text": f"{jiraId} was declined by {managerName}"
+    }
+
+def get_done_bot_message(jiraId, managerName):
+    return {
+        "actionResponse":{
+            "type":"UPDATE_MESSAGE"
+        },
+        "cards": [],
+        "text": f"{jiraId} was completed by {managerName}"
+    }
+
+
+JIRAID_PLACEHOLDER = CardTemplate.placeholder('jiraId')
+MANAGERID_PLACEHOLDER = CardTemplate.placeholder('managerId')
+MANAGERNAME_PLACEHOLDER = CardTemplate.placeholder('managerName')
+
+new_bot_message_template = CardTemplate(get_new_bot_message(JIRAID_PLACEHOLDER, MANAGERID_PLACEHOLDER))
+accept_bot_message_template = CardTemplate(get_accept_bot_message(JIRAID_PLACEHOLDER, MANAGERID_PLACEHOLDER, MANAGERNAME_PLACEHOLDER))
+declined_bot_message_template = CardTemplate(get_declined_bot_message(JIRAID_PLACEHOLDER, MANAGERNAME_PLACEHOLDER))
+done_bot_message_template = CardTemplate(get_done_bot_message(JIRAID_PLACEHOLDER, MANAGERNAME_PLACEHOLDER))
+
+def render_new_bot_message(jiraId, managerId):
+    return new_bot_message_template.render(jiraId=jiraId, managerId=managerId)
+
+def render_accept_bot_message(jiraId, managerId, managerName):
+    return accept_bot_message_template.render(jiraId=jiraId, managerId=managerId, managerName=managerName)
+
+def render_declined_bot_message(jiraId, managerName):
+    return declined_bot_message_template.render(jiraId=jiraId, managerName=managerName)
+
+def render_done_bot_message(jiraId, managerName):
+    return done_bot_message_template.render(jiraId=jiraId, managerName=managerName)
\ No newline at end of file
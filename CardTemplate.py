@@ -0,0 +1,28 @@
+import json
+from json.encoder import encode_basestring_ascii
+import re
+
+# Card compiled once into pre-serialized JSON, rendering only substitutes the placeholder values
+class CardTemplate():
+    PLACEHOLDER_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
+    @staticmethod
+    def placeholder(name):
+        """Value to build the card with, in place of the real value of name"""
+        return '{{' + name + '}}'
+
+    def __init__(self, card):
+        parts = self.PLACEHOLDER_PATTERN.split(json.dumps(card, separators=(',', ':')))
+        # Literal JSON bytes followed by the placeholder name after it, last literal has no placeholder
+        self.literals = [part.encode('utf-8') for part in parts[0::2]]
+        self.placeholder_names = parts[1::2]
+
+    def render(self, **values):
+        """Returns the card as JSON bytes. Values are escaped as JSON string content."""
+        escapedValues = { name: encode_basestring_ascii(str(value))[1:-1].encode('ascii') for name, value in values.items() }
+        renderedParts = []
+        for literal, name in zip(self.literals, self.placeholder_names):
+            renderedParts.append(literal)
+            renderedParts.append(escapedValues[name])
+        renderedParts.append(self.literals[-1])
+        return b''.join(renderedParts)
\ No newline at end of file
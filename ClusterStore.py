@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from dateutil import parser
+import sqlite3
+import threading
+import time
+from SQLiteStateStore import SQLiteStateStore
+from TicketState import TicketState
+
+# State shared by all processes of a clustered deployment, in one SQLite database that every process opens.
+# Ticket timers are rows with a deadline, claimed by one process at a time under a lease so each timeout fires once.
+# New tickets are claimed the same way while they are taken in, so duplicate requests on different processes take a ticket in once.
+class ClusterStore(SQLiteStateStore):
+    tracker_store = None
+
+    def __init__(self, databasePath, trackerStore, busyTimeout=30.0):
+        super().__init__(databasePath, busyTimeout)
+        # Reentrant, so the store methods can be called inside transaction()
+        self.lock = threading.RLock()
+        # Tracker rows are appended to the GSheet directly, appends of different processes never collide
+        self.tracker_store = trackerStore
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS ticket_timer (
+                ticket TEXT PRIMARY KEY, manager_id INTEGER, deadline REAL, is_declined INTEGER, owner TEXT, lease_expiry REAL);
+            CREATE INDEX IF NOT EXISTS ticket_timer_deadline ON ticket_timer (deadline);
+            CREATE TABLE IF NOT EXISTS ticket_intake (
+                ticket TEXT PRIMARY KEY, owner TEXT, lease_expiry REAL);
+        ''')
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction across processes. Other processes wait to write till it is committed."""
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+                self.connection.execute('COMMIT')
+            except:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def seed_if_empty(self, ticketStates, managerStates, rotationRowNumberByColumn):
+        """Seed a new cluster database. Only the first process to start seeds it."""
+        with self.transaction():
+            if not self.is_empty():
+                return
+            for record in ticketStates:
+                self.append_ticket_state(record.jira_id, record.manager_id, record.manager_name, record.thread_id, record.message_id)
+            for managerId, timestamp in managerStates.items():
+                self.save_manager_state(managerId, timestamp)
+            self.save_rotation_rows(rotationRowNumberByColumn)
+
+    def get_ticket_state(self, jiraId):
+        """Ticket state record, or None if the ticket is not in the cycle"""
+        with self.lock:
+            row = self.connection.execute('SELECT ticket, manager_name, manager_id, message_id, thread_id FROM ticket_state WHERE ticket = ?', (jiraId,)).fetchone()
+        if row is None:
+            return None
+        return TicketState(row[0], row[2], row[1], row[4], row[3])
+
+    def load_manager_states_since(self, timestamp):
+        """Manager states with last activity at or after timestamp, enough to know every manager currently in dnd"""
+        with self.lock:
+            rows = self.connection.execute('SELECT manager_id, last_activity FROM manager_state WHERE last_activity >= ?', (str(timestamp),)).fetchall()
+        return { row[0]: parser.parse(row[1]) for row in rows }
+
+    def append_tracker_rows(self, rows):
+        self.tracker_store.append_tracker_rows(rows)
+
+    def add_timer(self, jiraId, managerId, delay):
+        """Start the timer of a ticket, unless it already has one"""
+        with self.lock:
+            self.connection.execute('INSERT OR IGNORE INTO ticket_timer VALUES (?, ?, ?, 0, NULL, 0)', (jiraId, managerId, time.time() + delay))
+
+    def fire_timer_now(self, jiraId, managerId, isDeclined=True):
+        """Make the timer of a declined or expired ticket due right away. Ignored if the ticket moved on to another manager or is firing."""
+        with self.lock:
+            self.connection.execute('UPDATE ticket_timer SET deadline = ?, is_declined = ? WHERE ticket = ? AND manager_id = ? AND owner IS NULL', (time.time(), 1 if isDeclined else 0, jiraId, managerId))
+
+    def remove_timer(self, jiraId, managerId=None):
+        """Stop the timer of a ticket. With managerId, only if the ticket is still with that manager."""
+        with self.lock:
+            if managerId is None:
+                self.connection.execute('DELETE FROM ticket_timer WHERE ticket = ?', (jiraId,))
+            else:
+                self.connection.execute('DELETE FROM ticket_timer WHERE ticket = ? AND manager_id = ?', (jiraId, managerId))
+
+    def claim_due_timers(self, owner, leaseDuration, maxTimers):
+        """Claim due timers for owner till the lease expires. Timers of an owner that died are claimed again once their lease expires.
+        Returns list of (jiraId, managerId, isDeclined)."""
+        now = time.time()
+        with self.transaction():
+            rows = self.connection.execute('SELECT ticket, manager_id, is_declined FROM ticket_timer WHERE deadline <= ? AND (owner IS NULL OR lease_expiry <= ?) ORDER BY deadline LIMIT ?', (now, now, maxTimers)).fetchall()
+            self.connection.executemany('UPDATE ticket_timer SET owner = ?, lease_expiry = ? WHERE ticket = ?', [(owner, now + leaseDuration, row[0]) for row in rows])
+        return [(row[0], row[1], row[2] == 1) for row in rows]
+
+    def release_timer(self, jiraId, owner, managerId, delay):
+        """Reschedule a fired timer for its next timeout. Ignored if the ticket was accepted or the lease was lost meanwhile."""
+        with self.lock:
+            self.connection.execute('UPDATE ticket_timer SET manager_id = ?, deadline = ?, is_declined = 0, owner = NULL, lease_expiry = 0 WHERE ticket = ? AND owner = ?', (managerId, time.time() + delay, jiraId, owner))
+
+    def claim_ticket_intake(self, jiraId, owner, leaseDuration):
+        """Claim a new ticket for owner to take in. Returns False if it is already in the cycle or another process is taking it in.
+        The claim of an owner that died is taken over once its lease expires."""
+        now = time.time()
+        with self.transaction():
+            if self.connection.execute('SELECT 1 FROM ticket_state WHERE ticket = ?', (jiraId,)).fetchone() is not None:
+                return False
+            self.connection.execute('DELETE FROM ticket_intake WHERE ticket = ? AND lease_expiry <= ?', (jiraId, now))
+            try:
+                self.connection.execute('INSERT INTO ticket_intake VALUES (?, ?, ?)', (jiraId, owner, now + leaseDuration))
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def release_ticket_intake(self, jiraId, owner):
+        """Release the intake claim of owner on a ticket, once it is in the cycle or its intake failed"""
+        with self.lock:
+            self.connection.execute('DELETE FROM ticket_intake WHERE ticket = ? AND owner = ?', (jiraId, owner))
+
+    def get_timer_count(self):
+        """Number of tickets on timer in the cluster"""
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM ticket_timer').fetchone()[0]
+
+    def stop(self):
+        self.tracker_store.stop()
+        super().stop()
\ No newline at end of file
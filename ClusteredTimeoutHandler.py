@@ -0,0 +1,85 @@
+from TimeoutHandler import TimeoutHandler, TIMEOUTDISPATCHMODE_INPROCESS
+import time
+import traceback
+
+# Ticket timeouts of a clustered deployment. Timers live in the ClusterStore and every process polls for due timers,
+# a due timer is claimed under a lease by exactly one process which fires it and reschedules it.
+class ClusteredTimeoutHandler(TimeoutHandler):
+    # Key of the poll timer in the TimerScheduler, ticket ids are never tuples
+    POLL_TIMER_KEY = ('ClusterTimerPoll',)
+    MAX_TIMERS_PER_POLL = 100
+    # Fraction of the lease a claimed timer may take to fire, the rest is left to release it before another process claims it again
+    DISPATCH_LEASE_FRACTION = 0.75
+
+    cluster_store = None
+    node_id = ''
+    lease_duration = 60.0
+    poll_interval = 1.0
+
+    def __init__(self, logger, clusterStore, nodeId, leaseDuration, pollInterval, timeout, urlForRestRequest, list_of_cached_ticket_states, numberOfTimeoutWorkers=4, timeoutDispatcher=None, timeoutDispatchMode=TIMEOUTDISPATCHMODE_INPROCESS, timerScheduler=None, tenantName=''):
+        # Set before the base class schedules the cached tickets
+        self.cluster_store = clusterStore
+        self.node_id = nodeId
+        self.lease_duration = leaseDuration
+        self.poll_interval = pollInterval
+        super().__init__(logger, timeout, urlForRestRequest, list_of_cached_ticket_states, numberOfTimeoutWorkers, timeoutDispatcher, timeoutDispatchMode, timerScheduler, tenantName)
+        self.timer_scheduler.schedule(self.get_timer_key(self.POLL_TIMER_KEY), self.poll_interval, self.poll_due_timers)
+
+    def update_ticket_states_during_runtime(self, removedRecordsList, allNewRecordsList):
+        """When loading ticket states during runtime, the timeouts of the tickets are removed/added in the cluster."""
+        for record in removedRecordsList:
+            self.cluster_store.remove_timer(record.jira_id)
+        for record in allNewRecordsList:
+            self.add_thread(record.jira_id, record.manager_id, self.timeout_for_ticket)
+
+    def add_thread(self, jiraId, managerId, timeout=0):
+        """Schedule a timeout for ticket, unless any process of the cluster already has."""
+        if timeout == 0:
+            timeout = self.timeout_for_ticket
+        self.cluster_store.add_timer(jiraId, int(managerId), timeout)
+
+    def remove_thread_on_response(self, jiraId, managerId, isDeclined):
+        """Fire the timeout of ticket right away on decline, remove it completely in case it is accepted.
+        Timer may be claimed by another process, so the next poll here is brought forward to fire it without delay."""
+        if isDeclined:
+            self.cluster_store.fire_timer_now(jiraId, int(managerId))
+            self.timer_scheduler.schedule(self.get_timer_key(self.POLL_TIMER_KEY), 0, self.poll_due_timers)
+        else:
+            self.cluster_store.remove_timer(jiraId, int(managerId))
+
+    def expire_thread(self, jiraId, managerId):
+        """Time out the ticket for its manager right away, on whichever process claims it"""
+        self.cluster_store.fire_timer_now(jiraId, int(managerId), False)
+        self.timer_scheduler.schedule(self.get_timer_key(self.POLL_TIMER_KEY), 0, self.poll_due_timers)
+
+    def get_timer_count(self):
+        """Number of tickets on timer in the cluster"""
+        return self.cluster_store.get_timer_count()
+
+    def poll_due_timers(self):
+        """Claim due timers of the cluster and fire them on the timer worker pool"""
+        try:
+            deadline = time.monotonic() + self.lease_duration * self.DISPATCH_LEASE_FRACTION
+            for jiraId, managerId, isDeclined in self.cluster_store.claim_due_timers(self.node_id, self.lease_duration, self.MAX_TIMERS_PER_POLL):
+                self.timer_scheduler.schedule(self.get_timer_key(jiraId), 0, self.fire_claimed_timer, jiraId, managerId, isDeclined, deadline)
+        except:
+            self.logger.error("Error in poll_due_timers in ClusteredTimeoutHandler: " + traceback.format_exc())
+        finally:
+            self.timer_scheduler.schedule(self.get_timer_key(self.POLL_TIMER_KEY), self.poll_interval, self.poll_due_timers)
+
+    def fire_claimed_timer(self, jiraId, managerId, isDeclined, deadline):
+        """Runs on the timer worker pool for a claimed timer, and releases it with the next timeout.
+        Google Chat requests are given up at deadline, before the lease expires and another process fires the timer again."""
+        isManagerTimeout = managerId != 0 and not isDeclined
+        timeoutForTicket = self.timeout_for_ticket
+        try:
+            responseData = self.dispatch_timeout(jiraId, isManagerTimeout, deadline)
+            if responseData is not None:
+                managerId = int(responseData['managerId'])
+                if managerId == 0:
+                    # When all managers are busy/dnd, managerId is 0 in response
+                    timeoutForTicket = int(responseData['newTimeOut'])
+        except:
+            self.logger.error(f"Error in timeout for {jiraId}: {traceback.format_exc()}")
+        finally:
+            self.cluster_store.release_timer(jiraId, self.node_id, managerId, timeoutForTicket)
\ No newline at end of file
@@ -0,0 +1,29 @@
+from __future__ import with_statement
+import threading
+
+# Thread safe map of pending writes pushed to GSheet on a timer, only the latest value of each key is kept
+class CoalescingMap():
+    items = {}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+
+    def setIfAbsent(self, key, value):
+        """Used to put back values of a failed flush without overwriting newer ones"""
+        with self.lock:
+            self.items.setdefault(key, value)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.items.get(key, default)
+
+    def popAll(self):
+        with self.lock:
+            itemsToReturn = self.items
+            self.items = {}
+        return itemsToReturn
\ No newline at end of file
@@ -1,22 +1,50 @@
 from __future__ import with_statement
+from collections import deque
 import threading
 
-# Thread safe list of tracker data pushed to GSheet in batches
+# Thread safe queue of tracker data pushed to GSheet in batches. Items are sequences of values, like a tracker row and its journal sequence.
 class ConcurrentList():
-    items = []
-    number_of_items_in_batch = 49
+    items = None
+    number_of_items_in_batch = 50
+    high_water_mark = 0
+    on_high_water_mark = None
 
-    def __init__(self, numberOfItemsInBatch):
+    def __init__(self, numberOfItemsInBatch, highWaterMark=0, onHighWaterMark=None):
         self.lock = threading.Lock()
-        self.items = []
-        self.number_of_items_in_batch = numberOfItemsInBatch - 1    # index based so subtract 1
+        self.items = deque()
+        self.number_of_items_in_batch = numberOfItemsInBatch
+        # onHighWaterMark is called whenever an add leaves highWaterMark or more items in the list
+        self.high_water_mark = highWaterMark
+        self.on_high_water_mark = onHighWaterMark
 
     def add(self, item):
         with self.lock:
             self.items.append(item)
+            isAboveHighWaterMark = self.high_water_mark > 0 and len(self.items) >= self.high_water_mark
+        if isAboveHighWaterMark and self.on_high_water_mark is not None:
+            self.on_high_water_mark()
 
     def getAll(self):
+        return self.getBatch(self.number_of_items_in_batch)
+
+    def getBatch(self, maxItems, maxBytes=0):
+        """Remove and return up to maxItems from the front, and no more than maxBytes of data (approximated by its text length) if given"""
+        itemsToReturn = []
+        batchBytes = 0
+        with self.lock:
+            while len(self.items) > 0 and len(itemsToReturn) < maxItems:
+                if maxBytes > 0:
+                    batchBytes += sum(len(str(value)) for value in self.items[0]) + 8
+                    if batchBytes > maxBytes and len(itemsToReturn) > 0:
+                        break
+                itemsToReturn.append(self.items.popleft())
+        return itemsToReturn
+
+    def putBack(self, items):
+        """Return items of a failed batch to the front, keeping their order"""
+        with self.lock:
+            self.items.extendleft(reversed(items))
+
+    def getDepth(self):
         with self.lock:
-            itemsToReturn = self.items[:self.number_of_items_in_batch]
-            del self.items[:self.number_of_items_in_batch]
-        return itemsToReturn
\ No newline at end of file
+            return len(self.items)
\ No newline at end of file
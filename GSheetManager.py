@@ -1,23 +1,50 @@
 # importing the required libraries
 import gspread
 from datetime import datetime, timedelta
-from dateutil import parser
+from contextlib import nullcontext
 import threading
+import atexit
+import os
+import socket
 import json
+import re
+import hashlib
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from ConcurrentList import ConcurrentList
+from CoalescingMap import CoalescingMap
+from ManagerRotationIndex import ManagerRotationIndex
+from TicketState import TicketState
+from GSheetStateStore import GSheetStateStore
+from SQLiteStateStore import SQLiteStateStore
+from MirroredStateStore import MirroredStateStore
+from ClusterStore import ClusterStore
+from StateSnapshot import StateSnapshot
+from TrackerAnalytics import TrackerAnalytics
+from RateLimiter import RateLimiter, DeadlineExceededError
+from InstrumentedLock import InstrumentedLock
 
 class GSheetManager:
     # Hardcoded
     MAIN_GSHEET_NAME = 'Shift Automation'
     SHEET_NAME_CONFIGURATION = 'Configuration'
+    SNAPSHOT_FILE_NAME = 'rcabot-snapshot.json'
 
-    # Ticket State sheet column headers to get respective values from Dictionary
-    TICKET_ID_COL = 'Ticket'
-    THREAD_ID_COL = 'Thread ID'
-    MESSAGE_ID_COL = 'Message ID'
-    MANAGER_ID_COL = 'Manager GChat ID'
-    MANAGER_NAME_COL = 'Manager Name'
+    # Possible state backends
+    STATEBACKEND_GSHEET = 'GSheet'
+    STATEBACKEND_SQLITE = 'SQLite'
+
+    # Possible deployment modes. In Clustered mode ticket states, dnd timestamps, rotation and timers are shared by all processes.
+    DEPLOYMENTMODE_STANDALONE = 'Standalone'
+    DEPLOYMENTMODE_CLUSTERED = 'Clustered'
+
+    # Tracker rows per append request are also limited by size, well below the Sheets request payload limit
+    TRACKER_MAX_BATCH_BYTES = 2000000
+    TRACKER_FLUSH_MIN_BACKOFF = 1.0
+    TRACKER_FLUSH_MAX_BACKOFF = 300.0
+
+    # State store writes of the same ticket or manager are serialized on one of these locks, so they reach the store in order
+    NUMBER_OF_ORDERING_LOCKS = 64
     
     # Configuration sheet column headers to get respective values from Dictionary
     CONFIGURATION_SPACEID_COL = 'SpaceId'
@@ -35,6 +62,34 @@ class GSheetManager:
     CONFIGURATION_SHEETNAME_TICKETSTATE_COL = 'TicketStateSheetName'
     CONFIGURATION_SHEETNAME_MANAGERSTATE_COL = 'ManagerStateSheetName'
     CONFIGURATION_SHEETNAME_TRACKER_COL = 'TrackerSheetName'
+    CONFIGURATION_NUMBEROFTIMEOUTWORKERS_COL = 'NumberOfTimeoutWorkers'
+    CONFIGURATION_TIMEOUTDISPATCHMODE_COL = 'TimeoutDispatchMode'
+    CONFIGURATION_CHATCONNECTIONPOOLSIZE_COL = 'ChatConnectionPoolSize'
+    CONFIGURATION_CHATREQUESTTIMEOUT_COL = 'ChatRequestTimeout'
+    CONFIGURATION_STATEBACKEND_COL = 'StateBackend'
+    CONFIGURATION_SQLITEDATABASEPATH_COL = 'SQLiteDatabasePath'
+    CONFIGURATION_TRACKERHIGHWATERMARK_COL = 'TrackerHighWaterMark'
+    CONFIGURATION_EVENTPROCESSINGMODE_COL = 'EventProcessingMode'
+    CONFIGURATION_NUMBEROFEVENTWORKERS_COL = 'NumberOfEventWorkers'
+    CONFIGURATION_EVENTQUEUESIZE_COL = 'EventQueueSize'
+    CONFIGURATION_DEPLOYMENTMODE_COL = 'DeploymentMode'
+    CONFIGURATION_CLUSTERDATABASEPATH_COL = 'ClusterDatabasePath'
+    CONFIGURATION_CLUSTERLEASEDURATION_COL = 'ClusterLeaseDuration'
+    CONFIGURATION_CLUSTERTIMERPOLLINTERVAL_COL = 'ClusterTimerPollInterval'
+    CONFIGURATION_SNAPSHOTINTERVAL_COL = 'SnapshotInterval'
+    CONFIGURATION_SHEETWRITEWINDOW_COL = 'SheetWriteWindow'
+    CONFIGURATION_SHEETSREQUESTSPERMINUTE_COL = 'SheetsRequestsPerMinute'
+    CONFIGURATION_CHATREQUESTSPERMINUTE_COL = 'ChatRequestsPerMinute'
+    CONFIGURATION_APIMAXATTEMPTS_COL = 'APIMaxAttempts'
+    CONFIGURATION_REQUESTDEADLINE_COL = 'RequestDeadline'
+    CONFIGURATION_IDEMPOTENCYTTL_COL = 'IdempotencyTTL'
+    CONFIGURATION_IDEMPOTENCYCACHESIZE_COL = 'IdempotencyCacheSize'
+    CONFIGURATION_BULKINTAKEBATCHSIZE_COL = 'BulkIntakeBatchSize'
+    CONFIGURATION_TENANTSPREADSHEETS_COL = 'TenantSpreadsheets'
+    CONFIGURATION_JOURNALPATH_COL = 'JournalPath'
+
+    # Type of the journal records of tracker rows
+    JOURNALRECORD_TRACKER = 'Tracker'
     
     # Configurable Parameters loaded from GSheet Configuration
     sheet_name_managers = 'Managers'
@@ -52,71 +107,364 @@ class GSheetManager:
     shift2_start_time = 6
     shift3_start_time = 12
     shift4_start_time = 18
+    number_of_timeout_workers = 4
+    timeout_dispatch_mode = 'InProcess'
+    chat_connection_pool_size = 4
+    chat_request_timeout = 30
+    state_backend = STATEBACKEND_GSHEET
+    sqlite_database_path = 'rcabot.db'
+    tracker_high_water_mark = 500
+    event_processing_mode = 'Sync'
+    number_of_event_workers = 4
+    event_queue_size = 1000
+    deployment_mode = DEPLOYMENTMODE_STANDALONE
+    cluster_database_path = 'rcabot-cluster.db'
+    cluster_lease_duration = 60.0
+    cluster_timer_poll_interval = 1.0
+    snapshot_interval = 300.0
+    sheet_write_window = 0.2
+    sheets_requests_per_minute = 60
+    chat_requests_per_minute = 60
+    api_max_attempts = 5
+    request_deadline = 25.0
+    idempotency_ttl = 600.0
+    idempotency_cache_size = 10000
+    bulk_intake_batch_size = 50
+    tenant_spreadsheets = []
+    journal_path = ''
 
     # Class variables
+    spreadsheet_name = MAIN_GSHEET_NAME
+    client = None
+    sheets_rate_limiter = None
+    is_sheets_rate_limiter_shared = False
+    spreadsheet = None
+    configuration_map = {}
     sheet_configuration = None
     sheet_managers = None
-    sheet_statemanagement = None
-    sheet_ticketstatemanagement = None
-    sheet_tracker = None
-    sheet_managerstate = None
     list_of_tracker_data = None
+    # Seconds till the next retry while tracker flushes fail, 0 when the last one succeeded
+    tracker_flush_backoff = 0
+
+    # Rolling aggregates of tracker data added since start
+    tracker_analytics = None
+
+    # Journal of the process, tracker rows are journaled till they are written to the Tracker sheet. None if not journaled.
+    transition_journal = None
+
+    # Persistence of ticket states, manager states, rotation rows and tracker data
+    state_store = None
+
+    # Shared state store of a clustered deployment, None otherwise. node_id identifies this process in the cluster.
+    cluster_store = None
+    node_id = ''
 
-    # Local cache of ticket states
+    # Local cache of ticket states. Records are never modified in place, an update swaps in a new record.
     ticket_to_ticketState_map = {}
 
-    # Local cache of all manager data
-    list_of_managers = []
+    # New tickets being taken in, till their state is appended or they are put on timer
+    tickets_in_intake = set()
+
+    # Hash of the rows of the Managers sheet the rotation index was built from, a reload that finds the same rows does nothing.
+    # The rows themselves are not kept, the rotation index holds what is used of them.
+    managers_hash = None
+
+    # Called with ids of managers removed from the Managers sheet on reload
+    on_managers_removed = None
 
     # Manager Last Activity Timestamp tracker to help recognize managers in dnd
     manager_last_interaction_time_map = {}
 
+    # Per shift rotation of managers built from the Managers sheet, to pick next manager without scanning the sheet data
+    manager_rotation_index = None
+
     # Local cache of last row of manager for current shift and current shift
     last_manager_row_number_cached = 0
     current_shift_cached = 0
+
+    # Last row of manager of every shift keyed by StateManagement column, loaded once and kept up to date locally
+    rotation_row_number_by_column = {}
+
+    # Rotation row updates not yet written to StateManagement sheet, flushed on a timer
+    pending_rotation_updates = None
+
+    # After a start from the local snapshot, the state store is only available once the sheets are reconciled.
+    # Tickets changed till then keep their local state over the one loaded from the sheets, and the state store writes
+    # made till then are kept in order and sent once it is available. Both are None after a start from the sheets.
+    state_snapshot = None
+    state_store_ready = None
+    tickets_changed_before_reconcile = None
+    state_writes_before_reconcile = None
+
+    # Flushes, reloads and the reconcile run on the timer scheduler shared by all spreadsheets, so a spreadsheet has no threads of its own.
+    # Set when the spreadsheet is abandoned by a failed start, its timers then end.
+    timer_scheduler = None
+    stop_event = None
+    timer_keys = set()
     logger = None
 
-    def __init__(self, logger, credentials):
-        # Required for keeping GSheet operations thread safe
-        self.lock = threading.Lock()
+    def __init__(self, logger, credentials, timerScheduler, spreadsheetName=MAIN_GSHEET_NAME, client=None, sheetsRateLimiter=None):
+        """Every tenant has its own spreadsheet, a copy of the Shift Automation GSheet. The client and the Sheets rate limiter of
+        the main spreadsheet are passed to the other tenants, as they share the connections and quota of the service account."""
+        # Locks only guard in-memory state and are never held during a network call.
+        # ticket_lock guards ticket states, manager_lock guards managers, their dnd timestamps and the rotation.
+        self.ticket_lock = InstrumentedLock('GSheetManager.ticket_lock')
+        self.manager_lock = InstrumentedLock('GSheetManager.manager_lock')
+        self.ordering_locks = [InstrumentedLock('GSheetManager.ordering_lock') for i in range(self.NUMBER_OF_ORDERING_LOCKS)]
         self.logger = logger
+        self.spreadsheet_name = spreadsheetName
+        self.configuration_map = {}
+        self.managers_hash = None
+        self.tenant_spreadsheets = []
+        self.ticket_to_ticketState_map = {}
+        self.tickets_in_intake = set()
+        self.manager_last_interaction_time_map = {}
+        self.rotation_row_number_by_column = {}
+        self.state_store_ready = threading.Event()
+        self.tickets_changed_before_reconcile = None
+        self.state_writes_before_reconcile = None
+        self.state_write_buffer_lock = threading.Lock()
+        self.timer_scheduler = timerScheduler
+        self.stop_event = threading.Event()
+        self.timer_keys = set()
+
+        # Local files of other tenants are named after their spreadsheet, unless configured otherwise
+        self.sqlite_database_path = self.get_tenant_file_path(self.sqlite_database_path)
+        self.cluster_database_path = self.get_tenant_file_path(self.cluster_database_path)
 
         # authorize the clientsheet 
-        client = gspread.authorize(credentials)
-
-        # get the instance of the Spreadsheet
-        sheet = client.open(self.MAIN_GSHEET_NAME)
-
-        # get the Configurations sheet and load configuration
-        self.sheet_configuration = sheet.worksheet(self.SHEET_NAME_CONFIGURATION)
-        self.load_configuration()
-
-        self.list_of_tracker_data = ConcurrentList(self.number_of_items_in_batch)
-
-        self.sheet_managers = sheet.worksheet(self.sheet_name_managers)
-
-        self.sheet_statemanagement = sheet.worksheet(self.sheet_name_statemanagement)
-
-        self.sheet_ticketstatemanagement = sheet.worksheet(self.sheet_name_ticketstate)
-
-        self.sheet_managerstate = sheet.worksheet(self.sheet_name_managerstate)
+        self.client = gspread.authorize(credentials) if client is None else client
+        # Shared by all Sheets requests, started with default quota till configuration is loaded
+        self.is_sheets_rate_limiter_shared = sheetsRateLimiter is not None
+        self.sheets_rate_limiter = RateLimiter(logger, 'Sheets', self.sheets_requests_per_minute, self.api_max_attempts) if sheetsRateLimiter is None else sheetsRateLimiter
+
+        # Start serving from the local snapshot if there is one, the sheets are then loaded by reconcile_in_background
+        self.state_snapshot = StateSnapshot(self.get_tenant_file_path(self.SNAPSHOT_FILE_NAME))
+        snapshot = None
+        try:
+            snapshot = self.state_snapshot.load()
+        except:
+            self.logger.error("Error in loading snapshot in GSheetManager: " + traceback.format_exc())
+
+        if snapshot is not None:
+            self.apply_configuration(snapshot['configuration'])
+            # Clustered deployments start from the cluster database, which is as quick to load as the snapshot
+            if self.deployment_mode == self.DEPLOYMENTMODE_CLUSTERED:
+                snapshot = None
+        if snapshot is None:
+            self.open_spreadsheet()
+            self.load_configuration()
 
-        self.sheet_tracker = sheet.worksheet(self.sheet_name_tracker)
+        self.tracker_flush_lock = threading.Lock()
+        self.tracker_flush_backoff = 0
+        self.tracker_analytics = TrackerAnalytics()
+        self.list_of_tracker_data = ConcurrentList(self.number_of_items_in_batch, self.tracker_high_water_mark, self.request_tracker_flush)
+        self.pending_rotation_updates = CoalescingMap()
 
-        self.initialize_maps()
-        
-        self.flush_data_to_tracker_on_timer()
-        self.reload_manager_data_on_timer()
+        if snapshot is None:
+            self.initialize_maps(*self.load_state_from_sheets())
+            self.start_background_tasks()
+        else:
+            self.tickets_changed_before_reconcile = set()
+            self.state_writes_before_reconcile = []
+            self.initialize_maps(snapshot['rotationRows'], snapshot['managerStates'], snapshot['managers'], snapshot['managersHash'], snapshot['ticketStates'])
+
+        # Pending rotation and tracker writes are flushed when the process exits so the rotation position survives restarts
+        atexit.register(self.flush_pending_writes)
+
+    def get_tenant_file_path(self, path):
+        """Path of a local file of this tenant. The main spreadsheet keeps the path as is, others add their spreadsheet name to it."""
+        if self.spreadsheet_name == self.MAIN_GSHEET_NAME:
+            return path
+        pathWithoutExtension, extension = os.path.splitext(path)
+        return pathWithoutExtension + '-' + re.sub(r'[^A-Za-z0-9_-]', '_', self.spreadsheet_name) + extension
+
+    def open_spreadsheet(self):
+        """Open the tenant's Shift Automation GSheet and get all its worksheets in a single request"""
+        self.spreadsheet = self.sheets_rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.client.open, self.spreadsheet_name)
+        self.worksheets = { worksheet.title: worksheet for worksheet in self.sheets_rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.spreadsheet.worksheets) }
+        self.sheet_configuration = self.worksheets[self.SHEET_NAME_CONFIGURATION]
+
+    def load_state_from_sheets(self):
+        """Create the state store and load rotation rows, manager states, managers and ticket states from it in parallel.
+        Returns the loaded values in that order, with managers parsed by shift and followed by the hash of their rows."""
+        self.sheet_managers = self.worksheets[self.sheet_name_managers]
+        self.state_store = self.create_state_store(self.worksheets)
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix='SheetLoader') as executor:
+            rotationRowNumberByColumn = executor.submit(self.state_store.load_rotation_rows)
+            managerStates = executor.submit(self.state_store.load_manager_states)
+            listOfManagers = executor.submit(self.sheets_rate_limiter.call, RateLimiter.PRIORITY_TICKETSTATE, self.sheet_managers.get_all_values)
+            ticketStates = executor.submit(self.state_store.load_ticket_states)
+        listOfManagers = listOfManagers.result()
+        return rotationRowNumberByColumn.result(), managerStates.result(), ManagerRotationIndex.parse_managers(listOfManagers), self.get_managers_hash(listOfManagers), ticketStates.result()
+
+    def get_managers_hash(self, listOfManagers):
+        """Content hash of the rows of the Managers sheet, so a reload can tell they changed without keeping them"""
+        return hashlib.sha256(json.dumps(listOfManagers).encode()).hexdigest()
+
+    def start_background_tasks(self):
+        """State store is ready, start the timers that flush to it and reload from it"""
+        self.state_store_ready.set()
+        self.start_timer(self.time_for_tracker_data_flush, self.flush_data_to_tracker_on_timer)
+        self.flush_rotation_state_on_timer()
+        self.start_timer(self.time_for_manager_data_reload, self.reload_manager_data_on_timer)
+        self.save_snapshot_on_timer()
+
+    def reconcile_in_background(self, onTicketStatesReconciled):
+        """After a start from the snapshot, load the sheets in the background and bring local state up to date with them.
+        onTicketStatesReconciled(removedRecords, addedRecords) is called with the ticket states that changed. Nothing is done after a start from the sheets."""
+        if self.state_store_ready.is_set():
+            return
+        self.start_timer(0, self.reconcile_with_sheets, onTicketStatesReconciled, self.TRACKER_FLUSH_MIN_BACKOFF)
+
+    def reconcile_with_sheets(self, onTicketStatesReconciled, backoffTime):
+        """Runs on the timer worker pool, retried with backoff till the sheets are loaded. The state store is unavailable till then."""
+        try:
+            self.open_spreadsheet()
+            self.load_configuration()
+            rotationRowNumberByColumn, managerStates, managerEntriesByShift, managersHash, ticketStates = self.load_state_from_sheets()
+        except:
+            self.logger.error(f"Error in reconcile_with_sheets, retrying in {backoffTime} seconds: {traceback.format_exc()}")
+            self.start_timer(backoffTime, self.reconcile_with_sheets, onTicketStatesReconciled, min(backoffTime * 2, self.TRACKER_FLUSH_MAX_BACKOFF))
+            return
+        if self.stop_event.is_set():
+            self.state_store.stop()
+            return
+
+        with self.manager_lock:
+            self.managers_hash = managersHash
+            for managerId, timestamp in managerStates.items():
+                if managerId not in self.manager_last_interaction_time_map or self.manager_last_interaction_time_map[managerId] < timestamp:
+                    self.manager_last_interaction_time_map[managerId] = timestamp
+            # Rotation rows changed since start are not flushed yet and are newer
+            for column, rowNumber in rotationRowNumberByColumn.items():
+                if self.pending_rotation_updates.get(column) is None:
+                    self.rotation_row_number_by_column[column] = rowNumber
+            self.current_shift_cached = 0
+            self.rebuild_manager_rotation_index(managerEntriesByShift)
+
+        with self.ticket_lock:
+            oldTicketStates = self.ticket_to_ticketState_map
+            newTicketStates = { record.jira_id: record for record in ticketStates }
+            for jiraId in self.tickets_changed_before_reconcile:
+                if jiraId in oldTicketStates:
+                    newTicketStates[jiraId] = oldTicketStates[jiraId]
+                else:
+                    newTicketStates.pop(jiraId, None)
+            self.ticket_to_ticketState_map = newTicketStates
+            self.tickets_changed_before_reconcile = None
+        removedRecords = [record for jiraId, record in oldTicketStates.items() if jiraId not in newTicketStates]
+        addedRecords = [record for jiraId, record in newTicketStates.items() if jiraId not in oldTicketStates]
+
+        # Writes are sent in the order they were made, later writes wait till they are all queued
+        with self.state_write_buffer_lock:
+            for methodName, args in self.state_writes_before_reconcile:
+                try:
+                    getattr(self.state_store, methodName)(*args)
+                except:
+                    self.logger.error(f"Error in {methodName} made before reconcile_with_sheets: {traceback.format_exc()}")
+            self.state_writes_before_reconcile = None
+        self.start_background_tasks()
+        try:
+            onTicketStatesReconciled(removedRecords, addedRecords)
+        except:
+            self.logger.error("Error in reconcile_with_sheets: " + traceback.format_exc())
+
+    def get_state_store(self):
+        """State store for reads, waits for it up to RequestDeadline while the sheets are reconciled after a start from the snapshot.
+        Raises DeadlineExceededError if it is not available by then."""
+        if not self.state_store_ready.wait(self.request_deadline):
+            raise DeadlineExceededError(f"State store of {self.spreadsheet_name} not loaded from the sheets yet")
+        return self.state_store
+
+    def write_state(self, methodName, *args):
+        """Call a write method of the state store. Before the sheets are reconciled after a start from the snapshot,
+        the write is kept and sent once they are, so requests do not wait for the sheets."""
+        with self.state_write_buffer_lock:
+            if self.state_writes_before_reconcile is not None:
+                self.state_writes_before_reconcile.append((methodName, args))
+                return
+        getattr(self.state_store, methodName)(*args)
+
+    def hold_state_writes(self):
+        """Context manager, state store writes made in the with block are sent together. Writes kept till the sheets
+        are reconciled are sent together anyway."""
+        with self.state_write_buffer_lock:
+            if self.state_writes_before_reconcile is not None:
+                return nullcontext()
+        return self.state_store.hold_writes()
+
+    def call_when_state_written(self, callback):
+        """Call callback once the state store writes made so far are stored, e.g. to mark a journaled transition done"""
+        self.write_state('call_when_written', callback)
+
+    def record_ticket_change(self, jiraId):
+        """Keep track of tickets changed before the sheets are reconciled. Should be called holding the ticket lock."""
+        if self.tickets_changed_before_reconcile is not None:
+            self.tickets_changed_before_reconcile.add(jiraId)
+
+    def create_state_store(self, worksheets):
+        """State is kept in GSheet by default. With SQLite backend, a local database is the primary store and GSheet is an asynchronous mirror.
+        In Clustered mode, state is kept in the shared cluster database and only tracker data goes to GSheet."""
+        gSheetStateStore = GSheetStateStore(self.spreadsheet, worksheets, self.sheet_name_statemanagement, self.sheet_name_ticketstate, self.sheet_name_managerstate, self.sheet_name_tracker, self.logger, self.sheets_rate_limiter, self.timer_scheduler, self.sheet_write_window)
+        if self.deployment_mode == self.DEPLOYMENTMODE_CLUSTERED:
+            self.node_id = f"{socket.gethostname()}-{os.getpid()}"
+            clusterStore = ClusterStore(self.cluster_database_path, gSheetStateStore)
+            clusterStore.seed_if_empty(gSheetStateStore.load_ticket_states(), gSheetStateStore.load_manager_states(), gSheetStateStore.load_rotation_rows())
+            self.cluster_store = clusterStore
+            return clusterStore
+
+        if self.state_backend != self.STATEBACKEND_SQLITE:
+            return gSheetStateStore
+
+        sqliteStateStore = SQLiteStateStore(self.sqlite_database_path)
+        # Mirror needs its row index loaded before any write. A seeded database is served right away and the mirror loads in the background.
+        if not sqliteStateStore.is_empty():
+            return MirroredStateStore(self.logger, sqliteStateStore, gSheetStateStore, self.timer_scheduler, False)
+        # A new database is seeded with the state loaded from GSheet, which loads the row index of the mirror too
+        ticketStates = gSheetStateStore.load_ticket_states()
+        managerStates = gSheetStateStore.load_manager_states()
+        for record in ticketStates:
+            sqliteStateStore.append_ticket_state(record.jira_id, record.manager_id, record.manager_name, record.thread_id, record.message_id)
+        for managerId, timestamp in managerStates.items():
+            sqliteStateStore.save_manager_state(managerId, timestamp)
+        sqliteStateStore.save_rotation_rows(gSheetStateStore.load_rotation_rows())
+        return MirroredStateStore(self.logger, sqliteStateStore, gSheetStateStore, self.timer_scheduler)
+
+    def start_timer(self, interval, function, *args):
+        """Call function(*args) after interval seconds on the shared timer scheduler. Each function has one timer at a time,
+        its key is kept so it can be cancelled by stop."""
+        if self.stop_event.is_set():
+            return
+        timerKey = self.get_timer_key(function.__name__)
+        self.timer_keys.add(timerKey)
+        self.timer_scheduler.schedule(timerKey, interval, function, *args)
+        # Cancelled here if stop ran meanwhile and missed it
+        if self.stop_event.is_set():
+            self.timer_scheduler.cancel(timerKey)
+
+    def get_timer_key(self, timerName):
+        """Key of a timer of this spreadsheet in the timer scheduler, which is shared with other tenants and their ticket timers"""
+        return (self.spreadsheet_name, ('GSheetManager', timerName))
 
     def reload_configuration_during_runtime(self):
         """Some configurations can be changed during runtime without need of application restart"""
-        with self.lock:
-            self.load_configuration()
+        self.get_state_store()
+        self.load_configuration()
+        with self.manager_lock:
+            self.rebuild_manager_rotation_index()
 
     def load_configuration(self):
         """Load all configuration from sheet to local values"""
         try:
-            configurationMap = self.sheet_configuration.get_all_records()[0]
+            self.apply_configuration(self.sheets_rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.sheet_configuration.get_all_records)[0])
+        except:
+            self.logger.error("Error in load_configuration in GSheetManager: " + traceback.format_exc())
+
+    def apply_configuration(self, configurationMap):
+        """Set local values from a row of Configuration sheet"""
+        self.configuration_map = configurationMap
+        try:
             self.sheet_name_managers = configurationMap[self.CONFIGURATION_SHEETNAME_MANAGERS_COL]
             self.sheet_name_statemanagement = configurationMap[self.CONFIGURATION_SHEETNAME_STATEMANAGEMENT_COL]
             self.sheet_name_ticketstate = configurationMap[self.CONFIGURATION_SHEETNAME_TICKETSTATE_COL]
@@ -132,100 +480,188 @@ class GSheetManager:
             self.shift2_start_time = configurationMap[self.CONFIGURATION_SHIFT2STARTTIME_COL]
             self.shift3_start_time = configurationMap[self.CONFIGURATION_SHIFT3STARTTIME_COL]
             self.shift4_start_time = configurationMap[self.CONFIGURATION_SHIFT4STARTTIME_COL]
+            # Optional parameters, defaults are kept if the column is not present in Configuration sheet
+            self.number_of_timeout_workers = configurationMap.get(self.CONFIGURATION_NUMBEROFTIMEOUTWORKERS_COL, self.number_of_timeout_workers)
+            self.timeout_dispatch_mode = configurationMap.get(self.CONFIGURATION_TIMEOUTDISPATCHMODE_COL, self.timeout_dispatch_mode)
+            self.chat_connection_pool_size = configurationMap.get(self.CONFIGURATION_CHATCONNECTIONPOOLSIZE_COL, self.chat_connection_pool_size)
+            self.chat_request_timeout = configurationMap.get(self.CONFIGURATION_CHATREQUESTTIMEOUT_COL, self.chat_request_timeout)
+            self.state_backend = configurationMap.get(self.CONFIGURATION_STATEBACKEND_COL, self.state_backend)
+            self.sqlite_database_path = configurationMap.get(self.CONFIGURATION_SQLITEDATABASEPATH_COL, self.sqlite_database_path)
+            self.tracker_high_water_mark = configurationMap.get(self.CONFIGURATION_TRACKERHIGHWATERMARK_COL, self.tracker_high_water_mark)
+            self.event_processing_mode = configurationMap.get(self.CONFIGURATION_EVENTPROCESSINGMODE_COL, self.event_processing_mode)
+            self.number_of_event_workers = configurationMap.get(self.CONFIGURATION_NUMBEROFEVENTWORKERS_COL, self.number_of_event_workers)
+            self.event_queue_size = configurationMap.get(self.CONFIGURATION_EVENTQUEUESIZE_COL, self.event_queue_size)
+            self.deployment_mode = configurationMap.get(self.CONFIGURATION_DEPLOYMENTMODE_COL, self.deployment_mode)
+            self.cluster_database_path = configurationMap.get(self.CONFIGURATION_CLUSTERDATABASEPATH_COL, self.cluster_database_path)
+            self.cluster_lease_duration = configurationMap.get(self.CONFIGURATION_CLUSTERLEASEDURATION_COL, self.cluster_lease_duration)
+            self.cluster_timer_poll_interval = configurationMap.get(self.CONFIGURATION_CLUSTERTIMERPOLLINTERVAL_COL, self.cluster_timer_poll_interval)
+            self.snapshot_interval = configurationMap.get(self.CONFIGURATION_SNAPSHOTINTERVAL_COL, self.snapshot_interval)
+            self.sheet_write_window = configurationMap.get(self.CONFIGURATION_SHEETWRITEWINDOW_COL, self.sheet_write_window)
+            self.sheets_requests_per_minute = configurationMap.get(self.CONFIGURATION_SHEETSREQUESTSPERMINUTE_COL, self.sheets_requests_per_minute)
+            self.chat_requests_per_minute = configurationMap.get(self.CONFIGURATION_CHATREQUESTSPERMINUTE_COL, self.chat_requests_per_minute)
+            self.api_max_attempts = configurationMap.get(self.CONFIGURATION_APIMAXATTEMPTS_COL, self.api_max_attempts)
+            self.request_deadline = configurationMap.get(self.CONFIGURATION_REQUESTDEADLINE_COL, self.request_deadline)
+            self.idempotency_ttl = configurationMap.get(self.CONFIGURATION_IDEMPOTENCYTTL_COL, self.idempotency_ttl)
+            self.idempotency_cache_size = configurationMap.get(self.CONFIGURATION_IDEMPOTENCYCACHESIZE_COL, self.idempotency_cache_size)
+            self.bulk_intake_batch_size = configurationMap.get(self.CONFIGURATION_BULKINTAKEBATCHSIZE_COL, self.bulk_intake_batch_size)
+            tenantSpreadsheets = configurationMap.get(self.CONFIGURATION_TENANTSPREADSHEETS_COL, ','.join(self.tenant_spreadsheets))
+            self.tenant_spreadsheets = [spreadsheetName.strip() for spreadsheetName in str(tenantSpreadsheets).split(',') if spreadsheetName.strip() != '']
+            self.journal_path = configurationMap.get(self.CONFIGURATION_JOURNALPATH_COL, self.journal_path)
+            # A shared rate limiter follows the configuration of the main spreadsheet only
+            if not self.is_sheets_rate_limiter_shared:
+                self.sheets_rate_limiter.update_rate(self.sheets_requests_per_minute)
+                self.sheets_rate_limiter.max_attempts = self.api_max_attempts
         except:
-            self.logger.error("Error in load_configuration in GSheetManager: " + traceback.format_exc())
+            self.logger.error("Error in apply_configuration in GSheetManager: " + traceback.format_exc())
 
     def reload_manager_data_on_timer(self):
         """Manager data to be loaded from sheet on a timer in case of any change"""
-        threading.Timer(self.time_for_manager_data_reload, self.reload_manager_data_on_timer).start()
+        self.start_timer(self.time_for_manager_data_reload, self.reload_manager_data_on_timer)
         try:
             self.reload_manager_data_during_runtime()
+            self.state_store.compact()
         except:
             self.logger.error("Error in reload_manager_data_on_timer in GSheetManager: " + traceback.format_exc())
 
     def reload_manager_data_during_runtime(self):
-        """Manager data from sheets can be loaded manually during runtime in case of any changes"""
-        with self.lock:
-            self.list_of_managers = self.sheet_managers.get_all_values()
+        """Manager data from sheets can be loaded manually during runtime in case of any changes.
+        Nothing is done if it is unchanged, otherwise only the shifts that changed are indexed again.
+        Returns ids of managers removed from the sheet, their tickets are handed to on_managers_removed."""
+        self.get_state_store()
+        listOfManagers = self.sheets_rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.sheet_managers.get_all_values)
+        managersHash = self.get_managers_hash(listOfManagers)
+        with self.manager_lock:
+            if managersHash == self.managers_hash:
+                return set()
+            self.managers_hash = managersHash
+            removedManagerIds = self.manager_rotation_index.update_managers(ManagerRotationIndex.parse_managers(listOfManagers))
+        if len(removedManagerIds) > 0 and self.on_managers_removed is not None:
+            self.on_managers_removed(removedManagerIds)
+        return removedManagerIds
+
+    def set_on_managers_removed(self, onManagersRemoved):
+        """onManagersRemoved(managerIds) is called when a reload finds managers removed from the Managers sheet"""
+        self.on_managers_removed = onManagersRemoved
+
+    def rebuild_manager_rotation_index(self, managerEntriesByShift=None):
+        """Rebuild rotation index from manager data and dnd timestamps, with the managers of the current index if no manager data is given.
+        Should be called holding the manager lock."""
+        if managerEntriesByShift is None:
+            managerEntriesByShift = self.manager_rotation_index.get_manager_entries()
+        self.manager_rotation_index = ManagerRotationIndex(managerEntriesByShift, self.manager_last_interaction_time_map, self.manager_dnd_time)
 
     def reload_ticket_state_during_runtime(self):
-        """Ticket state from sheets can be loaded manually during runtime in case of any changes"""
-        with self.lock:
-            dictionaryOfAllRecords = self.sheet_ticketstatemanagement.get_all_records()
-            removedRecords = self.ticket_to_ticketState_map.copy()
-            self.ticket_to_ticketState_map.clear()
-            for record in dictionaryOfAllRecords:
-                jiraId = record[self.TICKET_ID_COL]
-                self.ticket_to_ticketState_map[jiraId] = record
-                removedRecords.pop(jiraId, None)
-            return removedRecords.values(), dictionaryOfAllRecords
-
-    def initialize_maps(self):
+        """Ticket state from the state store can be loaded manually during runtime in case of any changes.
+        Returns the records removed and added, a ticket moved to another manager is in both with its old and new record."""
+        dictionaryOfAllRecords = self.get_state_store().load_ticket_states()
+        with self.ticket_lock:
+            oldTicketStates = self.ticket_to_ticketState_map
+            self.load_ticket_state_records(dictionaryOfAllRecords)
+            newTicketStates = self.ticket_to_ticketState_map
+        removedRecords = [record for jiraId, record in oldTicketStates.items() if not record.is_same_assignment(newTicketStates.get(jiraId))]
+        addedRecords = [record for jiraId, record in newTicketStates.items() if not record.is_same_assignment(oldTicketStates.get(jiraId))]
+        return removedRecords, addedRecords
+
+    def load_ticket_state_records(self, dictionaryOfAllRecords):
+        """Rebuild ticket state map from all ticket state records. Should be called holding the ticket lock. Returns the loaded records."""
+        self.ticket_to_ticketState_map = { record.jira_id: record for record in dictionaryOfAllRecords }
+        return dictionaryOfAllRecords
+
+    def initialize_maps(self, rotationRowNumberByColumn, managerStates, managerEntriesByShift, managersHash, dictionaryOfAllRecords):
         """Load all data into local lists and maps to reduce overhead of interacting with GSheets"""
         try:
-            listOfManagerState = self.sheet_managerstate.get_all_values()
-            for managerState in listOfManagerState[1:]:
-                self.manager_last_interaction_time_map[managerState[0]] = parser.parse(managerState[1])
-            self.list_of_managers = self.sheet_managers.get_all_values()
-            dictionaryOfAllRecords = self.sheet_ticketstatemanagement.get_all_records()
-            self.ticket_to_ticketState_map.clear()
-            for record in dictionaryOfAllRecords:
-                self.ticket_to_ticketState_map[record[self.TICKET_ID_COL]] = record
+            with self.manager_lock:
+                self.rotation_row_number_by_column = rotationRowNumberByColumn
+                self.manager_last_interaction_time_map.update(managerStates)
+                self.managers_hash = managersHash
+                self.rebuild_manager_rotation_index(managerEntriesByShift)
+            with self.ticket_lock:
+                self.load_ticket_state_records(dictionaryOfAllRecords)
         except:
             self.logger.error("Error in initialize_maps in GSheetManager: " + traceback.format_exc())
 
     def get_ticket_states_map(self):
         """Get a copy of the ticket state dictionary"""
-        with self.lock:
+        if self.cluster_store is not None:
+            return { record.jira_id: record for record in self.cluster_store.load_ticket_states() }
+        with self.ticket_lock:
             return self.ticket_to_ticketState_map.copy()
 
     def get_manager_id(self):
         """Get next Manager Id. 
-        It checks Dnd for manager as well and loops through managers till one is not in Dnd.
-        If not found, dndtimeout of the first manager is returned, else 0 is returned.
+        It checks Dnd for manager as well and picks the next manager in rotation that is not in Dnd.
+        If not found, shortest dnd timeout of the shift's managers is returned, else 0 is returned.
         It returns the selected manager Id and dnd timeout if any."""
-        with self.lock:
+        return self.get_manager_ids(1)[0]
+
+    def get_manager_ids(self, numberOfTickets):
+        """Managers for numberOfTickets tickets in a single pass over the rotation under the manager lock, picked as
+        get_manager_id would pick them one after the other. Returns list of (manager Id, dnd timeout)."""
+        if self.cluster_store is not None:
+            return self.get_manager_ids_in_cluster(numberOfTickets)
+
+        with self.manager_lock:
             currentShift = self.get_shift()
             shiftColumnNumber = currentShift + 1
-            managersRowCount = len(self.list_of_managers)
             
             if self.last_manager_row_number_cached == 0 or self.current_shift_cached != currentShift:
                 self.current_shift_cached = currentShift
-                self.last_manager_row_number_cached = int(self.sheet_statemanagement.cell(col=shiftColumnNumber,row=4).value)   
-
-            lastRowNumberFromState = self.last_manager_row_number_cached + 1
-            if (lastRowNumberFromState > managersRowCount):
-                lastRowNumberFromState = 2
-
-            firstSelectedManagerId = 0
-            selectedManagerId = 0
-            dndTimeoutForManager = 1
-            while (dndTimeoutForManager != 0):
-                firstValueOflLstRowNumberFromState = 0
-                while (int(self.list_of_managers[lastRowNumberFromState-1][4]) != currentShift):
-                    if firstValueOflLstRowNumberFromState == 0:
-                        firstValueOflLstRowNumberFromState = lastRowNumberFromState
-                    elif firstValueOflLstRowNumberFromState == lastRowNumberFromState:
-                        return 0, self.manager_dnd_time
-                    lastRowNumberFromState+=1
-                    if (lastRowNumberFromState > managersRowCount):
-                        lastRowNumberFromState = 2
-                selectedManagerId = self.list_of_managers[lastRowNumberFromState-1][5]
-                newDndTimeoutForManager = self.has_activity_in_last_hour(selectedManagerId)
-                if dndTimeoutForManager == 1 or newDndTimeoutForManager < dndTimeoutForManager:
-                    dndTimeoutForManager = newDndTimeoutForManager
-                if dndTimeoutForManager == 0:
-                    ticketTimeoutTimeWithBuffer = self.manager_dnd_time - self.ticket_timeout - 30
-                    self.manager_last_interaction_time_map[selectedManagerId] = datetime.utcnow() - timedelta(seconds=ticketTimeoutTimeWithBuffer)
-                    break
-                elif firstSelectedManagerId == 0:
-                    firstSelectedManagerId = selectedManagerId
-                elif firstSelectedManagerId == selectedManagerId:
-                    break
-            
-            self.last_manager_row_number_cached = lastRowNumberFromState
-            self.sheet_statemanagement.update_cell(4, shiftColumnNumber, lastRowNumberFromState)
-            return selectedManagerId, dndTimeoutForManager
+                self.last_manager_row_number_cached = self.rotation_row_number_by_column.get(shiftColumnNumber, 0)
+
+            now = datetime.utcnow()
+            selectedManagers = []
+            for i in range(numberOfTickets):
+                lastRowNumberFromState, selectedManagerId, dndTimeoutForManager = self.select_next_manager(currentShift, self.last_manager_row_number_cached, now)
+                if lastRowNumberFromState == 0:
+                    selectedManagers.append((0, self.manager_dnd_time))
+                    continue
+                self.last_manager_row_number_cached = lastRowNumberFromState
+                self.rotation_row_number_by_column[shiftColumnNumber] = lastRowNumberFromState
+                self.pending_rotation_updates.set(shiftColumnNumber, lastRowNumberFromState)
+                selectedManagers.append((selectedManagerId, dndTimeoutForManager))
+            return selectedManagers
+
+    def get_manager_ids_in_cluster(self, numberOfTickets):
+        """get_manager_ids of a clustered deployment. Rotation row and dnd timestamps of all processes are read,
+        and the picks are written back, in one transaction of the cluster database."""
+        with self.cluster_store.transaction():
+            now = datetime.utcnow()
+            currentShift = self.get_shift()
+            shiftColumnNumber = currentShift + 1
+            lastRowNumber = self.cluster_store.load_rotation_rows().get(shiftColumnNumber, 0)
+            managerStates = self.cluster_store.load_manager_states_since(now - timedelta(seconds=self.manager_dnd_time))
+            selectedManagers = []
+            bufferedInteractionTimes = {}
+            with self.manager_lock:
+                for managerId, timestamp in managerStates.items():
+                    if self.manager_last_interaction_time_map.get(managerId) != timestamp:
+                        self.manager_last_interaction_time_map[managerId] = timestamp
+                        self.manager_rotation_index.set_last_activity(managerId, timestamp)
+                for i in range(numberOfTickets):
+                    lastRowNumberFromState, selectedManagerId, dndTimeoutForManager = self.select_next_manager(currentShift, lastRowNumber, now)
+                    if lastRowNumberFromState == 0:
+                        selectedManagers.append((0, self.manager_dnd_time))
+                        continue
+                    lastRowNumber = lastRowNumberFromState
+                    selectedManagers.append((selectedManagerId, dndTimeoutForManager))
+                    if dndTimeoutForManager == 0:
+                        bufferedInteractionTimes[selectedManagerId] = self.manager_last_interaction_time_map.get(selectedManagerId)
+
+            for managerId, bufferedInteractionTime in bufferedInteractionTimes.items():
+                self.cluster_store.save_manager_state(managerId, bufferedInteractionTime)
+            if any(managerId != 0 for managerId, dndTimeoutForManager in selectedManagers):
+                self.cluster_store.save_rotation_rows({ shiftColumnNumber: lastRowNumber })
+            return selectedManagers
+
+    def select_next_manager(self, currentShift, lastRowNumber, now):
+        """Next manager of the shift in rotation after lastRowNumber. A manager that is not in dnd is put in dnd for the ticket timeout with buffer,
+        so it is not picked for another ticket meanwhile. Returns row number, manager id and dnd timeout. Should be called holding the manager lock."""
+        lastRowNumberFromState, selectedManagerId, dndTimeoutForManager = self.manager_rotation_index.get_next_manager(currentShift, lastRowNumber, now)
+        if lastRowNumberFromState != 0 and dndTimeoutForManager == 0:
+            ticketTimeoutTimeWithBuffer = self.manager_dnd_time - self.ticket_timeout - 30
+            self.manager_last_interaction_time_map[selectedManagerId] = now - timedelta(seconds=ticketTimeoutTimeWithBuffer)
+            self.manager_rotation_index.set_last_activity(selectedManagerId, self.manager_last_interaction_time_map[selectedManagerId])
+        return lastRowNumberFromState, selectedManagerId, dndTimeoutForManager
 
     def get_shift(self):
         """Returns current shift as per UTC time. The shift start times are configured in GSheet"""
@@ -240,85 +676,211 @@ class GSheetManager:
         else:
             return 1
     
+    def get_ordering_lock(self, key):
+        """Lock serializing the state store writes of a ticket or manager. Writes of different keys run concurrently."""
+        return self.ordering_locks[hash(key) % self.NUMBER_OF_ORDERING_LOCKS]
+
     def append_ticket_status(self, jiraId, managerId, managerName, threadId, messageId):
         """Only should be called for new ticket, appends the new status to local map as well as GSheet"""
-        with self.lock:
-            self.ticket_to_ticketState_map[jiraId] = {}
-            self.ticket_to_ticketState_map[jiraId][self.TICKET_ID_COL] = jiraId
-            self.ticket_to_ticketState_map[jiraId][self.THREAD_ID_COL] = threadId
-            self.ticket_to_ticketState_map[jiraId][self.MANAGER_ID_COL] = managerId
-            self.ticket_to_ticketState_map[jiraId][self.MANAGER_NAME_COL] = managerName
-            self.ticket_to_ticketState_map[jiraId][self.MESSAGE_ID_COL] = messageId
-            self.sheet_ticketstatemanagement.append_row([jiraId, managerName, managerId, messageId, threadId])
+        ticketState = TicketState(jiraId, managerId, managerName, threadId, messageId)
+        with self.get_ordering_lock(jiraId):
+            with self.ticket_lock:
+                self.ticket_to_ticketState_map[jiraId] = ticketState
+                self.record_ticket_change(jiraId)
+            self.write_state('append_ticket_state', jiraId, managerId, managerName, threadId, messageId)
     
     def update_ticket_status(self, jiraId, managerId, managerName, messageId):
         """Only for already existing ticket, updates the status to local map as well as GSheet"""
-        with self.lock:
-            cell = self.get_cell(self.sheet_ticketstatemanagement, jiraId)
-            if (cell is not None):
-                self.ticket_to_ticketState_map[jiraId][self.MANAGER_ID_COL] = managerId
-                self.ticket_to_ticketState_map[jiraId][self.MANAGER_NAME_COL] = managerName
-                self.ticket_to_ticketState_map[jiraId][self.MESSAGE_ID_COL] = messageId
-                cell_list = self.sheet_ticketstatemanagement.range(f'B{cell.row}:D{cell.row}')
-                cell_values = [managerName, managerId, messageId]
-                for i, val in enumerate(cell_values):
-                    cell_list[i].value = val
-                self.sheet_ticketstatemanagement.update_cells(cell_list)
-            # else: # Anomaly, should not happen
-            #     append_ticket_status(jiraId, managerId, managerName, messageId, threadId)
-        
+        with self.get_ordering_lock(jiraId):
+            with self.ticket_lock:
+                ticketState = self.ticket_to_ticketState_map.get(jiraId)
+                if ticketState is not None:
+                    ticketState = ticketState.with_manager(managerId, managerName, messageId)
+                    self.ticket_to_ticketState_map[jiraId] = ticketState
+                    self.record_ticket_change(jiraId)
+            # Anomaly if the ticket is not cached, should not happen. In Clustered mode it may have been added by another process.
+            if ticketState is None and self.cluster_store is None:
+                return
+            self.write_state('update_ticket_state', jiraId, managerId, managerName, messageId)
 
     def get_ticket_status(self, jiraId):
-        """Gets ticket status if present"""
-        with self.lock:
-            if (jiraId in self.ticket_to_ticketState_map):
-                return self.ticket_to_ticketState_map[jiraId]
-            return None
+        """Gets ticket status if present. The returned record is a snapshot that is never modified.
+        In Clustered mode it is read from the cluster database, as the ticket may have been changed by another process."""
+        if self.cluster_store is not None:
+            ticketState = self.cluster_store.get_ticket_state(jiraId)
+            with self.ticket_lock:
+                if ticketState is None:
+                    self.ticket_to_ticketState_map.pop(jiraId, None)
+                else:
+                    self.ticket_to_ticketState_map[jiraId] = ticketState
+            return ticketState
+        with self.ticket_lock:
+            return self.ticket_to_ticketState_map.get(jiraId)
+
+    def begin_ticket_intake(self, jiraId):
+        """Claim a new ticket for processing. Returns False if it is already in the cycle or another request is taking it in,
+        so concurrent requests for a ticket cannot both pass the status check while the first one is pinging a manager.
+        In Clustered mode the ticket is also claimed in the cluster database, so requests on other processes cannot take it in too."""
+        if self.get_ticket_status(jiraId) is not None:
+            return False
+        with self.ticket_lock:
+            if jiraId in self.tickets_in_intake or jiraId in self.ticket_to_ticketState_map:
+                return False
+            self.tickets_in_intake.add(jiraId)
+        if self.cluster_store is not None:
+            try:
+                isClaimed = self.cluster_store.claim_ticket_intake(jiraId, self.node_id, self.cluster_lease_duration)
+            except:
+                isClaimed = False
+                self.logger.error("Error in begin_ticket_intake in GSheetManager: " + traceback.format_exc())
+            if not isClaimed:
+                with self.ticket_lock:
+                    self.tickets_in_intake.discard(jiraId)
+                return False
+        return True
+
+    def end_ticket_intake(self, jiraId):
+        if self.cluster_store is not None:
+            try:
+                self.cluster_store.release_ticket_intake(jiraId, self.node_id)
+            except:
+                self.logger.error("Error in end_ticket_intake in GSheetManager: " + traceback.format_exc())
+        with self.ticket_lock:
+            self.tickets_in_intake.discard(jiraId)
 
     def remove_ticket_status(self, jiraId):
         """Removes existing ticket status, only called on acceptance of a ticket"""
-        with self.lock:
-            self.ticket_to_ticketState_map.pop(jiraId, None)
-            cell = self.get_cell(self.sheet_ticketstatemanagement, jiraId)
-            if (cell is not None):
-                self.sheet_ticketstatemanagement.delete_row(cell.row)
+        with self.get_ordering_lock(jiraId):
+            with self.ticket_lock:
+                if self.ticket_to_ticketState_map.pop(jiraId, None) is None and self.cluster_store is None:
+                    return
+                self.record_ticket_change(jiraId)
+            self.write_state('remove_ticket_state', jiraId)
+
+    def set_transition_journal(self, transitionJournal):
+        self.transition_journal = transitionJournal
 
     def add_data_to_tracker(self, timestamp, jiraId, managerName, status):
-        """Adds data to tracker list to be updated later in GSheet on timer"""
-        self.list_of_tracker_data.add([str(timestamp), jiraId, managerName, status])
+        """Adds data to tracker list to be updated later in GSheet on timer, and to the tracker analytics.
+        The row is journaled first, so it is not lost if the process stops before it is written."""
+        row = [str(timestamp), jiraId, managerName, status]
+        journalSequence = None
+        if self.transition_journal is not None:
+            journalSequence = self.transition_journal.append({ 'type': self.JOURNALRECORD_TRACKER, 'tenant': self.spreadsheet_name, 'row': row })
+        self.list_of_tracker_data.add((row, journalSequence))
+        self.tracker_analytics.record(timestamp, jiraId, managerName, status, self.get_shift())
+
+    def requeue_tracker_row(self, row, journalSequence):
+        """Tracker row of a journal record left behind by the previous process"""
+        self.list_of_tracker_data.add((row, journalSequence))
+
+    def request_tracker_flush(self):
+        """Flush pending tracker data right away instead of at the next TimeForDataFlush tick. Ignored while flushes fail and
+        back off, or before the state store is ready."""
+        if self.tracker_flush_backoff == 0 and self.state_store_ready.is_set():
+            self.start_timer(0, self.flush_data_to_tracker_on_timer)
 
     def flush_data_to_tracker_on_timer(self):
-        """Batch update GSheet with Tracker data"""
-        threading.Timer(self.time_for_tracker_data_flush, self.flush_data_to_tracker_on_timer).start()
+        """Flush tracker data every TimeForDataFlush seconds, or earlier when the high water mark is reached.
+        While flushes fail, retries back off exponentially and high water mark is ignored.
+        Skipped if a flush is already running, as it drains the data and starts the next timer."""
+        if not self.tracker_flush_lock.acquire(blocking=False):
+            return
+        try:
+            if self.stop_event.is_set():
+                return
+            if self.flush_data_to_tracker():
+                self.tracker_flush_backoff = 0
+            else:
+                self.tracker_flush_backoff = min(max(self.tracker_flush_backoff * 2, self.TRACKER_FLUSH_MIN_BACKOFF), self.TRACKER_FLUSH_MAX_BACKOFF)
+            self.start_timer(self.tracker_flush_backoff if self.tracker_flush_backoff > 0 else self.time_for_tracker_data_flush, self.flush_data_to_tracker_on_timer)
+        finally:
+            self.tracker_flush_lock.release()
+
+    def flush_data_to_tracker(self):
+        """Drain all pending tracker data in as many batches as needed. A failed batch is put back in the list.
+        Returns False if a batch failed."""
+        while (True):
+            dataToFlush = self.list_of_tracker_data.getBatch(self.number_of_items_in_batch, self.TRACKER_MAX_BATCH_BYTES)
+            if len(dataToFlush) == 0:
+                return True
+            try:
+                self.state_store.append_tracker_rows([row for row, journalSequence in dataToFlush])
+            except:
+                self.list_of_tracker_data.putBack(dataToFlush)
+                self.logger.error(f"Error in flush_data_to_tracker, {len(dataToFlush)} rows kept for retry: {traceback.format_exc()}")
+                return False
+            for row, journalSequence in dataToFlush:
+                if journalSequence is not None:
+                    self.transition_journal.mark_done(journalSequence)
+
+    def get_tracker_queue_depth(self):
+        """Number of tracker rows waiting to be flushed"""
+        return self.list_of_tracker_data.getDepth()
+
+    def flush_rotation_state_on_timer(self):
+        """Write behind the latest rotation row of each shift to StateManagement sheet"""
+        self.start_timer(self.time_for_tracker_data_flush, self.flush_rotation_state_on_timer)
+        self.flush_rotation_state()
+
+    def flush_rotation_state(self):
+        """All pending rotation rows are written in a single request. On failure they are kept for next flush unless already overwritten."""
+        rotationUpdates = self.pending_rotation_updates.popAll()
+        if len(rotationUpdates) == 0:
+            return
         try:
-            dataToFlush = self.list_of_tracker_data.getAll()
-            if len(dataToFlush) > 0:
-                self.sheet_tracker.append_rows(dataToFlush)
+            self.state_store.save_rotation_rows(rotationUpdates)
         except:
-            self.logger.error("Error in flush_data_to_tracker_on_timer: " + traceback.format_exc())
+            for column, rowNumber in rotationUpdates.items():
+                self.pending_rotation_updates.setIfAbsent(column, rowNumber)
+            self.logger.error("Error in flush_rotation_state: " + traceback.format_exc())
+
+    def flush_pending_writes(self):
+        """Flush everything waiting to be written to the state store and save the snapshot, called on shutdown"""
+        self.save_snapshot()
+        if not self.state_store_ready.is_set():
+            return
+        self.flush_rotation_state()
+        self.flush_data_to_tracker()
+        try:
+            self.state_store.close()
+        except:
+            self.logger.error("Error in flush_pending_writes: " + traceback.format_exc())
+
+    def stop(self):
+        """Stop the timers and state store writes of a spreadsheet abandoned by a failed start.
+        Nothing pending is written, not even on exit."""
+        atexit.unregister(self.flush_pending_writes)
+        self.stop_event.set()
+        for timerKey in list(self.timer_keys):
+            self.timer_scheduler.cancel(timerKey)
+        if self.state_store is not None:
+            self.state_store.stop()
+
+    def save_snapshot_on_timer(self):
+        """Save the local snapshot every SnapshotInterval seconds"""
+        self.start_timer(self.snapshot_interval, self.save_snapshot_on_timer)
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        """Save configuration, managers, ticket states, dnd timestamps and rotation rows to the local snapshot used on next start"""
+        try:
+            with self.manager_lock:
+                managerEntriesByShift = self.manager_rotation_index.get_manager_entries()
+                managersHash = self.managers_hash
+                managerStates = self.manager_last_interaction_time_map.copy()
+                rotationRowNumberByColumn = self.rotation_row_number_by_column.copy()
+            with self.ticket_lock:
+                ticketStates = list(self.ticket_to_ticketState_map.values())
+            self.state_snapshot.save(self.configuration_map, managerEntriesByShift, managersHash, ticketStates, managerStates, rotationRowNumberByColumn)
+        except:
+            self.logger.error("Error in save_snapshot: " + traceback.format_exc())
 
     def record_manager_last_activity(self, timestamp, managerId):
         """Record the last timestamp of a manager activity (decline or acceptance), so as to add manager to dnd"""
-        with self.lock:
-            self.manager_last_interaction_time_map[managerId] = timestamp
-        cell = self.get_cell(self.sheet_managerstate, managerId)
-        if cell is not None:
-            self.sheet_managerstate.update_cell(cell.row, cell.col + 1, str(timestamp))
-        else:
-            self.sheet_managerstate.append_row([managerId, str(timestamp)])
-
-    def has_activity_in_last_hour(self, managerId):
-        """Check if a manager is in dnd"""
-        if managerId in self.manager_last_interaction_time_map:
-            timeSinceLastActivity = (datetime.utcnow() - self.manager_last_interaction_time_map.get(managerId)).total_seconds()
-            if (timeSinceLastActivity <= self.manager_dnd_time - 5):
-                return self.manager_dnd_time - timeSinceLastActivity
-        return 0
-
-    def get_cell(self, sheet, dataToFind):
-        """get_cell in gspread api throws exception if data is not found. Returns None in case of that"""
-        try:
-            cell = sheet.find(dataToFind)
-            return cell
-        except:  # gspread.exceptions.CellNotFound
-            return None
+        with self.get_ordering_lock(managerId):
+            with self.manager_lock:
+                self.manager_last_interaction_time_map[managerId] = timestamp
+                if self.manager_rotation_index is not None:
+                    self.manager_rotation_index.set_last_activity(managerId, timestamp)
+            self.write_state('save_manager_state', managerId, timestamp)
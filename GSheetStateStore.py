@@ -0,0 +1,175 @@
+from contextlib import contextmanager
+from dateutil import parser
+import threading
+import heapq
+from StateStore import StateStore
+from TicketState import TicketState
+from SheetWriteCoalescer import SheetWriteCoalescer
+from RateLimiter import RateLimiter
+
+# State kept in the StateManagement, TicketState, ManagerState and Tracker sheets of the Shift Automation GSheet
+class GSheetStateStore(StateStore):
+    sheet_statemanagement = None
+    sheet_ticketstatemanagement = None
+    sheet_managerstate = None
+    sheet_tracker = None
+
+    # Row of every ticket in TicketState sheet. Removed tickets leave blank (tombstoned) rows that are reused by appends.
+    ticket_to_row_number_map = {}
+    ticket_to_row_values_map = {}
+    ticket_state_free_rows = []
+    ticket_state_row_count = 1
+
+    # Row of every manager in ManagerState sheet
+    manager_to_row_number_map = {}
+    manager_state_row_count = 1
+
+    # Writes to TicketState, ManagerState and StateManagement sheets are queued here and sent together in one request
+    sheet_write_coalescer = None
+    rate_limiter = None
+
+    def __init__(self, spreadsheet, worksheets, sheetNameStateManagement, sheetNameTicketState, sheetNameManagerState, sheetNameTracker, logger, rateLimiter, timerScheduler, sheetWriteWindow=0.2):
+        """worksheets is a dictionary of all worksheets of the Shift Automation GSheet by title"""
+        self.lock = threading.Lock()
+        self.sheet_statemanagement = worksheets[sheetNameStateManagement]
+        self.sheet_ticketstatemanagement = worksheets[sheetNameTicketState]
+        self.sheet_managerstate = worksheets[sheetNameManagerState]
+        self.sheet_tracker = worksheets[sheetNameTracker]
+        self.ticket_to_row_number_map = {}
+        self.ticket_to_row_values_map = {}
+        self.ticket_state_free_rows = []
+        self.manager_to_row_number_map = {}
+        self.rate_limiter = rateLimiter
+        self.sheet_write_coalescer = SheetWriteCoalescer(logger, spreadsheet, rateLimiter, timerScheduler, sheetWriteWindow)
+        # New tickets and managers are written to the row after the last one, which may be past the end of the grid
+        self.sheet_write_coalescer.add_worksheet(self.sheet_ticketstatemanagement)
+        self.sheet_write_coalescer.add_worksheet(self.sheet_managerstate)
+
+    def load_ticket_states(self):
+        """Load all TicketState records and rebuild the row index, skipping tombstoned rows"""
+        self.sheet_write_coalescer.flush()
+        dictionaryOfAllRecords = self.rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.sheet_ticketstatemanagement.get_all_records)
+        with self.lock:
+            self.ticket_to_row_number_map = {}
+            self.ticket_to_row_values_map = {}
+            self.ticket_state_free_rows = []
+            self.ticket_state_row_count = len(dictionaryOfAllRecords) + 1
+            loadedRecords = []
+            for rowNumber, record in enumerate(dictionaryOfAllRecords, start=2):
+                jiraId = record[self.TICKET_ID_COL]
+                if jiraId == '':
+                    heapq.heappush(self.ticket_state_free_rows, rowNumber)
+                    continue
+                ticketState = TicketState.from_sheet_record(record)
+                self.ticket_to_row_number_map[ticketState.jira_id] = rowNumber
+                self.ticket_to_row_values_map[ticketState.jira_id] = [ticketState.jira_id, ticketState.manager_name, ticketState.manager_id, ticketState.message_id, ticketState.thread_id]
+                loadedRecords.append(ticketState)
+            return loadedRecords
+
+    def append_ticket_state(self, jiraId, managerId, managerName, threadId, messageId):
+        rowValues = [jiraId, managerName, managerId, messageId, threadId]
+        with self.lock:
+            if len(self.ticket_state_free_rows) > 0:
+                rowNumber = heapq.heappop(self.ticket_state_free_rows)
+            else:
+                self.ticket_state_row_count += 1
+                rowNumber = self.ticket_state_row_count
+            self.ticket_to_row_number_map[jiraId] = rowNumber
+            self.ticket_to_row_values_map[jiraId] = rowValues
+            # Free rows are blank in the sheet, or still have their blanking write pending which this write merges with
+            self.sheet_write_coalescer.write_row(self.sheet_ticketstatemanagement.title, rowNumber, 1, rowValues, isBlankInSheet=True)
+
+    def update_ticket_state(self, jiraId, managerId, managerName, messageId):
+        with self.lock:
+            rowNumber = self.ticket_to_row_number_map.get(jiraId)
+            if (rowNumber is None):
+                return
+            self.ticket_to_row_values_map[jiraId][1:4] = [managerName, managerId, messageId]
+            self.sheet_write_coalescer.write_row(self.sheet_ticketstatemanagement.title, rowNumber, 2, [managerName, managerId, messageId])
+
+    def remove_ticket_state(self, jiraId):
+        with self.lock:
+            self.ticket_to_row_values_map.pop(jiraId, None)
+            rowNumber = self.ticket_to_row_number_map.pop(jiraId, None)
+            if (rowNumber is None):
+                return
+            # A ticket appended and removed before its row was written leaves nothing to write.
+            # Otherwise row is blanked instead of deleted so row numbers of other tickets stay the same till next compaction.
+            if not self.sheet_write_coalescer.discard_row_if_blank_in_sheet(self.sheet_ticketstatemanagement.title, rowNumber):
+                self.sheet_write_coalescer.write_row(self.sheet_ticketstatemanagement.title, rowNumber, 1, [''] * 5)
+            heapq.heappush(self.ticket_state_free_rows, rowNumber)
+
+    def compact(self):
+        """Rewrite TicketState sheet without tombstoned rows once they outnumber the live tickets"""
+        with self.lock:
+            if len(self.ticket_state_free_rows) <= len(self.ticket_to_row_number_map):
+                return
+            liveRows = sorted(self.ticket_to_row_number_map.items(), key=lambda item: item[1])
+            values = [self.ticket_to_row_values_map[jiraId] for jiraId, rowNumber in liveRows]
+            values.extend([[''] * 5 for i in range(self.ticket_state_row_count - 1 - len(values))])
+            # Rewritten rows replace any pending writes of the same rows and are sent as a single range
+            for rowNumber, rowValues in enumerate(values, start=2):
+                self.sheet_write_coalescer.write_row(self.sheet_ticketstatemanagement.title, rowNumber, 1, rowValues)
+            self.ticket_to_row_number_map = { jiraId: rowNumber for rowNumber, (jiraId, oldRowNumber) in enumerate(liveRows, start=2) }
+            self.ticket_state_free_rows = []
+            self.ticket_state_row_count = len(liveRows) + 1
+
+    def load_manager_states(self):
+        self.sheet_write_coalescer.flush()
+        listOfManagerState = self.rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.sheet_managerstate.get_all_values)
+        managerStates = {}
+        with self.lock:
+            self.manager_to_row_number_map = {}
+            self.manager_state_row_count = len(listOfManagerState)
+            for rowNumber, managerState in enumerate(listOfManagerState[1:], start=2):
+                if managerState[0] == '':
+                    continue
+                managerStates[managerState[0]] = parser.parse(managerState[1])
+                self.manager_to_row_number_map[managerState[0]] = rowNumber
+        return managerStates
+
+    def save_manager_state(self, managerId, timestamp):
+        with self.lock:
+            rowNumber = self.manager_to_row_number_map.get(managerId)
+            if rowNumber is None:
+                self.manager_state_row_count += 1
+                rowNumber = self.manager_state_row_count
+                self.manager_to_row_number_map[managerId] = rowNumber
+                self.sheet_write_coalescer.write_row(self.sheet_managerstate.title, rowNumber, 1, [managerId, str(timestamp)])
+            else:
+                self.sheet_write_coalescer.write_row(self.sheet_managerstate.title, rowNumber, 2, [str(timestamp)])
+
+    def load_rotation_rows(self):
+        self.sheet_write_coalescer.flush()
+        rotationRowNumberByColumn = {}
+        rotationRowNumbers = self.rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.sheet_statemanagement.row_values, self.ROTATION_ROW_NUMBER)
+        for column, rowNumber in enumerate(rotationRowNumbers, start=1):
+            if str(rowNumber).isdigit():
+                rotationRowNumberByColumn[column] = int(rowNumber)
+        return rotationRowNumberByColumn
+
+    def save_rotation_rows(self, rotationRowNumberByColumn):
+        """Rotation rows are sent with the other pending writes"""
+        for column, rowNumber in rotationRowNumberByColumn.items():
+            self.sheet_write_coalescer.write_row(self.sheet_statemanagement.title, self.ROTATION_ROW_NUMBER, column, [rowNumber])
+
+    def append_tracker_rows(self, rows):
+        self.rate_limiter.call(RateLimiter.PRIORITY_TRACKER, self.sheet_tracker.append_rows, rows)
+
+    @contextmanager
+    def hold_writes(self):
+        """Writes made in the with block go to GSheet in one request once it ends"""
+        self.sheet_write_coalescer.hold()
+        try:
+            yield
+        finally:
+            self.sheet_write_coalescer.release()
+
+    def call_when_written(self, callback):
+        self.sheet_write_coalescer.call_when_flushed(callback)
+
+    def close(self):
+        self.sheet_write_coalescer.flush()
+
+    def stop(self):
+        self.sheet_write_coalescer.stop()
\ No newline at end of file
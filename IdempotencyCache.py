@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import threading
+import time
+from RateLimiter import DeadlineExceededError
+
+# Result of the first request of an idempotency key, shared with its repeats
+class IdempotencyEntry():
+    expiry = 0.0
+    result = None
+    is_successful = False
+
+    def __init__(self, expiry):
+        self.expiry = expiry
+        self.done_event = threading.Event()
+
+# Bounded cache of recent request results by idempotency key. A repeated request gets the result of the first one
+# instead of being processed again, waiting for it if it is still being processed.
+class IdempotencyCache():
+    time_to_live = 600.0
+    max_entries = 10000
+
+    def __init__(self, timeToLive, maxEntries):
+        self.lock = threading.Lock()
+        self.time_to_live = timeToLive
+        self.max_entries = maxEntries
+        # Entries in order of creation, so expired and excess entries are dropped from the front
+        self.entries = OrderedDict()
+
+    def update_limits(self, timeToLive, maxEntries):
+        """Applies to entries created from now on"""
+        with self.lock:
+            self.time_to_live = timeToLive
+            self.max_entries = maxEntries
+
+    def run(self, key, timeout, function, *args):
+        """Returns function(*args), called once for all requests of key within the time to live. If the call raises, the key is forgotten
+        so the request is processed again when it is retried. Raises DeadlineExceededError if a repeat waits more than timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while (True):
+            with self.lock:
+                self.remove_expired_entries()
+                entry = self.entries.get(key)
+                isFirstRequest = entry is None
+                if isFirstRequest:
+                    entry = self.entries[key] = IdempotencyEntry(time.monotonic() + self.time_to_live)
+            if isFirstRequest:
+                return self.run_first_request(key, entry, function, args)
+            if not entry.done_event.wait(max(0, deadline - time.monotonic())):
+                raise DeadlineExceededError(f"First request of {key} still running")
+            if entry.is_successful:
+                return entry.result
+
+    def run_first_request(self, key, entry, function, args):
+        try:
+            entry.result = function(*args)
+            entry.is_successful = True
+            return entry.result
+        except:
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            raise
+        finally:
+            entry.done_event.set()
+
+    def remove_expired_entries(self):
+        """Should be called holding the lock"""
+        now = time.monotonic()
+        while len(self.entries) > 0:
+            key, entry = next(iter(self.entries.items()))
+            if entry.expiry > now and len(self.entries) < self.max_entries:
+                break
+            self.entries.popitem(last=False)
+
+    def get_size(self):
+        with self.lock:
+            return len(self.entries)
\ No newline at end of file
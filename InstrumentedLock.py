@@ -0,0 +1,44 @@
+import threading
+import time
+from Metrics import lockWait, lockHold
+
+# Drop-in for threading.Lock that records wait and hold times under its name. Locks sharing a name, like the ordering
+# locks of a class, are recorded together.
+class InstrumentedLock():
+    name = ''
+
+    def __init__(self, name):
+        self.lock = threading.Lock()
+        self.name = name
+        # Only written by the thread holding the lock
+        self.acquired_time = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        # Uncontended acquires skip timing the wait
+        if self.lock.acquire(False):
+            self.acquired_time = time.perf_counter()
+            lockWait.observe(0.0, self.name)
+            return True
+        if not blocking:
+            return False
+        startTime = time.perf_counter()
+        if not self.lock.acquire(True, timeout):
+            return False
+        self.acquired_time = time.perf_counter()
+        lockWait.observe(self.acquired_time - startTime, self.name)
+        return True
+
+    def release(self):
+        holdTime = time.perf_counter() - self.acquired_time
+        self.lock.release()
+        lockHold.observe(holdTime, self.name)
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, exceptionTraceback):
+        self.release()
\ No newline at end of file
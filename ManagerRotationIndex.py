@@ -0,0 +1,184 @@
+from array import array
+from datetime import timedelta
+import bisect
+import heapq
+import sys
+
+# Manager of the rotation, with its id parsed and interned once when manager data is loaded
+class RotationManager():
+    __slots__ = ('manager_id', 'shift_positions', 'last_interaction_time')
+
+    def __init__(self, managerId):
+        self.manager_id = managerId
+        # Shift and position in rows_by_shift of every row of the manager, flattened into one tuple as most managers have a single row.
+        # A manager can have rows in multiple shifts.
+        self.shift_positions = ()
+        # Last activity, which puts the manager in dnd. None if there was no activity.
+        self.last_interaction_time = None
+
+    def get_positions(self, shift):
+        return [self.shift_positions[index + 1] for index in range(0, len(self.shift_positions), 2) if self.shift_positions[index] == shift]
+
+    def get_shifts(self):
+        return set(self.shift_positions[0::2])
+
+    def add_position(self, shift, position):
+        """Returns True for the first position of the manager in the shift"""
+        isFirstInShift = shift not in self.shift_positions[0::2]
+        self.shift_positions += (shift, position)
+        return isFirstInShift
+
+    def remove_shift(self, shift):
+        shiftPositions = []
+        for index in range(0, len(self.shift_positions), 2):
+            if self.shift_positions[index] != shift:
+                shiftPositions.extend(self.shift_positions[index:index + 2])
+        self.shift_positions = tuple(shiftPositions)
+
+# Precomputed per shift rotation of the Managers sheet with a DND expiry heap, rebuilt whenever manager data is reloaded
+class ManagerRotationIndex():
+    MANAGERS_SHIFT_COL_INDEX = 4
+    MANAGERS_ID_COL_INDEX = 5
+
+    manager_dnd_time = 3600.0
+
+    def __init__(self, managerEntriesByShift, managerLastInteractionTimeMap, managerDndTime):
+        """managerEntriesByShift is the Managers sheet as parsed by parse_managers"""
+        self.manager_dnd_time = managerDndTime
+        # Row numbers of managers of each shift, in sheet order
+        self.rows_by_shift = {}
+        # Manager id at each position of rows_by_shift
+        self.manager_ids_by_shift = {}
+        # Managers by id, those in the sheet and those with recorded activity
+        self.managers = {}
+        # Sorted positions of managers not in dnd per shift
+        self.available_by_shift = {}
+        # Min-heap of (last activity, managerId) per shift, ordered like the dnd expiries. Entries are stale once the manager's activity changes.
+        self.dnd_heap_by_shift = {}
+        for managerId, lastInteractionTime in managerLastInteractionTimeMap.items():
+            self.set_manager_last_activity(self.get_manager(managerId), lastInteractionTime)
+
+        for shift, entries in managerEntriesByShift.items():
+            self.build_shift(shift, entries)
+
+    @classmethod
+    def parse_managers(cls, listOfManagers):
+        """(row number, manager id) of the managers of each shift, in sheet order. Only these are kept of the rows of the Managers sheet."""
+        entriesByShift = {}
+        for rowIndex, manager in enumerate(listOfManagers[1:]):
+            try:
+                shift = int(manager[cls.MANAGERS_SHIFT_COL_INDEX])
+                managerId = sys.intern(manager[cls.MANAGERS_ID_COL_INDEX])
+            except (ValueError, IndexError):
+                continue
+            entriesByShift.setdefault(shift, []).append((rowIndex + 2, managerId))  # header row and 1 based row numbers
+        return entriesByShift
+
+    def get_manager_entries(self):
+        """Managers of each shift in the form parse_managers returns them, e.g. to rebuild the index or save it"""
+        return { shift: list(zip(rows, self.manager_ids_by_shift[shift])) for shift, rows in self.rows_by_shift.items() }
+
+    def get_manager(self, managerId):
+        """Manager ids are numbers when loaded from the sheet and text otherwise"""
+        managerId = sys.intern(str(managerId))
+        manager = self.managers.get(managerId)
+        if manager is None:
+            manager = self.managers[managerId] = RotationManager(managerId)
+        return manager
+
+    def set_manager_last_activity(self, manager, lastInteractionTime):
+        manager.last_interaction_time = lastInteractionTime
+
+    def build_shift(self, shift, entries):
+        """Index the managers of a shift. Managers with any recorded activity start in dnd, expired dnd is released on the next pick."""
+        self.rows_by_shift[shift] = array('l', [rowNumber for rowNumber, managerId in entries])
+        self.manager_ids_by_shift[shift] = [managerId for rowNumber, managerId in entries]
+        available = []
+        dndHeap = []
+        for position, (rowNumber, managerId) in enumerate(entries):
+            manager = self.get_manager(managerId)
+            isFirstInShift = manager.add_position(shift, position)
+            if manager.last_interaction_time is None:
+                available.append(position)
+            elif isFirstInShift:
+                dndHeap.append((manager.last_interaction_time, manager.manager_id))
+        heapq.heapify(dndHeap)
+        self.available_by_shift[shift] = available
+        self.dnd_heap_by_shift[shift] = dndHeap
+
+    def remove_shift(self, shift):
+        for managerId in set(self.manager_ids_by_shift[shift]):
+            self.managers[managerId].remove_shift(shift)
+        del self.rows_by_shift[shift]
+        del self.manager_ids_by_shift[shift]
+        del self.available_by_shift[shift]
+        del self.dnd_heap_by_shift[shift]
+
+    def update_managers(self, entriesByShift):
+        """Apply changed manager data, as parsed by parse_managers. Only shifts whose managers or their rows changed are indexed again,
+        dnd of all managers is kept. Returns the ids of managers that are no longer in any shift."""
+        oldManagerIds = self.get_manager_ids_in_shifts()
+        for shift in list(self.rows_by_shift):
+            if shift not in entriesByShift:
+                self.remove_shift(shift)
+        for shift, entries in entriesByShift.items():
+            if shift in self.rows_by_shift:
+                if list(zip(self.rows_by_shift[shift], self.manager_ids_by_shift[shift])) == entries:
+                    continue
+                self.remove_shift(shift)
+            self.build_shift(shift, entries)
+        return oldManagerIds - self.get_manager_ids_in_shifts()
+
+    def get_manager_ids_in_shifts(self):
+        return { managerId for managerId, manager in self.managers.items() if len(manager.shift_positions) > 0 }
+
+    def get_dnd_expiry(self, lastInteractionTime):
+        """Manager stays in dnd till 5 seconds before dnd time ends"""
+        return lastInteractionTime + timedelta(seconds=self.manager_dnd_time - 5)
+
+    def set_last_activity(self, managerId, lastInteractionTime):
+        """Record manager activity. Manager is removed from rotation of all its shifts till its dnd expires."""
+        manager = self.get_manager(managerId)
+        self.set_manager_last_activity(manager, lastInteractionTime)
+        for shift in manager.get_shifts():
+            available = self.available_by_shift[shift]
+            for position in manager.get_positions(shift):
+                index = bisect.bisect_left(available, position)
+                if index < len(available) and available[index] == position:
+                    del available[index]
+            heapq.heappush(self.dnd_heap_by_shift[shift], (manager.last_interaction_time, manager.manager_id))
+
+    def release_expired_dnd(self, shift, now):
+        """Put managers whose dnd has expired back in rotation and drop stale heap entries from the top"""
+        dndHeap = self.dnd_heap_by_shift[shift]
+        available = self.available_by_shift[shift]
+        while len(dndHeap) > 0:
+            lastInteractionTime, managerId = dndHeap[0]
+            manager = self.managers[managerId]
+            isStale = manager.last_interaction_time != lastInteractionTime
+            if not isStale and self.get_dnd_expiry(lastInteractionTime) > now:
+                break
+            heapq.heappop(dndHeap)
+            if not isStale:
+                for position in manager.get_positions(shift):
+                    index = bisect.bisect_left(available, position)
+                    if index == len(available) or available[index] != position:
+                        available.insert(index, position)
+
+    def get_next_manager(self, shift, lastRowNumber, now):
+        """Next manager of the shift after lastRowNumber in round robin order that is not in dnd.
+        Returns row number, manager id and 0, or if all managers are in dnd, the next row number and manager id with the shortest remaining dnd time.
+        Row number is 0 if there are no managers in the shift."""
+        rows = self.rows_by_shift.get(shift)
+        if not rows:
+            return 0, 0, 0
+        self.release_expired_dnd(shift, now)
+        startPosition = bisect.bisect_right(rows, lastRowNumber) % len(rows)
+        available = self.available_by_shift[shift]
+        if len(available) > 0:
+            index = bisect.bisect_left(available, startPosition)
+            position = available[index] if index < len(available) else available[0]
+            return rows[position], self.manager_ids_by_shift[shift][position], 0
+        lastInteractionTime, managerId = self.dnd_heap_by_shift[shift][0]
+        dndTimeoutForManager = self.manager_dnd_time - (now - self.managers[managerId].last_interaction_time).total_seconds()
+        return rows[startPosition], self.manager_ids_by_shift[shift][startPosition], dndTimeoutForManager
\ No newline at end of file
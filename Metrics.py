@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+# Bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOCK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+# Histogram of observed values per combination of label values, rendered in the Prometheus text format
+class Histogram():
+    name = ''
+    help_text = ''
+    label_names = ()
+    buckets = LATENCY_BUCKETS
+
+    def __init__(self, name, helpText, labelNames=(), buckets=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.name = name
+        self.help_text = helpText
+        self.label_names = labelNames
+        self.buckets = buckets
+        # Per label values, count of each bucket (not cumulative, last one is +Inf) followed by the sum of values
+        self.series = {}
+
+    def observe(self, value, *labelValues):
+        bucketIndex = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.series.get(labelValues)
+            if counts is None:
+                counts = self.series[labelValues] = [0] * (len(self.buckets) + 2)
+            counts[bucketIndex] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labelValues):
+        """Observe the time spent in the with block"""
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - startTime, *labelValues)
+
+    def render(self):
+        with self.lock:
+            series = { labelValues: list(counts) for labelValues, counts in self.series.items() }
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labelValues, counts in sorted(series.items()):
+            labels = ''.join(f'{labelName}="{labelValue}",' for labelName, labelValue in zip(self.label_names, labelValues))
+            cumulativeCount = 0
+            for bucket, count in zip(self.buckets + ('+Inf',), counts):
+                cumulativeCount += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bucket}"}} {cumulativeCount}')
+            labels = '{' + labels.rstrip(',') + '}' if labels else ''
+            lines.append(f'{self.name}_sum{labels} {counts[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulativeCount}')
+        return lines
+
+# Gauge read from a function when the metrics are scraped, so it costs nothing in between
+class Gauge():
+    name = ''
+    help_text = ''
+    function = None
+
+    def __init__(self, name, helpText, function):
+        self.name = name
+        self.help_text = helpText
+        self.function = function
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {self.function()}']
+
+# All metrics of the process, exposed on the /metrics endpoint
+class MetricsRegistry():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def histogram(self, name, helpText, labelNames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, helpText, labelNames, buckets))
+
+    def gauge(self, name, helpText, function):
+        """Register a gauge, replacing any earlier gauge of the same name"""
+        return self.register(Gauge(name, helpText, function))
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+metricsRegistry = MetricsRegistry()
+externalCallLatency = metricsRegistry.histogram('rcabot_external_call_seconds', 'Latency of each attempt of a Google Sheets or Google Chat call', ('call',))
+rateLimitWait = metricsRegistry.histogram('rcabot_rate_limit_wait_seconds', 'Time requests waited for a rate limiter token', ('api',))
+eventLatency = metricsRegistry.histogram('rcabot_event_seconds', 'Time to handle each event type', ('event',))
+operationLatency = metricsRegistry.histogram('rcabot_operation_seconds', 'Time of internal operations like manager selection and ticket timeouts', ('operation',))
+lockWait = metricsRegistry.histogram('rcabot_lock_wait_seconds', 'Time waited to acquire a lock', ('lock',), LOCK_BUCKETS)
+lockHold = metricsRegistry.histogram('rcabot_lock_hold_seconds', 'Time a lock was held', ('lock',), LOCK_BUCKETS)
\ No newline at end of file
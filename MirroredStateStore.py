@@ -0,0 +1,144 @@
+import threading
+import queue
+import traceback
+from StateStore import StateStore
+
+# Reads and writes go to the primary store, writes are replayed in order on the mirror store on the shared timer scheduler
+class MirroredStateStore(StateStore):
+    MIN_LOAD_BACKOFF = 1.0
+    MAX_LOAD_BACKOFF = 300.0
+
+    primary_store = None
+    mirror_store = None
+    timer_scheduler = None
+    is_mirroring = False
+    is_mirror_loaded = True
+    load_backoff = 0
+    is_stopped = False
+    logger = None
+
+    def __init__(self, logger, primaryStore, mirrorStore, timerScheduler, isMirrorLoaded=True):
+        """A mirror that is not loaded yet is loaded in the background before any write is applied to it,
+        as a GSheet mirror writes to the rows it finds on load"""
+        self.lock = threading.Lock()
+        self.logger = logger
+        self.primary_store = primaryStore
+        self.mirror_store = mirrorStore
+        self.timer_scheduler = timerScheduler
+        # Unique per store, the timer scheduler is shared by all spreadsheets
+        self.timer_key = ('StateStoreMirror', id(self))
+        self.mirror_queue = queue.Queue()
+        # Set while writes are being applied, so only one worker applies them at a time and in order
+        self.is_mirroring = False
+        self.is_mirror_loaded = isMirrorLoaded
+        self.load_backoff = 0
+        self.is_stopped = False
+        if not isMirrorLoaded:
+            self.is_mirroring = True
+            self.timer_scheduler.schedule(self.timer_key, 0, self.apply_mirror_writes)
+
+    def mirror(self, methodName, *args):
+        self.mirror_queue.put((methodName, args))
+        with self.lock:
+            if self.is_mirroring or self.is_stopped:
+                return
+            self.is_mirroring = True
+        self.timer_scheduler.schedule(self.timer_key, 0, self.apply_mirror_writes)
+
+    def apply_mirror_writes(self):
+        """Runs on the timer worker pool till the queue is empty. Mirror is only a reporting copy, failed writes are logged and skipped.
+        Till the mirror is loaded, writes wait in the queue and the load is retried with backoff."""
+        if not self.is_mirror_loaded and not self.load_mirror():
+            return
+        while (True):
+            with self.lock:
+                if self.is_stopped or self.mirror_queue.empty():
+                    self.is_mirroring = False
+                    return
+            methodName, args = self.mirror_queue.get()
+            try:
+                getattr(self.mirror_store, methodName)(*args)
+            except:
+                self.logger.error(f"Error in {methodName} on mirror state store: {traceback.format_exc()}")
+            finally:
+                self.mirror_queue.task_done()
+
+    def load_mirror(self):
+        """Load the mirror store so it can be written to. Returns False if it failed, it is then retried on a timer."""
+        if self.is_stopped:
+            return False
+        try:
+            self.mirror_store.load_ticket_states()
+            self.mirror_store.load_manager_states()
+        except:
+            self.load_backoff = min(max(self.load_backoff * 2, self.MIN_LOAD_BACKOFF), self.MAX_LOAD_BACKOFF)
+            self.logger.error(f"Error in loading mirror state store, retrying in {self.load_backoff} seconds: {traceback.format_exc()}")
+            self.timer_scheduler.schedule(self.timer_key, self.load_backoff, self.apply_mirror_writes)
+            return False
+        self.is_mirror_loaded = True
+        return True
+
+    def get_pending_mirror_writes(self):
+        return self.mirror_queue.qsize()
+
+    def wait_for_mirror(self):
+        """Block till all queued writes are applied on the mirror, used on shutdown"""
+        self.mirror_queue.join()
+
+    def load_ticket_states(self):
+        return self.primary_store.load_ticket_states()
+
+    def append_ticket_state(self, jiraId, managerId, managerName, threadId, messageId):
+        self.primary_store.append_ticket_state(jiraId, managerId, managerName, threadId, messageId)
+        self.mirror('append_ticket_state', jiraId, managerId, managerName, threadId, messageId)
+
+    def update_ticket_state(self, jiraId, managerId, managerName, messageId):
+        self.primary_store.update_ticket_state(jiraId, managerId, managerName, messageId)
+        self.mirror('update_ticket_state', jiraId, managerId, managerName, messageId)
+
+    def remove_ticket_state(self, jiraId):
+        self.primary_store.remove_ticket_state(jiraId)
+        self.mirror('remove_ticket_state', jiraId)
+
+    def load_manager_states(self):
+        return self.primary_store.load_manager_states()
+
+    def save_manager_state(self, managerId, timestamp):
+        self.primary_store.save_manager_state(managerId, timestamp)
+        self.mirror('save_manager_state', managerId, timestamp)
+
+    def load_rotation_rows(self):
+        return self.primary_store.load_rotation_rows()
+
+    def save_rotation_rows(self, rotationRowNumberByColumn):
+        self.primary_store.save_rotation_rows(rotationRowNumberByColumn)
+        self.mirror('save_rotation_rows', rotationRowNumberByColumn)
+
+    def append_tracker_rows(self, rows):
+        self.primary_store.append_tracker_rows(rows)
+        self.mirror('append_tracker_rows', rows)
+
+    def call_when_written(self, callback):
+        """Mirror is only a reporting copy, writes are stored once they are in the primary store"""
+        self.primary_store.call_when_written(callback)
+
+    def compact(self):
+        self.primary_store.compact()
+        self.mirror('compact')
+
+    def close(self):
+        """Waits for the writes not mirrored yet, unless the mirror could not be loaded"""
+        if self.is_mirror_loaded:
+            self.wait_for_mirror()
+        else:
+            self.logger.warning(f"{self.get_pending_mirror_writes()} writes not mirrored, mirror state store could not be loaded")
+        self.primary_store.close()
+        self.mirror_store.close()
+
+    def stop(self):
+        """Writes not mirrored yet are not sent to the mirror"""
+        with self.lock:
+            self.is_stopped = True
+        self.timer_scheduler.cancel(self.timer_key)
+        self.primary_store.stop()
+        self.mirror_store.stop()
\ No newline at end of file
@@ -0,0 +1,40 @@
+import threading
+import queue
+import traceback
+
+# Bounded work queue served by a fixed pool of workers. Work with the same key always goes to the same worker, so it runs in order.
+class PartitionedWorkQueue():
+    logger = None
+
+    def __init__(self, logger, numberOfWorkers, maxQueueSize):
+        self.logger = logger
+        self.work_queues = [queue.Queue(maxsize=max(1, maxQueueSize // numberOfWorkers)) for i in range(numberOfWorkers)]
+        for workerNumber, workQueue in enumerate(self.work_queues):
+            threading.Thread(target=self.run_worker, args=(workQueue, ), name=f'EventWorker-{workerNumber}', daemon=True).start()
+
+    def submit(self, key, function, *args):
+        """Queue function(*args) on the worker of key. Blocks while that worker's queue is full, so callers are slowed down instead of work piling up."""
+        self.work_queues[hash(key) % len(self.work_queues)].put((key, function, args))
+
+    def get_depth(self):
+        """Number of work items waiting in all queues"""
+        return sum(workQueue.qsize() for workQueue in self.work_queues)
+
+    def stop(self):
+        """Workers end after the work already queued"""
+        for workQueue in self.work_queues:
+            workQueue.put(None)
+
+    def run_worker(self, workQueue):
+        while (True):
+            work = workQueue.get()
+            if work is None:
+                workQueue.task_done()
+                return
+            key, function, args = work
+            try:
+                function(*args)
+            except:
+                self.logger.error(f"Error in background work for {key}: {traceback.format_exc()}")
+            finally:
+                workQueue.task_done()
\ No newline at end of file
@@ -0,0 +1,140 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from Metrics import externalCallLatency, rateLimitWait
+
+# Raised for responses that should be retried, e.g. when the quota of the API is exceeded
+class RetryableRequestError(Exception):
+    def __init__(self, status_code, content):
+        super().__init__(f"Request failed with status {status_code}: {content}")
+        self.status_code = status_code
+
+# Raised when a request could not be sent, or retried, before its deadline
+class DeadlineExceededError(Exception):
+    pass
+
+# Token bucket for one Google API, shared by all threads. Waiting requests are served in priority order.
+# Failed requests are retried with jittered exponential backoff, and a quota error holds back all requests of the API.
+class RateLimiter():
+    # Priority classes, lower is served first
+    PRIORITY_CHAT = 0
+    PRIORITY_TICKETSTATE = 1
+    PRIORITY_TRACKER = 2
+
+    RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+    STATUS_CODE_TOO_MANY_REQUESTS = 429
+    MIN_RETRY_BACKOFF = 1.0
+    MAX_RETRY_BACKOFF = 64.0
+
+    # Bucket holds up to this many seconds worth of requests, so short bursts are sent right away
+    BURST_SECONDS = 10.0
+
+    name = ''
+    requests_per_second = 1.0
+    capacity = 10.0
+    max_attempts = 5
+    logger = None
+
+    def __init__(self, logger, name, requestsPerMinute, maxAttempts=5):
+        self.condition = threading.Condition()
+        self.logger = logger
+        self.name = name
+        self.max_attempts = maxAttempts
+        self.update_rate(requestsPerMinute)
+        self.tokens = self.capacity
+        self.last_refill_time = time.monotonic()
+        # No token is handed out before this time, set when the API reports its quota is exceeded
+        self.paused_until = 0
+        # Heap of (priority, sequence) of waiting requests, the head gets the next token
+        self.waiters = []
+        self.sequence = itertools.count()
+
+    def update_rate(self, requestsPerMinute):
+        with self.condition:
+            self.requests_per_second = requestsPerMinute / 60.0
+            self.capacity = max(1.0, self.requests_per_second * self.BURST_SECONDS)
+            self.condition.notify_all()
+
+    def refill(self):
+        """Should be called holding the condition"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill_time) * self.requests_per_second)
+        self.last_refill_time = now
+
+    def acquire(self, priority, deadline=None):
+        """Wait for a token. deadline is a time.monotonic() value, returns False if it passes before a token is available."""
+        with self.condition:
+            waiter = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, waiter)
+            try:
+                while (True):
+                    self.refill()
+                    now = time.monotonic()
+                    waitTime = None
+                    if self.waiters[0] == waiter:
+                        if now < self.paused_until:
+                            waitTime = self.paused_until - now
+                        elif self.tokens >= 1:
+                            self.tokens -= 1
+                            return True
+                        else:
+                            waitTime = (1 - self.tokens) / self.requests_per_second
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        waitTime = deadline - now if waitTime is None else min(waitTime, deadline - now)
+                    self.condition.wait(waitTime)
+            finally:
+                self.waiters.remove(waiter)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+    def pause(self, pauseTime):
+        """Hold back all requests of the API, used when it reports its quota is exceeded"""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + pauseTime)
+            self.tokens = 0
+
+    def call(self, priority, function, *args, deadline=None, callName=None):
+        """Call function(*args) once a token is available, retrying retryable errors with jittered exponential backoff.
+        Raises DeadlineExceededError if the deadline passes before the call could be made or retried.
+        Each attempt is timed under callName, by default the API name and function name, e.g. sheets_get_all_values."""
+        if callName is None:
+            callName = f"{self.name.lower()}_{function.__name__}"
+        attempt = 0
+        while (True):
+            startTime = time.perf_counter()
+            isAcquired = self.acquire(priority, deadline)
+            rateLimitWait.observe(time.perf_counter() - startTime, self.name)
+            if not isAcquired:
+                raise DeadlineExceededError(f"{self.name} request could not be sent before its deadline")
+            try:
+                with externalCallLatency.time(callName):
+                    return function(*args)
+            except Exception as exception:
+                attempt += 1
+                statusCode = self.get_status_code(exception)
+                if attempt >= self.max_attempts or not self.is_retryable(exception, statusCode):
+                    raise
+                backoffTime = random.uniform(0, min(self.MAX_RETRY_BACKOFF, self.MIN_RETRY_BACKOFF * 2 ** attempt))
+                if deadline is not None and time.monotonic() + backoffTime >= deadline:
+                    raise
+                if statusCode == self.STATUS_CODE_TOO_MANY_REQUESTS:
+                    self.pause(backoffTime)
+                self.logger.warning(f"{self.name} request failed with {exception!r}, retry {attempt} in {backoffTime:.2f} seconds")
+                time.sleep(backoffTime)
+
+    def get_status_code(self, exception):
+        """Status code of RetryableRequestError and gspread APIError, None for other errors"""
+        statusCode = getattr(exception, 'status_code', None)
+        if statusCode is None:
+            statusCode = getattr(getattr(exception, 'response', None), 'status_code', None)
+        return statusCode
+
+    def is_retryable(self, exception, statusCode):
+        """Retryable status codes and network errors are retried"""
+        if statusCode is not None:
+            return statusCode in self.RETRYABLE_STATUS_CODES
+        return isinstance(exception, OSError)
\ No newline at end of file
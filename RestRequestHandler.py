@@ -1,27 +1,77 @@
 from httplib2 import Http
-import threading
+import queue
 import json
+from RateLimiter import RateLimiter, RetryableRequestError
+from InstrumentedLock import InstrumentedLock
+from Metrics import externalCallLatency
 
 class RestRequestHandler:
-    REQUEST_URL_CREATE = 'https://chat.googleapis.com/v1/{}/messages'
-    REQUEST_URL_CREATE_IN_THREAD = 'https://chat.googleapis.com/v1/{}/messages?threadKey={}'
+    # Creating a message again with the same requestId returns the message already created, so creates can be retried safely
+    REQUEST_URL_CREATE = 'https://chat.googleapis.com/v1/{}/messages?requestId={}'
+    REQUEST_URL_CREATE_IN_THREAD = 'https://chat.googleapis.com/v1/{}/messages?threadKey={}&requestId={}'
     REQUEST_URL_UPDATE = 'https://chat.googleapis.com/v1/{}?updateMask={}'
     
     REQUEST_UPDATEMASK = 'cards,text'
     REQUESTTYPE_POST = "POST"
     REQUESTTYPE_PUT = "PUT"
 
+    # Requests with the same ordering key are serialized on one of these locks, so one ticket's messages stay in order
+    NUMBER_OF_ORDERING_LOCKS = 64
 
-    http_auth = None
+    credentials = None
+    connection_pool = None
+    connection_pool_size = 4
+    request_timeout = 30
+    rate_limiter = None
 
-    def __init__(self, creds):
-        self.lock = threading.Lock()
-        self.http_auth = creds.authorize(Http())
+    def __init__(self, creds, connectionPoolSize=4, requestTimeout=30, rateLimiter=None):
+        self.credentials = creds
+        self.rate_limiter = rateLimiter
+        self.connection_pool_size = connectionPoolSize
+        self.request_timeout = requestTimeout
+        self.token_lock = InstrumentedLock('RestRequestHandler.token_lock')
+        self.ordering_locks = [InstrumentedLock('RestRequestHandler.ordering_lock') for i in range(self.NUMBER_OF_ORDERING_LOCKS)]
+        # Every connection is authorized with the same credentials, so the access token is shared between them
+        self.connection_pool = queue.Queue()
+        for i in range(connectionPoolSize):
+            self.connection_pool.put(creds.authorize(Http(timeout=requestTimeout)))
 
-    def send_rest_request_chat(self, url, requestType, body):
-        with self.lock:
-            response, content = self.http_auth.request(url,
+    def send_rest_request_chat(self, url, requestType, body, orderingKey=None, deadline=None):
+        """Send request to Google Chat on a pooled connection. Requests with the same orderingKey (jiraId) are sent one at a time.
+        Body can be a dictionary or already serialized JSON bytes. With a rate limiter, failed requests are retried till the deadline."""
+        callName = 'chat_' + requestType.lower()
+        if self.rate_limiter is None:
+            with externalCallLatency.time(callName):
+                return self.send_ordered_rest_request(url, requestType, body, orderingKey)
+        return self.rate_limiter.call(RateLimiter.PRIORITY_CHAT, self.send_ordered_rest_request, url, requestType, body, orderingKey, deadline=deadline, callName=callName)
+
+    def send_ordered_rest_request(self, url, requestType, body, orderingKey):
+        """Ordering lock is only held while the request is sent, not while it waits for the rate limiter or backs off before
+        a retry, so other tickets sharing the lock are not held up by them"""
+        if orderingKey is None:
+            return self.send_rest_request_on_pooled_connection(url, requestType, body)
+        with self.ordering_locks[hash(orderingKey) % self.NUMBER_OF_ORDERING_LOCKS]:
+            return self.send_rest_request_on_pooled_connection(url, requestType, body)
+
+    def send_rest_request_on_pooled_connection(self, url, requestType, body):
+        """Borrow a keep-alive connection from the pool, blocking if all of them are in use"""
+        self.refresh_access_token_if_expired()
+        http_auth = self.connection_pool.get()
+        try:
+            response, content = http_auth.request(url,
                                         method=requestType, 
                                         headers={'Content-type': 'application/json'},
-                                        body=json.dumps(body))
-        return json.loads(content)
\ No newline at end of file
+                                        body=body if isinstance(body, bytes) else json.dumps(body))
+        finally:
+            self.connection_pool.put(http_auth)
+        if response.status in RateLimiter.RETRYABLE_STATUS_CODES:
+            raise RetryableRequestError(response.status, content)
+        return json.loads(content)
+
+    def refresh_access_token_if_expired(self):
+        """Refresh the shared access token once, instead of every pooled connection refreshing it on its own"""
+        if self.credentials.access_token is not None and not self.credentials.access_token_expired:
+            return
+        with self.token_lock:
+            if self.credentials.access_token is None or self.credentials.access_token_expired:
+                self.credentials.refresh(Http(timeout=self.request_timeout))
\ No newline at end of file
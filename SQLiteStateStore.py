@@ -0,0 +1,88 @@
+from dateutil import parser
+import threading
+import sqlite3
+from StateStore import StateStore
+from TicketState import TicketState
+
+# Local embedded state store, SQLite in WAL mode so reads never wait on the single writer
+class SQLiteStateStore(StateStore):
+    database_path = 'rcabot.db'
+    connection = None
+
+    def __init__(self, databasePath, busyTimeout=5.0):
+        self.lock = threading.Lock()
+        self.database_path = databasePath
+        # One connection shared by all threads, serialized by the lock. Writers of other processes are waited for up to busyTimeout seconds.
+        self.connection = sqlite3.connect(databasePath, timeout=busyTimeout, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS ticket_state (
+                ticket TEXT PRIMARY KEY, manager_name TEXT, manager_id TEXT, message_id TEXT, thread_id TEXT);
+            CREATE TABLE IF NOT EXISTS manager_state (
+                manager_id TEXT PRIMARY KEY, last_activity TEXT);
+            CREATE TABLE IF NOT EXISTS rotation_state (
+                shift_column INTEGER PRIMARY KEY, row_number INTEGER);
+            CREATE TABLE IF NOT EXISTS tracker (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, ticket TEXT, manager_name TEXT, status TEXT);
+        ''')
+
+    def is_empty(self):
+        """True for a newly created database, used to seed it from GSheet on first run"""
+        with self.lock:
+            for table in ['ticket_state', 'manager_state', 'rotation_state']:
+                if self.connection.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is not None:
+                    return False
+            return True
+
+    def load_ticket_states(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT ticket, manager_name, manager_id, message_id, thread_id FROM ticket_state').fetchall()
+        return [TicketState(row[0], row[2], row[1], row[4], row[3]) for row in rows]
+
+    def append_ticket_state(self, jiraId, managerId, managerName, threadId, messageId):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO ticket_state VALUES (?, ?, ?, ?, ?)', (jiraId, managerName, str(managerId), messageId, threadId))
+
+    def update_ticket_state(self, jiraId, managerId, managerName, messageId):
+        with self.lock:
+            self.connection.execute('UPDATE ticket_state SET manager_name = ?, manager_id = ?, message_id = ? WHERE ticket = ?', (managerName, str(managerId), messageId, jiraId))
+
+    def remove_ticket_state(self, jiraId):
+        with self.lock:
+            self.connection.execute('DELETE FROM ticket_state WHERE ticket = ?', (jiraId,))
+
+    def load_manager_states(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT manager_id, last_activity FROM manager_state').fetchall()
+        return { row[0]: parser.parse(row[1]) for row in rows }
+
+    def save_manager_state(self, managerId, timestamp):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO manager_state VALUES (?, ?)', (managerId, str(timestamp)))
+
+    def load_rotation_rows(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT shift_column, row_number FROM rotation_state').fetchall()
+        return { row[0]: row[1] for row in rows }
+
+    def save_rotation_rows(self, rotationRowNumberByColumn):
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO rotation_state VALUES (?, ?)', list(rotationRowNumberByColumn.items()))
+
+    def append_tracker_rows(self, rows):
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                self.connection.executemany('INSERT INTO tracker (timestamp, ticket, manager_name, status) VALUES (?, ?, ?, ?)', rows)
+                self.connection.execute('COMMIT')
+            except:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def stop(self):
+        self.close()
\ No newline at end of file
@@ -0,0 +1,231 @@
+from gspread.utils import rowcol_to_a1
+import threading
+import traceback
+from RateLimiter import RateLimiter
+
+# Gathers cell writes to all worksheets of a spreadsheet over a short window and sends them in a single values.batchUpdate request.
+# Writes to the same cell merge and the last one wins. Batches are sent on the shared timer scheduler, not a thread of its own.
+class SheetWriteCoalescer():
+    MIN_RETRY_BACKOFF = 1.0
+    MAX_RETRY_BACKOFF = 300.0
+    # Rows added to a worksheet past the last row written, so its grid is not grown on every new row
+    GRID_GROWTH_ROWS = 100
+
+    write_window = 0.2
+    hold_count = 0
+    is_stopped = False
+    is_flush_scheduled = False
+    retry_backoff = 0
+    spreadsheet = None
+    rate_limiter = None
+    timer_scheduler = None
+    logger = None
+
+    def __init__(self, logger, spreadsheet, rateLimiter, timerScheduler, writeWindow=0.2):
+        self.condition = threading.Condition()
+        # Only one batch is sent at a time, so a batch never overtakes an earlier one
+        self.flush_lock = threading.Lock()
+        self.logger = logger
+        self.spreadsheet = spreadsheet
+        self.rate_limiter = rateLimiter
+        self.timer_scheduler = timerScheduler
+        # Unique per coalescer, the timer scheduler is shared by all spreadsheets
+        self.timer_key = ('SheetWriteCoalescer', id(self))
+        self.write_window = writeWindow
+        # Pending cells by (worksheet title, row number), each a dictionary of column number to value
+        self.pending_rows = {}
+        # Pending rows that are blank in the sheet, so their writes can be dropped instead of blanking them again
+        self.blank_rows = set()
+        # While held, writes keep gathering past the window
+        self.hold_count = 0
+        self.is_stopped = False
+        # Set from the first write till the batch it starts is sent, so later writes join it instead of starting another window
+        self.is_flush_scheduled = False
+        # While sends fail, retries back off exponentially
+        self.retry_backoff = 0
+        # Called once the writes queued before them are sent
+        self.flush_callbacks = []
+        # Worksheets whose grid is grown to fit rows written past its end, and their number of rows. Only used by the flush.
+        self.worksheets = {}
+        self.grid_row_counts = {}
+
+    def add_worksheet(self, worksheet):
+        """Rows written to the worksheet past the end of its grid are added to it before they are sent, as values.batchUpdate
+        does not add rows like an append does"""
+        with self.flush_lock:
+            self.worksheets[worksheet.title] = worksheet
+            self.grid_row_counts[worksheet.title] = worksheet.row_count
+
+    def write_row(self, sheetTitle, rowNumber, firstColumn, values, isBlankInSheet=False):
+        """Queue values for consecutive cells of a row starting at firstColumn. isBlankInSheet tells the row is known to be blank in the sheet."""
+        with self.condition:
+            key = (sheetTitle, rowNumber)
+            if key not in self.pending_rows:
+                self.pending_rows[key] = {}
+                if isBlankInSheet:
+                    self.blank_rows.add(key)
+            cells = self.pending_rows[key]
+            for offset, value in enumerate(values):
+                cells[firstColumn + offset] = value
+            self.schedule_flush()
+
+    def discard_row_if_blank_in_sheet(self, sheetTitle, rowNumber):
+        """Drop all pending writes of a row that is blank in the sheet, e.g. a row appended and removed in the same window.
+        Returns False if the row has to be written."""
+        with self.condition:
+            key = (sheetTitle, rowNumber)
+            if key not in self.blank_rows:
+                return False
+            self.blank_rows.discard(key)
+            self.pending_rows.pop(key, None)
+            return True
+
+    def call_when_flushed(self, callback):
+        """Call callback on the flusher once all writes queued so far are sent, retried if needed. Not called if stopped before."""
+        with self.condition:
+            if self.is_stopped:
+                return
+            self.flush_callbacks.append(callback)
+            self.schedule_flush()
+
+    def hold(self):
+        """Keep writes from being sent till release, so writes spread over a longer operation go in one request"""
+        with self.condition:
+            self.hold_count += 1
+
+    def release(self):
+        with self.condition:
+            self.hold_count -= 1
+            if self.hold_count == 0:
+                self.schedule_flush()
+
+    def stop(self):
+        """Stop the flusher and drop pending writes, used when the spreadsheet is abandoned without flushing"""
+        with self.condition:
+            self.is_stopped = True
+            self.pending_rows = {}
+            self.blank_rows = set()
+            self.flush_callbacks = []
+        self.timer_scheduler.cancel(self.timer_key)
+
+    def get_pending_count(self):
+        """Number of rows waiting to be written"""
+        with self.condition:
+            return len(self.pending_rows)
+
+    def schedule_flush(self):
+        """Send pending writes once the window is over, or the retry backoff after a failed send. Should be called holding the condition."""
+        if self.is_flush_scheduled or self.is_stopped or self.hold_count > 0:
+            return
+        if len(self.pending_rows) == 0 and len(self.flush_callbacks) == 0:
+            return
+        self.is_flush_scheduled = True
+        self.timer_scheduler.schedule(self.timer_key, max(self.write_window, self.retry_backoff), self.flush_on_timer)
+
+    def flush_on_timer(self):
+        """Runs on the timer worker pool when the window of the first pending write is over. Writes made while held are sent on release."""
+        with self.condition:
+            if self.is_stopped or self.hold_count > 0:
+                self.is_flush_scheduled = False
+                return
+        if self.flush():
+            self.retry_backoff = 0
+        else:
+            self.retry_backoff = min(max(self.retry_backoff * 2, self.MIN_RETRY_BACKOFF), self.MAX_RETRY_BACKOFF)
+        with self.condition:
+            self.is_flush_scheduled = False
+            self.schedule_flush()
+
+    def flush(self):
+        """Send all pending writes in one request and call the callbacks waiting for them. On failure the writes are put back unless
+        overwritten meanwhile, and the callbacks wait for the retry. Returns False if the request failed."""
+        with self.flush_lock:
+            with self.condition:
+                pendingRows = self.pending_rows
+                self.pending_rows = {}
+                self.blank_rows = set()
+                flushCallbacks = self.flush_callbacks
+                self.flush_callbacks = []
+            if len(pendingRows) > 0:
+                try:
+                    self.grow_grids(pendingRows)
+                    self.send_ranges(self.get_ranges(pendingRows))
+                except:
+                    with self.condition:
+                        for key, cells in pendingRows.items():
+                            # State of the row in the sheet is not known anymore
+                            self.blank_rows.discard(key)
+                            pendingCells = self.pending_rows.setdefault(key, {})
+                            for column, value in cells.items():
+                                pendingCells.setdefault(column, value)
+                        self.flush_callbacks[:0] = flushCallbacks
+                    self.logger.error(f"Error in flush of SheetWriteCoalescer, {len(pendingRows)} rows kept for retry: {traceback.format_exc()}")
+                    return False
+            for callback in flushCallbacks:
+                try:
+                    callback()
+                except:
+                    self.logger.error("Error in flush callback of SheetWriteCoalescer: " + traceback.format_exc())
+            return True
+
+    def send_ranges(self, ranges):
+        """Send ranges in one values.batchUpdate request. If GSheet rejects the request with an error that is not retried, e.g. a range
+        past the end of its grid, halves of it are sent to find the ranges it rejects. Those are logged and dropped, so they do not
+        hold back the other writes forever. Raises errors that are retried."""
+        try:
+            self.rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.spreadsheet.values_batch_update, None, { 'valueInputOption': 'RAW', 'data': ranges })
+            return
+        except Exception as exception:
+            statusCode = self.rate_limiter.get_status_code(exception)
+            if statusCode is None or self.rate_limiter.is_retryable(exception, statusCode):
+                raise
+            if len(ranges) == 1:
+                self.logger.error(f"Write of {ranges[0]['range']} dropped, rejected by GSheet: {traceback.format_exc()}")
+                return
+        middle = len(ranges) // 2
+        self.send_ranges(ranges[:middle])
+        self.send_ranges(ranges[middle:])
+
+    def grow_grids(self, pendingRows):
+        """Add rows to the worksheets whose pending rows are past the end of their grid. Should be called holding the flush lock."""
+        lastRowNumbers = {}
+        for sheetTitle, rowNumber in pendingRows:
+            lastRowNumbers[sheetTitle] = max(lastRowNumbers.get(sheetTitle, 0), rowNumber)
+        for sheetTitle, lastRowNumber in lastRowNumbers.items():
+            if sheetTitle not in self.worksheets or lastRowNumber <= self.grid_row_counts[sheetTitle]:
+                continue
+            rowCount = lastRowNumber + self.GRID_GROWTH_ROWS
+            self.rate_limiter.call(RateLimiter.PRIORITY_TICKETSTATE, self.worksheets[sheetTitle].resize, rowCount)
+            self.grid_row_counts[sheetTitle] = rowCount
+
+    def get_ranges(self, pendingRows):
+        """One range per run of consecutive cells in a row. Runs over the same columns of consecutive rows are merged in one range."""
+        openRanges = {}
+        ranges = []
+        for sheetTitle, rowNumber in sorted(pendingRows):
+            cells = pendingRows[(sheetTitle, rowNumber)]
+            for firstColumn, values in self.get_column_runs(cells):
+                rangeKey = (sheetTitle, firstColumn, len(values))
+                openRange = openRanges.get(rangeKey)
+                if openRange is None or openRange['lastRow'] != rowNumber - 1:
+                    openRange = { 'sheetTitle': sheetTitle, 'firstRow': rowNumber, 'lastRow': rowNumber, 'firstColumn': firstColumn, 'values': [] }
+                    openRanges[rangeKey] = openRange
+                    ranges.append(openRange)
+                openRange['lastRow'] = rowNumber
+                openRange['values'].append(values)
+        return [{ 'range': self.get_a1_range(openRange), 'values': openRange['values'] } for openRange in ranges]
+
+    def get_column_runs(self, cells):
+        """Split cells of a row into (first column, values) runs of consecutive columns"""
+        runs = []
+        for column in sorted(cells):
+            if len(runs) > 0 and runs[-1][0] + len(runs[-1][1]) == column:
+                runs[-1][1].append(cells[column])
+            else:
+                runs.append((column, [cells[column]]))
+        return runs
+
+    def get_a1_range(self, openRange):
+        lastColumn = openRange['firstColumn'] + len(openRange['values'][0]) - 1
+        sheetTitle = openRange['sheetTitle'].replace("'", "''")
+        return f"'{sheetTitle}'!{rowcol_to_a1(openRange['firstRow'], openRange['firstColumn'])}:{rowcol_to_a1(openRange['lastRow'], lastColumn)}"
\ No newline at end of file
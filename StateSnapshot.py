@@ -0,0 +1,51 @@
+from datetime import datetime
+import json
+import os
+import sys
+from TicketState import TicketState
+
+# Local copy of configuration, managers by shift, ticket states, manager dnd timestamps and rotation rows, so a restart can serve
+# right away from it while the sheets are loaded in the background
+class StateSnapshot():
+    # Version 1 kept the rows of the Managers sheet as they were loaded
+    SNAPSHOT_VERSION = 2
+
+    snapshot_path = 'rcabot-snapshot.json'
+
+    def __init__(self, snapshotPath):
+        self.snapshot_path = snapshotPath
+
+    def load(self):
+        """Returns the saved snapshot, or None if there is none or it is from another version.
+        Ticket states are returned as TicketState records, managers as ManagerRotationIndex.parse_managers returns them,
+        manager dnd timestamps as datetimes and rotation rows keyed by column number."""
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, 'r') as snapshotFile:
+            snapshot = json.load(snapshotFile)
+        if snapshot.get('version') != self.SNAPSHOT_VERSION:
+            return None
+        snapshot['managers'] = { int(shift): [(rowNumber, sys.intern(managerId)) for rowNumber, managerId in entries] for shift, entries in snapshot['managers'].items() }
+        snapshot['ticketStates'] = [TicketState.from_sheet_record(record) for record in snapshot['ticketStates']]
+        snapshot['managerStates'] = { managerId: datetime.fromisoformat(timestamp) for managerId, timestamp in snapshot['managerStates'].items() }
+        snapshot['rotationRows'] = { int(column): rowNumber for column, rowNumber in snapshot['rotationRows'].items() }
+        return snapshot
+
+    def save(self, configurationMap, managerEntriesByShift, managersHash, ticketStates, managerStates, rotationRowNumberByColumn):
+        """Write the snapshot to a temporary file first and move it in place, so a crash never leaves a partial snapshot"""
+        snapshot = {
+            'version': self.SNAPSHOT_VERSION,
+            'savedAt': datetime.utcnow().isoformat(),
+            'configuration': configurationMap,
+            'managers': managerEntriesByShift,
+            'managersHash': managersHash,
+            'ticketStates': [ticketState.to_sheet_record() for ticketState in ticketStates],
+            'managerStates': { managerId: timestamp.isoformat() for managerId, timestamp in managerStates.items() },
+            'rotationRows': rotationRowNumberByColumn
+        }
+        temporaryPath = self.snapshot_path + '.tmp'
+        with open(temporaryPath, 'w') as snapshotFile:
+            json.dump(snapshot, snapshotFile)
+            snapshotFile.flush()
+            os.fsync(snapshotFile.fileno())
+        os.replace(temporaryPath, self.snapshot_path)
\ No newline at end of file
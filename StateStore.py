@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+
+# Storage interface for application state: ticket states, manager dnd timestamps, rotation rows and tracker data.
+# Ticket states are TicketState records, the column headers are those of the TicketState sheet.
+class StateStore():
+    # Ticket State column headers
+    TICKET_ID_COL = 'Ticket'
+    THREAD_ID_COL = 'Thread ID'
+    MESSAGE_ID_COL = 'Message ID'
+    MANAGER_ID_COL = 'Manager GChat ID'
+    MANAGER_NAME_COL = 'Manager Name'
+
+    # Row of StateManagement sheet holding last row of manager per shift column
+    ROTATION_ROW_NUMBER = 4
+
+    def load_ticket_states(self):
+        """Returns list of all TicketState records"""
+        raise NotImplementedError()
+
+    def append_ticket_state(self, jiraId, managerId, managerName, threadId, messageId):
+        raise NotImplementedError()
+
+    def update_ticket_state(self, jiraId, managerId, managerName, messageId):
+        raise NotImplementedError()
+
+    def remove_ticket_state(self, jiraId):
+        raise NotImplementedError()
+
+    def load_manager_states(self):
+        """Returns dictionary of manager id to last activity timestamp"""
+        raise NotImplementedError()
+
+    def save_manager_state(self, managerId, timestamp):
+        raise NotImplementedError()
+
+    def load_rotation_rows(self):
+        """Returns dictionary of StateManagement column number to last row of manager"""
+        raise NotImplementedError()
+
+    def save_rotation_rows(self, rotationRowNumberByColumn):
+        raise NotImplementedError()
+
+    def append_tracker_rows(self, rows):
+        raise NotImplementedError()
+
+    @contextmanager
+    def hold_writes(self):
+        """Optional, writes made in the with block are sent to the backend together"""
+        yield
+
+    def call_when_written(self, callback):
+        """Call callback once the writes made so far are stored in the backend. Stores that write right away call it right away."""
+        callback()
+
+    def compact(self):
+        """Optional housekeeping, run on a timer"""
+        pass
+
+    def close(self):
+        pass
+
+    def stop(self):
+        """Stop background work without writing anything pending, used when the application fails to start"""
+        pass
\ No newline at end of file
@@ -0,0 +1,47 @@
+import threading
+
+# A team served by the bot. It has its own Shift Automation GSheet, Chat space, ticket states, rotation, dnd and timeouts.
+class Tenant():
+    name = ''
+    gsheet_manager = None
+    timeout_handler = None
+
+    def __init__(self, gSheetManager):
+        self.name = gSheetManager.spreadsheet_name
+        self.gsheet_manager = gSheetManager
+
+# Tenants of the process by name (their spreadsheet name) and by the Chat space they are configured with
+class TenantRegistry():
+    default_tenant = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tenants_by_name = {}
+        self.tenants_by_space = {}
+
+    def register(self, tenant):
+        """The first tenant registered is the default one, which gets events that name no tenant or space"""
+        with self.lock:
+            if self.default_tenant is None:
+                self.default_tenant = tenant
+            self.tenants_by_name[tenant.name] = tenant
+        self.update_space_routes()
+
+    def update_space_routes(self):
+        """Index tenants by space again, to be called when a tenant's configuration is reloaded"""
+        with self.lock:
+            self.tenants_by_space = { tenant.gsheet_manager.space_id: tenant for tenant in self.tenants_by_name.values() }
+
+    def get_tenant(self, tenantName=None, spaceName=None):
+        """Tenant of an event by its tenant name, else by the Chat space it comes from, else the default tenant.
+        Returns None if the event names a tenant or space that is not served. With a single tenant, events of any space go to it."""
+        with self.lock:
+            if tenantName is not None:
+                return self.tenants_by_name.get(tenantName)
+            if spaceName is not None:
+                return self.tenants_by_space.get(spaceName, self.default_tenant if len(self.tenants_by_name) == 1 else None)
+            return self.default_tenant
+
+    def get_tenants(self):
+        with self.lock:
+            return list(self.tenants_by_name.values())
\ No newline at end of file
@@ -0,0 +1,43 @@
+import sys
+from StateStore import StateStore
+
+# Ticket in the cycle: its Google Chat thread and message and the manager it is with. Ids are parsed and interned once when a record
+# is created, so records loaded from the sheets, the databases and the snapshot share the id strings of the Managers sheet.
+# Timeout handlers keep their own record of each ticket on timer, with the state of its timer and the manager it is timing out for.
+class TicketState():
+    __slots__ = ('jira_id', 'manager_id', 'manager_name', 'thread_id', 'message_id', 'is_declined', 'is_firing')
+
+    # Manager id of a ticket that no manager could be pinged for
+    NO_MANAGER_ID = '0'
+
+    def __init__(self, jiraId, managerId, managerName='', threadId='', messageId=''):
+        self.jira_id = sys.intern(str(jiraId))
+        self.manager_id = sys.intern(str(managerId))
+        self.manager_name = managerName
+        self.thread_id = threadId
+        self.message_id = messageId
+        self.is_declined = False
+        self.is_firing = False
+
+    @staticmethod
+    def get_manager_id(managerId):
+        """Manager ids are numbers when loaded from the sheet and text otherwise"""
+        return sys.intern(str(managerId))
+
+    @classmethod
+    def from_sheet_record(cls, record):
+        """Record of the TicketState sheet, keyed by its column headers"""
+        return cls(record[StateStore.TICKET_ID_COL], record[StateStore.MANAGER_ID_COL], record[StateStore.MANAGER_NAME_COL], record[StateStore.THREAD_ID_COL], record[StateStore.MESSAGE_ID_COL])
+
+    def to_sheet_record(self):
+        return { StateStore.TICKET_ID_COL: self.jira_id, StateStore.THREAD_ID_COL: self.thread_id, StateStore.MANAGER_ID_COL: self.manager_id, StateStore.MANAGER_NAME_COL: self.manager_name, StateStore.MESSAGE_ID_COL: self.message_id }
+
+    def with_manager(self, managerId, managerName, messageId):
+        """Copy of the record moved on to another manager, records in the ticket state map are never modified"""
+        return TicketState(self.jira_id, managerId, managerName, self.thread_id, messageId)
+
+    def has_manager(self, managerId):
+        return self.manager_id == self.get_manager_id(managerId)
+
+    def is_same_assignment(self, otherRecord):
+        return otherRecord is not None and self.manager_id == otherRecord.manager_id
\ No newline at end of file
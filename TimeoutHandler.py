@@ -1,122 +1,182 @@
-from TimerEventObjData import TimerEventObjData
-import threading
-import httplib2
+from TicketState import TicketState
+from TimerScheduler import TimerScheduler
+from InstrumentedLock import InstrumentedLock
+from Metrics import operationLatency
 import json
+import time
 import traceback
 
 EVENTTYPE_MESSAGE = "MESSAGE"
 RESPONSEDATA_ISMANAGERTIMEOUT = "isManagerTimeout"
 RESPONSEDATA_ISINTERNALRESTREQUEST = "isInternalRestRequest"
+RESPONSEDATA_TIMELEFT = "timeLeft"
+RESPONSEDATA_TENANT = "tenant"
 RESPONSEDATA_TRUE = "True"
 
+# How a timed out ticket is handed back to the application
+TIMEOUTDISPATCHMODE_INPROCESS = "InProcess"
+TIMEOUTDISPATCHMODE_RESTREQUEST = "RestRequest"
+
 class TimeoutHandler():
-    ticket_id_col = 'Ticket'
-    manager_id_col = 'Manager GChat ID'
     tickets_on_timer = {}
     timeout_for_ticket = 300.0
     url_for_rest_request = ''
+    timeout_dispatch_mode = TIMEOUTDISPATCHMODE_INPROCESS
+    timeout_dispatcher = None
+    timer_scheduler = None
+    tenant_name = ''
     logger = None
 
-    def __init__(self, logger, timeout, urlForRestRequest, list_of_cached_ticket_states, ticket_id_col, manager_id_col):
-        self.lock = threading.Lock()
+    def __init__(self, logger, timeout, urlForRestRequest, list_of_cached_ticket_states, numberOfTimeoutWorkers=4, timeoutDispatcher=None, timeoutDispatchMode=TIMEOUTDISPATCHMODE_INPROCESS, timerScheduler=None, tenantName=''):
+        self.lock = InstrumentedLock('TimeoutHandler.lock')
         self.logger = logger
         self.tickets_on_timer = {}
         self.timeout_for_ticket = timeout
         self.url_for_rest_request = urlForRestRequest
-        self.ticket_id_col = ticket_id_col
-        self.manager_id_col = manager_id_col
+        # Called as timeoutDispatcher(jiraId, isManagerTimeout) and returns the same data as the rest request response
+        self.timeout_dispatcher = timeoutDispatcher
+        self.timeout_dispatch_mode = timeoutDispatchMode
+        # All ticket timeouts share one dispatcher thread and a small worker pool, so thread count does not grow with tickets.
+        # Timeout handlers of all tenants can share the same scheduler, their timers are then keyed by tenant name.
+        self.tenant_name = tenantName
+        self.timer_scheduler = TimerScheduler(logger, numberOfTimeoutWorkers) if timerScheduler is None else timerScheduler
 
         self.add_cached_tickets_to_thread(list_of_cached_ticket_states)
     
     def add_cached_tickets_to_thread(self, list_of_cached_ticket_states):
-        """When loading ticket states from GSheet during initialization, the timeout threads of the tickets are added."""
+        """When loading ticket states from GSheet during initialization, the timeouts of the tickets are scheduled."""
         try:
             if len(list_of_cached_ticket_states) > 0:
                 for key, value in list_of_cached_ticket_states.items():
-                    self.add_thread(value[self.ticket_id_col], value[self.manager_id_col], self.timeout_for_ticket)
+                    self.add_thread(value.jira_id, value.manager_id, self.timeout_for_ticket)
         except:
             self.logger.error("Error in add_cached_tickets_to_thread in TimeoutHandler: " + traceback.format_exc())
 
+    def get_timer_key(self, jiraId):
+        """Key of the ticket's timer in the timer scheduler, which may be shared with other tenants"""
+        return (self.tenant_name, jiraId)
+
     def update_ticket_states_during_runtime(self, removedRecordsList, allNewRecordsList):
-        """When loading ticket states from GSheet during runtime, the timeout threads of the tickets are removed/added.
+        """When loading ticket states from GSheet during runtime, the timeouts of the tickets are removed/added.
         This is implemented only for unforeseen circumstances and should be avoided."""
         with self.lock:
             for record in removedRecordsList:
-                timerEventObjData = self.tickets_on_timer.pop(record[self.ticket_id_col], None)
-                if timerEventObjData is not None:
-                    timerEventObjData.isDeclined = False
-                    timerEventObjData.eventObject.set()
+                if self.tickets_on_timer.pop(record.jira_id, None) is not None:
+                    self.timer_scheduler.cancel(self.get_timer_key(record.jira_id))
         for record in allNewRecordsList:
-            self.add_thread(record[self.ticket_id_col], record[self.manager_id_col], self.timeout_for_ticket)
+            self.add_thread(record.jira_id, record.manager_id, self.timeout_for_ticket)
 
-    def update_properties(self, timeout, urlForRestRequest):
+    def update_properties(self, timeout, urlForRestRequest, timeoutDispatchMode=TIMEOUTDISPATCHMODE_INPROCESS):
         """When loading configuration from GSheet during runtime, update the timeout properties as well."""
         with self.lock:
             self.timeout_for_ticket = timeout
             self.url_for_rest_request = urlForRestRequest
+            self.timeout_dispatch_mode = timeoutDispatchMode
 
     def add_thread(self, jiraId, managerId, timeout=0):
-        """Create a timeout thread for ticket."""
+        """Schedule a timeout for ticket."""
         with self.lock:
             if jiraId not in self.tickets_on_timer:
                 if timeout == 0:
                     timeout = self.timeout_for_ticket
-                eventObject = threading.Event()
-                timerEventObjData = TimerEventObjData(jiraId, managerId, eventObject)
-                threadObject = threading.Thread(target=self.send_rest_request, args=(timerEventObjData, timeout, ))
-                threadObject.name = jiraId
-                self.tickets_on_timer[jiraId] = timerEventObjData
-                threadObject.start()
+                timerTicketState = TicketState(jiraId, managerId)
+                self.tickets_on_timer[jiraId] = timerTicketState
+                self.timer_scheduler.schedule(self.get_timer_key(jiraId), timeout, self.send_rest_request, timerTicketState)
 
     def remove_thread_on_response(self, jiraId, managerId, isDeclined):
-        """Interrupt a timeout thread for ticket. Remove thread completely in case it is accepted."""
+        """Interrupt the timeout of ticket, firing it right away on decline. Remove it completely in case it is accepted."""
+        with self.lock:
+            timerTicketState = self.tickets_on_timer.get(jiraId)
+            if timerTicketState is not None and timerTicketState.has_manager(managerId):
+                if not timerTicketState.is_firing:
+                    if isDeclined:
+                        timerTicketState.is_declined = True
+                        timerTicketState.is_firing = True
+                        self.timer_scheduler.schedule(self.get_timer_key(jiraId), 0, self.send_rest_request, timerTicketState)
+                    else:
+                        self.timer_scheduler.cancel(self.get_timer_key(jiraId))
+                        self.tickets_on_timer.pop(jiraId, None)
+
+    def expire_thread(self, jiraId, managerId):
+        """Time out the ticket for its manager right away, e.g. when the manager was removed. Ignored if the ticket moved on to another manager."""
+        with self.lock:
+            timerTicketState = self.tickets_on_timer.get(jiraId)
+            if timerTicketState is not None and timerTicketState.has_manager(managerId) and not timerTicketState.is_firing:
+                timerTicketState.is_firing = True
+                self.timer_scheduler.schedule(self.get_timer_key(jiraId), 0, self.send_rest_request, timerTicketState)
+
+    def send_rest_request(self, timerTicketState):
+        """Runs on the timer worker pool whenever ticket times out or is declined, and reschedules the next timeout."""
+        with self.lock:
+            if self.tickets_on_timer.get(timerTicketState.jira_id) is not timerTicketState:
+                return
+            timerTicketState.is_firing = True
+            isManagerTimeout = timerTicketState.manager_id != TicketState.NO_MANAGER_ID and not timerTicketState.is_declined
+            timerTicketState.is_declined = False
+            timeoutForTicket = self.timeout_for_ticket
+        try:
+            responseData = self.dispatch_timeout(timerTicketState.jira_id, isManagerTimeout)
+            if responseData is not None:
+                timerTicketState.manager_id = TicketState.get_manager_id(responseData['managerId'])
+                if timerTicketState.manager_id == TicketState.NO_MANAGER_ID:
+                    # When all managers are busy/dnd, managerId is 0 in response
+                    timeoutForTicket = int(responseData['newTimeOut'])
+        except:
+            self.logger.error(f"Error in timeout for {timerTicketState.jira_id}: {traceback.format_exc()}")
+        finally:
+            with self.lock:
+                timerTicketState.is_firing = False
+                if self.tickets_on_timer.get(timerTicketState.jira_id) is timerTicketState:
+                    self.timer_scheduler.schedule(self.get_timer_key(timerTicketState.jira_id), timeoutForTicket, self.send_rest_request, timerTicketState)
+
+    def dispatch_timeout(self, jiraId, isManagerTimeout, deadline=None):
+        """Hand a timed out or declined ticket back to the application. Returns the response data or None.
+        deadline is a time.monotonic() value, Google Chat requests for the ticket are given up after it."""
         with self.lock:
-            timerEventObjData = self.tickets_on_timer.get(jiraId)
-            if timerEventObjData is not None and timerEventObjData.managerId == int(managerId):
-                if not timerEventObjData.eventObject.is_set():
-                    timerEventObjData.isDeclined = isDeclined
-                    timerEventObjData.eventObject.set()
-                    if not isDeclined:
-                        timerEventObjData = self.tickets_on_timer.pop(jiraId, None)
-
-    def send_rest_request(self, timerEventObjData, timeoutForTicket):
-        """Timeout thread of the ticket used to send rest requests whenever ticket times out."""
-        while (True):
-            timerEventObjData.eventObject.clear()
-            timerEventObjData.eventObject.wait(timeout=timeoutForTicket) 
-            if timerEventObjData.eventObject.is_set() and timerEventObjData.isDeclined == False:
-                break
-            try:
-                timeoutForTicket = self.timeout_for_ticket
-                isManagerTimeout = timerEventObjData.managerId != 0 and not timerEventObjData.isDeclined
-                timerEventObjData.isDeclined = False
-                http = httplib2.Http()
-                if isManagerTimeout:
-                    body =  {
-                                "type":EVENTTYPE_MESSAGE,
-                                "jiraId":timerEventObjData.jiraId,
-                                RESPONSEDATA_ISINTERNALRESTREQUEST: RESPONSEDATA_TRUE,
-                                RESPONSEDATA_ISMANAGERTIMEOUT:isManagerTimeout
-                            }
-                else:
-                    body =  {
-                                "type":EVENTTYPE_MESSAGE,
-                                "jiraId":timerEventObjData.jiraId,
-                                RESPONSEDATA_ISINTERNALRESTREQUEST: RESPONSEDATA_TRUE
-                            }
-
-                response, content = http.request(self.url_for_rest_request, 
-                                    method="POST", 
-                                    headers={'Content-type': 'application/json'},
-                                    body=json.dumps(body))
-                
-                if response.status  == 200:
-                    responseData = json.loads(content)
-                    timerEventObjData.managerId = int(responseData['managerId'])
-                    if timerEventObjData.managerId == 0:
-                        # When all managers are busy/dnd, managerId is 0 in response
-                        timeoutForTicket = int(responseData['newTimeOut'])
-                else:
-                    self.logger.warning(f"Invalid response received in timeout for {timerEventObjData.jiraId}: {response}")
-            except:
-                self.logger.error(f"Error in timeout for {timerEventObjData.jiraId}: {traceback.format_exc()}")
\ No newline at end of file
+            urlForRestRequest = self.url_for_rest_request
+            isInProcessDispatch = self.timeout_dispatcher is not None and self.timeout_dispatch_mode != TIMEOUTDISPATCHMODE_RESTREQUEST
+        with operationLatency.time('ticket_timeout'):
+            if isInProcessDispatch:
+                return self.timeout_dispatcher(jiraId, isManagerTimeout, deadline)
+            return self.send_timeout_rest_request(urlForRestRequest, jiraId, isManagerTimeout, deadline)
+
+    def get_timer_count(self):
+        """Number of tickets on timer"""
+        with self.lock:
+            return len(self.tickets_on_timer)
+
+    def send_timeout_rest_request(self, urlForRestRequest, jiraId, isManagerTimeout, deadline=None):
+        """Loopback request to the application for a timed out ticket, only used for multi process setups.
+        Returns the response data or None if the request failed. With a deadline, the time left till it is sent along,
+        and the request is not waited on past it."""
+        # Imported here, as it is only needed in RestRequest mode and adds to the import time of the application
+        import httplib2
+        timeLeft = None if deadline is None else max(deadline - time.monotonic(), 1.0)
+        http = httplib2.Http(timeout=timeLeft)
+        if isManagerTimeout:
+            body =  {
+                        "type":EVENTTYPE_MESSAGE,
+                        "jiraId":jiraId,
+                        RESPONSEDATA_ISINTERNALRESTREQUEST: RESPONSEDATA_TRUE,
+                        RESPONSEDATA_ISMANAGERTIMEOUT:isManagerTimeout
+                    }
+        else:
+            body =  {
+                        "type":EVENTTYPE_MESSAGE,
+                        "jiraId":jiraId,
+                        RESPONSEDATA_ISINTERNALRESTREQUEST: RESPONSEDATA_TRUE
+                    }
+        if self.tenant_name != '':
+            body[RESPONSEDATA_TENANT] = self.tenant_name
+        if timeLeft is not None:
+            body[RESPONSEDATA_TIMELEFT] = timeLeft
+
+        response, content = http.request(urlForRestRequest, 
+                            method="POST", 
+                            headers={'Content-type': 'application/json'},
+                            body=json.dumps(body))
+        
+        if response.status  == 200:
+            return json.loads(content)
+        self.logger.warning(f"Invalid response received in timeout for {jiraId}: {response}")
+        return None
\ No newline at end of file
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from Metrics import operationLatency
+
+# Single dispatcher thread backed by a heap of deadlines, shared by all timers instead of one sleeping thread per timer
+class TimerScheduler():
+    number_of_workers = 4
+    is_shut_down = False
+    logger = None
+
+    def __init__(self, logger, numberOfWorkers=4):
+        self.condition = threading.Condition()
+        self.logger = logger
+        self.number_of_workers = numberOfWorkers
+        # Heap entries are (deadline, sequence, key, callback, args). Sequence is unique so entries never compare further.
+        self.heap = []
+        # Sequence of the live entry per key, entries with any other sequence are stale and skipped on pop
+        self.timers = {}
+        self.sequence = itertools.count(1)
+        self.is_shut_down = False
+        self.executor = ThreadPoolExecutor(max_workers=numberOfWorkers, thread_name_prefix='TimerWorker')
+        self.dispatcher = threading.Thread(target=self.dispatch_expired_timers, name='TimerDispatcher', daemon=True)
+        self.dispatcher.start()
+
+    def schedule(self, key, delay, callback, *args):
+        """Schedule callback(*args) to run after delay seconds. Replaces any pending timer for the same key."""
+        with self.condition:
+            if self.is_shut_down:
+                return
+            sequence = next(self.sequence)
+            self.timers[key] = sequence
+            heapq.heappush(self.heap, (time.monotonic() + max(delay, 0), sequence, key, callback, args))
+            self.compact_heap()
+            self.condition.notify()
+
+    def update_number_of_workers(self, numberOfWorkers):
+        """Resize the worker pool once the configuration is loaded. Callbacks already handed to the old pool still run on it."""
+        with self.condition:
+            if self.is_shut_down or numberOfWorkers == self.number_of_workers:
+                return
+            oldExecutor = self.executor
+            self.number_of_workers = numberOfWorkers
+            self.executor = ThreadPoolExecutor(max_workers=numberOfWorkers, thread_name_prefix='TimerWorker')
+        oldExecutor.shutdown(wait=False)
+
+    def cancel(self, key):
+        """Cancel pending timer for key. Returns False if there was none."""
+        with self.condition:
+            return self.timers.pop(key, None) is not None
+
+    def get_pending_count(self):
+        """Number of timers currently waiting to fire"""
+        with self.condition:
+            return len(self.timers)
+
+    def shutdown(self):
+        """Drop all pending timers and stop the dispatcher and workers. Callbacks already running are left to finish."""
+        with self.condition:
+            self.is_shut_down = True
+            self.heap = []
+            self.timers = {}
+            executor = self.executor
+            self.condition.notify()
+        executor.shutdown(wait=False)
+
+    def compact_heap(self):
+        """Drop stale entries left behind by cancel and reschedule so heap size stays proportional to live timers"""
+        if len(self.heap) > 2 * len(self.timers) + 64:
+            self.heap = [entry for entry in self.heap if self.timers.get(entry[2]) == entry[1]]
+            heapq.heapify(self.heap)
+
+    def dispatch_expired_timers(self):
+        """Dispatcher loop, sleeps till the earliest deadline and hands expired timers to the worker pool"""
+        while (True):
+            with self.condition:
+                while (True):
+                    if self.is_shut_down:
+                        return
+                    if len(self.heap) == 0:
+                        self.condition.wait()
+                        continue
+                    deadline, sequence, key, callback, args = self.heap[0]
+                    waitTime = deadline - time.monotonic()
+                    if waitTime > 0:
+                        self.condition.wait(timeout=waitTime)
+                        continue
+                    heapq.heappop(self.heap)
+                    if self.timers.get(key) == sequence:
+                        del self.timers[key]
+                        # Taken under the condition, as update_number_of_workers may replace the pool
+                        executor = self.executor
+                        break
+            try:
+                executor.submit(self.run_callback, key, deadline, callback, args)
+            except:
+                self.logger.error(f"Error in dispatch_expired_timers for {key}: {traceback.format_exc()}")
+
+    def run_callback(self, key, deadline, callback, args):
+        # How late the timer runs after its deadline, including the wait for a free worker
+        operationLatency.observe(time.monotonic() - deadline, 'timer_lag')
+        try:
+            callback(*args)
+        except:
+            self.logger.error(f"Error in timer callback for {key}: {traceback.format_exc()}")
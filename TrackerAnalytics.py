@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import bisect
+import threading
+
+# Ticket status for the tracker.
+TICKET_STATUS_PINGED = 'Pinged'
+TICKET_STATUS_ACCEPTED = 'Accepted'
+TICKET_STATUS_DECLINED = 'Declined'
+TICKET_STATUS_TIMEDOUT = 'TimedOut'
+TICKET_STATUS_COMPLETED = 'Completed'
+
+# Bucket upper bounds in seconds of the time a manager takes to accept or decline a ticket
+RESPONSE_TIME_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 14400)
+EPOCH = datetime(1970, 1, 1)
+
+# Counts by status and response times of the tracker events of a manager, a shift or all of them
+class TrackerStatistics():
+    def __init__(self):
+        self.counts_by_status = {}
+        # Count of each bucket (not cumulative, last one is +Inf)
+        self.response_time_counts = [0] * (len(RESPONSE_TIME_BUCKETS) + 1)
+        self.response_time_sum = 0.0
+
+    def count(self, status):
+        self.counts_by_status[status] = self.counts_by_status.get(status, 0) + 1
+
+    def observe_response_time(self, responseTime):
+        self.response_time_counts[bisect.bisect_left(RESPONSE_TIME_BUCKETS, responseTime)] += 1
+        self.response_time_sum += responseTime
+
+    def get_rate(self, status):
+        """Fraction of pings that ended in status"""
+        pingCount = self.counts_by_status.get(TICKET_STATUS_PINGED, 0)
+        return round(self.counts_by_status.get(status, 0) / pingCount, 4) if pingCount > 0 else None
+
+    def to_dict(self):
+        responseCount = sum(self.response_time_counts)
+        cumulativeCount = 0
+        responseTimeBuckets = []
+        for bucket, count in zip(RESPONSE_TIME_BUCKETS + ('+Inf', ), self.response_time_counts):
+            cumulativeCount += count
+            responseTimeBuckets.append({ 'le': bucket, 'count': cumulativeCount })
+        return {
+            'counts': dict(self.counts_by_status),
+            'acceptRate': self.get_rate(TICKET_STATUS_ACCEPTED),
+            'declineRate': self.get_rate(TICKET_STATUS_DECLINED),
+            'timeoutRate': self.get_rate(TICKET_STATUS_TIMEDOUT),
+            'averageResponseTime': round(self.response_time_sum / responseCount, 1) if responseCount > 0 else None,
+            'responseTimeBuckets': responseTimeBuckets
+        }
+
+# Rolling aggregates of the tracker events, updated as each event is added to the tracker so they can be read without the Tracker sheet.
+# Memory is bounded by the number of managers, shifts and tickets waiting, not by the number of events.
+class TrackerAnalytics():
+    HOURS_IN_WINDOW = 24
+    MAX_WAITING_TICKETS = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = datetime.utcnow()
+        self.total_statistics = TrackerStatistics()
+        self.statistics_by_manager = {}
+        self.statistics_by_shift = {}
+        # Tickets pinged and not yet accepted, declined or timed out by jiraId, as (manager name, pinged time) in order of ping
+        self.waiting_tickets = OrderedDict()
+        # Counts by status of each of the last HOURS_IN_WINDOW hours, in a ring of (hour number, counts)
+        self.hourly_counts = [(0, {})] * self.HOURS_IN_WINDOW
+
+    def record(self, timestamp, jiraId, managerName, status, shift):
+        """Add a tracker event, timestamp is a UTC datetime"""
+        with self.lock:
+            managerStatistics = self.statistics_by_manager.get(managerName)
+            if managerStatistics is None:
+                managerStatistics = self.statistics_by_manager[managerName] = TrackerStatistics()
+            shiftStatistics = self.statistics_by_shift.get(shift)
+            if shiftStatistics is None:
+                shiftStatistics = self.statistics_by_shift[shift] = TrackerStatistics()
+            for statistics in (self.total_statistics, managerStatistics, shiftStatistics):
+                statistics.count(status)
+            self.count_in_hour(timestamp, status)
+
+            if status == TICKET_STATUS_PINGED:
+                self.waiting_tickets.pop(jiraId, None)
+                self.waiting_tickets[jiraId] = (managerName, timestamp)
+                if len(self.waiting_tickets) > self.MAX_WAITING_TICKETS:
+                    self.waiting_tickets.popitem(last=False)
+            elif status in (TICKET_STATUS_ACCEPTED, TICKET_STATUS_DECLINED, TICKET_STATUS_TIMEDOUT):
+                waitingTicket = self.waiting_tickets.pop(jiraId, None)
+                if waitingTicket is not None and status != TICKET_STATUS_TIMEDOUT:
+                    responseTime = max(0.0, (timestamp - waitingTicket[1]).total_seconds())
+                    for statistics in (self.total_statistics, managerStatistics, shiftStatistics):
+                        statistics.observe_response_time(responseTime)
+
+    def count_in_hour(self, timestamp, status):
+        """Should be called holding the lock"""
+        hourNumber = int((timestamp - EPOCH).total_seconds() // 3600)
+        slot = hourNumber % self.HOURS_IN_WINDOW
+        slotHourNumber, counts = self.hourly_counts[slot]
+        if slotHourNumber != hourNumber:
+            counts = {}
+            self.hourly_counts[slot] = (hourNumber, counts)
+        counts[status] = counts.get(status, 0) + 1
+
+    def get_summary(self):
+        """All aggregates since start, ready to be serialized to JSON"""
+        now = datetime.utcnow()
+        currentHourNumber = int((now - EPOCH).total_seconds() // 3600)
+        with self.lock:
+            oldestWaitingTicket = next(iter(self.waiting_tickets.items()), None)
+            return {
+                'since': self.start_time.isoformat(),
+                'total': self.total_statistics.to_dict(),
+                'byShift': { str(shift): statistics.to_dict() for shift, statistics in sorted(self.statistics_by_shift.items()) },
+                'byManager': { managerName: statistics.to_dict() for managerName, statistics in self.statistics_by_manager.items() },
+                'lastHours': [
+                    { 'hour': (EPOCH + timedelta(hours=hourNumber)).isoformat(), 'counts': dict(counts) }
+                    for hourNumber, counts in sorted(self.hourly_counts, key=lambda hourlyCounts: hourlyCounts[0]) if hourNumber > currentHourNumber - self.HOURS_IN_WINDOW
+                ],
+                'waiting': {
+                    'count': len(self.waiting_tickets),
+                    'oldestTicket': None if oldestWaitingTicket is None else oldestWaitingTicket[0],
+                    'oldestWaitTime': None if oldestWaitingTicket is None else round((now - oldestWaitingTicket[1][1]).total_seconds(), 1)
+                }
+            }
\ No newline at end of file
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+import fcntl
+import json
+import os
+import threading
+import traceback
+
+# Local append-only journal of intended ticket transitions and tracker rows. A record is appended before its side effects run
+# and marked done once they are all applied, records not marked done are replayed on the next start.
+# Appends made at the same time by different requests are written with a single fsync (group commit).
+class TransitionJournal():
+    # The journal is rewritten with only the records not done once it grows past this size
+    COMPACTION_SIZE = 4000000
+
+    journal_path = 'rcabot-journal.jsonl'
+    logger = None
+
+    def __init__(self, logger, journalPath):
+        self.condition = threading.Condition()
+        self.logger = logger
+        self.journal_path = self.lock_journal_path(journalPath)
+        # Records not done by sequence, the ones loaded from the journal are replayed by the application
+        self.records_not_done = self.load_records_not_done()
+        self.records_to_replay = list(self.records_not_done.items())
+        self.next_sequence = max(self.records_not_done.keys(), default=0) + 1
+        # Lines waiting for the writer, and the last sequence that reached the disk
+        self.pending_lines = []
+        self.last_queued_sequence = self.next_sequence - 1
+        self.last_durable_sequence = self.last_queued_sequence
+        self.is_closed = False
+        self.compact()
+        threading.Thread(target=self.run_writer, name='JournalWriter', daemon=True).start()
+
+    def lock_journal_path(self, journalPath):
+        """Every process of the host journals to its own file. The first journal path not locked by another process is taken,
+        so a restarted process picks up the journal left behind by the one it replaces."""
+        pathWithoutExtension, extension = os.path.splitext(journalPath)
+        processNumber = 0
+        while (True):
+            path = journalPath if processNumber == 0 else f"{pathWithoutExtension}-{processNumber}{extension}"
+            # Lock is kept in a separate file, as compaction replaces the journal file
+            self.lock_file = open(path + '.lock', 'a')
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return path
+            except BlockingIOError:
+                self.lock_file.close()
+                processNumber += 1
+
+    def load_records_not_done(self):
+        """Records of the journal that were not marked done. A partly written last line of a crash is skipped."""
+        recordsNotDone = OrderedDict()
+        if not os.path.exists(self.journal_path):
+            return recordsNotDone
+        with open(self.journal_path, 'r') as journalFile:
+            for line in journalFile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    self.logger.warning(f"Skipped unreadable line of journal {self.journal_path}: {line}")
+                    continue
+                if 'done' in entry:
+                    recordsNotDone.pop(entry['done'], None)
+                else:
+                    recordsNotDone[entry['sequence']] = entry['record']
+        return recordsNotDone
+
+    def get_records_to_replay(self):
+        """Returns (sequence, record) of the records left not done by the previous process, only once"""
+        with self.condition:
+            recordsToReplay = self.records_to_replay
+            self.records_to_replay = []
+            return recordsToReplay
+
+    def append(self, record):
+        """Append a record and wait till it is on disk. Returns its sequence, to be passed to mark_done once its side effects are applied."""
+        with self.condition:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            self.records_not_done[sequence] = record
+            self.queue_line({ 'sequence': sequence, 'record': record }, sequence)
+            while self.last_durable_sequence < sequence and not self.is_closed:
+                self.condition.wait()
+        return sequence
+
+    def mark_done(self, sequence):
+        """Nothing waits for the done marker to reach the disk, if it is lost the record is replayed again"""
+        with self.condition:
+            if self.records_not_done.pop(sequence, None) is not None:
+                self.queue_line({ 'done': sequence }, self.last_queued_sequence)
+
+    def queue_line(self, entry, sequence):
+        """Should be called holding the condition. After close, lines are written right away."""
+        self.pending_lines.append(json.dumps(entry) + '\n')
+        self.last_queued_sequence = sequence
+        if self.is_closed:
+            self.write_pending_lines()
+        else:
+            self.condition.notify_all()
+
+    def run_writer(self):
+        """Write all lines queued since the last write with one fsync, then wake up the appends they belong to"""
+        while (True):
+            with self.condition:
+                while len(self.pending_lines) == 0 and not self.is_closed:
+                    self.condition.wait()
+                if self.is_closed:
+                    return
+                lines = self.pending_lines
+                self.pending_lines = []
+                lastQueuedSequence = self.last_queued_sequence
+            # Appends queued meanwhile go with the next write
+            self.write_lines(lines)
+            with self.condition:
+                self.last_durable_sequence = max(self.last_durable_sequence, lastQueuedSequence)
+                self.condition.notify_all()
+                if os.path.getsize(self.journal_path) > self.COMPACTION_SIZE:
+                    self.compact()
+
+    def write_pending_lines(self):
+        """Should be called holding the condition"""
+        lines = self.pending_lines
+        self.pending_lines = []
+        self.write_lines(lines)
+        self.last_durable_sequence = self.last_queued_sequence
+        self.condition.notify_all()
+
+    def write_lines(self, lines):
+        """Appends are woken up even if the write fails, so a failing disk does not stop the application"""
+        try:
+            with open(self.journal_path, 'a') as journalFile:
+                journalFile.write(''.join(lines))
+                journalFile.flush()
+                os.fsync(journalFile.fileno())
+        except:
+            self.logger.error(f"Error in writing journal {self.journal_path}: {traceback.format_exc()}")
+
+    def compact(self):
+        """Should be called holding the condition or before the writer starts. Rewrite the journal with only the records not done.
+        Lines still queued are written after it, the records they repeat are read once and done markers of missing records are ignored."""
+        temporaryPath = self.journal_path + '.tmp'
+        try:
+            with open(temporaryPath, 'w') as journalFile:
+                for sequence, record in self.records_not_done.items():
+                    journalFile.write(json.dumps({ 'sequence': sequence, 'record': record }) + '\n')
+                journalFile.flush()
+                os.fsync(journalFile.fileno())
+            os.replace(temporaryPath, self.journal_path)
+        except:
+            self.logger.error(f"Error in compacting journal {self.journal_path}: {traceback.format_exc()}")
+
+    def get_pending_count(self):
+        """Number of records whose side effects are not applied yet"""
+        with self.condition:
+            return len(self.records_not_done)
+
+    def close(self):
+        """Write out everything queued, lines queued from now on are written right away. Called on shutdown."""
+        with self.condition:
+            self.is_closed = True
+            self.write_pending_lines()
\ No newline at end of file
@@ -1,14 +1,27 @@
+import time
+# Start of the module import, for the startup profile
+moduleImportStartTime = time.perf_counter()
 from flask import Flask, request, json, make_response
-from threading import Thread
-import google.auth
-from googleapiclient.discovery import build 
-from oauth2client.service_account import ServiceAccountCredentials
-from GSheetManager import GSheetManager
+from threading import Thread, Lock, active_count
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import traceback
 from datetime import datetime
-from TimeoutHandler import TimeoutHandler, RESPONSEDATA_ISINTERNALRESTREQUEST, RESPONSEDATA_ISMANAGERTIMEOUT
-from RestRequestHandler import RestRequestHandler
+from TimeoutHandler import TimeoutHandler, RESPONSEDATA_ISINTERNALRESTREQUEST, RESPONSEDATA_ISMANAGERTIMEOUT, RESPONSEDATA_TENANT, RESPONSEDATA_TIMELEFT
+from ClusteredTimeoutHandler import ClusteredTimeoutHandler
+from TimerScheduler import TimerScheduler
+from TenantRegistry import Tenant, TenantRegistry
+from TransitionJournal import TransitionJournal
+from RateLimiter import RateLimiter, DeadlineExceededError
+from PartitionedWorkQueue import PartitionedWorkQueue
+from IdempotencyCache import IdempotencyCache
+from BotMessages import ACTIONMETHOD_ACCEPT, ACTIONMETHOD_DECLINE, render_new_bot_message, render_accept_bot_message, render_declined_bot_message, render_done_bot_message
+from Metrics import metricsRegistry, eventLatency, operationLatency
+from TrackerAnalytics import TICKET_STATUS_PINGED, TICKET_STATUS_ACCEPTED, TICKET_STATUS_DECLINED, TICKET_STATUS_TIMEDOUT, TICKET_STATUS_COMPLETED
 import logging
+import atexit
+import sys
+import uuid
 
 # Message types supported in application currently.
 EVENTTYPE_MESSAGE = 'MESSAGE'
@@ -17,9 +30,17 @@ EVENTTYPE_CARDCLICKED = 'CARD_CLICKED'
 EVENTTYPE_RELOADMANAGERDATA = 'RELOAD_MANAGER_DATA'
 EVENTTYPE_RELOADTICKETSTATE = 'RELOAD_TICKET_STATE'
 EVENTTYPE_RELOADCONFIG = 'RELOAD_CONFIG'
+EVENTTYPE_BULKMESSAGE = 'BULK_MESSAGE'
+EVENTTYPES = (EVENTTYPE_MESSAGE, EVENTTYPE_BULKMESSAGE, EVENTTYPE_DELETE, EVENTTYPE_CARDCLICKED, EVENTTYPE_RELOADMANAGERDATA, EVENTTYPE_RELOADTICKETSTATE, EVENTTYPE_RELOADCONFIG)
+
+# Event labels for the latency metrics of requests that are not events
+EVENTLABEL_HEARTBEAT = 'HEARTBEAT'
+EVENTLABEL_EMPTY = 'EMPTY'
+EVENTLABEL_UNKNOWN = 'UNKNOWN'
 
 # Data received in requests.
 RESPONSEDATA_JIRAID = 'jiraId'
+RESPONSEDATA_JIRAIDS = 'jiraIds'
 RESPONSEDATA_TYPE = 'type'
 RESPONSEDATA_TEXT = 'text'
 RESPONSEDATA_USER = 'user'
@@ -31,117 +52,600 @@ RESPONSEDATA_ACTION = 'action'
 RESPONSEDATA_ACTIONMETHODNAME = 'actionMethodName'
 RESPONSEDATA_PARAMETERS = 'parameters'
 RESPONSEDATA_VALUE = 'value'
+RESPONSEDATA_EVENTID = 'eventId'
+RESPONSEDATA_EVENTTIME = 'eventTime'
+RESPONSEDATA_SPACE = 'space'
+
+# Event processing modes, in Async mode ticket work runs on background workers after the response is returned.
+EVENTPROCESSINGMODE_ASYNC = 'Async'
+
+# Types of journal records of ticket transitions. A transition is journaled before its side effects run, and applied again
+# on the next start if the process stopped before all of them were applied.
+TRANSITION_NEWTICKET = 'NewTicket'
+TRANSITION_REASSIGNED = 'Reassigned'
+TRANSITION_ACCEPTED = 'Accepted'
+TRANSITION_DECLINED = 'Declined'
 
-# Possible action methods in case of a card click event.
-ACTIONMETHOD_ACCEPT = "accept"
-ACTIONMETHOD_DECLINE = "decline"
-ACTIONMETHOD_DONE = "done"
+# Journaled transitions that fail are retried in the background with exponential backoff, on the timer scheduler under this key
+TRANSITION_RETRY_TIMER_KEY = ('TransitionRetry',)
+TRANSITION_RETRY_MIN_BACKOFF = 1.0
+TRANSITION_RETRY_MAX_BACKOFF = 300.0
 
-# Ticket status for the tracker.
-TICKET_STATUS_PINGED = 'Pinged'
-TICKET_STATUS_ACCEPTED = 'Accepted'
-TICKET_STATUS_DECLINED = 'Declined'
-TICKET_STATUS_TIMEDOUT = 'TimedOut'
-TICKET_STATUS_COMPELTED = 'Completed'
+# Phases of startup reported by the startup profile
+STARTUPPHASE_MODULEIMPORT = 'module import'
+STARTUPPHASE_CLIENTIMPORTS = 'Google API client imports'
+STARTUPPHASE_CREDENTIALS = 'credentials'
+STARTUPPHASE_MAINSPREADSHEET = 'main spreadsheet'
+STARTUPPHASE_TENANTSPREADSHEETS = 'tenant spreadsheets'
+STARTUPPHASE_TOTAL = 'total'
+
+# A failed start is retried by requests only after a backoff, doubled on every failure
+START_RETRY_MIN_BACKOFF = 5.0
+START_RETRY_MAX_BACKOFF = 300.0
 
 scopes = ['https://spreadsheets.google.com/feeds','https://www.googleapis.com/auth/drive','https://www.googleapis.com/auth/chat.bot']
-creds = ServiceAccountCredentials.from_json_keyfile_name('rcabot.json', scopes)
 application = app = Flask(__name__)
 logger = logging.getLogger(__name__)
-restRequestHandler = RestRequestHandler(creds)
-gSheetManager = GSheetManager(logger, creds)
-timeoutHandler = TimeoutHandler(logger, gSheetManager.ticket_timeout, gSheetManager.url_for_rest_request, gSheetManager.get_ticket_states_map(), gSheetManager.TICKET_ID_COL, gSheetManager.MANAGER_ID_COL)
+
+# Clients, tenants and workers are created by start(), so importing the module needs neither credentials nor network access
+creds = None
+# Process wide settings come from the main spreadsheet, which also lists the spreadsheets of the other tenants
+mainGSheetManager = None
+chatRateLimiter = None
+restRequestHandler = None
+# Timeouts of all tenants share one timer thread and worker pool
+timerScheduler = None
+# Google Chat requests of a bulk request are sent concurrently, one per pooled connection
+bulkPingExecutor = None
+idempotencyCache = None
+eventWorkQueue = None
+tenantRegistry = None
+# One journal for the process, shared by all tenants
+transitionJournal = None
+isStarted = False
+startLock = Lock()
+startRetryBackoff = 0.0
+nextStartTime = 0.0
+# Seconds spent in each phase of startup, by phase
+startupTimes = {}
+
+@contextmanager
+def time_startup_phase(phase):
+    phaseStartTime = time.perf_counter()
+    try:
+        yield
+    finally:
+        startupTimes[phase] = time.perf_counter() - phaseStartTime
+
+def start():
+    """Create the clients, load the spreadsheets of all tenants and start the timers and workers. Runs once, on the first request
+    that needs it or when called explicitly, e.g. from a gunicorn post_fork hook. Everything is created aside and only published
+    once all of it is started. If it fails, what was started is stopped and it can be tried again after a backoff."""
+    global creds, mainGSheetManager, chatRateLimiter, restRequestHandler, timerScheduler, bulkPingExecutor, idempotencyCache, eventWorkQueue, tenantRegistry, transitionJournal, isStarted, startRetryBackoff, nextStartTime
+    with startLock:
+        if isStarted:
+            return
+        if time.monotonic() < nextStartTime:
+            raise RuntimeError(f"Start failed, next attempt in {nextStartTime - time.monotonic():.0f} seconds")
+        startTime = time.perf_counter()
+        # Stops what was started so far, in reverse order, if the start fails
+        stopFunctions = []
+        try:
+            with time_startup_phase(STARTUPPHASE_CLIENTIMPORTS):
+                # Google API client libraries take most of the import time, they are imported only when the application starts
+                from oauth2client.service_account import ServiceAccountCredentials
+                from GSheetManager import GSheetManager
+                from RestRequestHandler import RestRequestHandler
+            with time_startup_phase(STARTUPPHASE_CREDENTIALS):
+                newCreds = ServiceAccountCredentials.from_json_keyfile_name('rcabot.json', scopes)
+            # Shared by the timeouts and the flushes and reloads of all spreadsheets, started with default workers till configuration is loaded
+            newTimerScheduler = TimerScheduler(logger)
+            stopFunctions.append(newTimerScheduler.shutdown)
+            with time_startup_phase(STARTUPPHASE_MAINSPREADSHEET):
+                newMainGSheetManager = GSheetManager(logger, newCreds, newTimerScheduler)
+            stopFunctions.append(newMainGSheetManager.stop)
+            newTimerScheduler.update_number_of_workers(newMainGSheetManager.number_of_timeout_workers)
+            newChatRateLimiter = RateLimiter(logger, 'Chat', newMainGSheetManager.chat_requests_per_minute, newMainGSheetManager.api_max_attempts)
+            newRestRequestHandler = RestRequestHandler(newCreds, newMainGSheetManager.chat_connection_pool_size, newMainGSheetManager.chat_request_timeout, newChatRateLimiter)
+            newBulkPingExecutor = ThreadPoolExecutor(max_workers=newMainGSheetManager.chat_connection_pool_size, thread_name_prefix='BulkPing')
+            stopFunctions.append(lambda: newBulkPingExecutor.shutdown(wait=False))
+            newIdempotencyCache = IdempotencyCache(newMainGSheetManager.idempotency_ttl, newMainGSheetManager.idempotency_cache_size)
+            newEventWorkQueue = None
+            if newMainGSheetManager.event_processing_mode == EVENTPROCESSINGMODE_ASYNC:
+                newEventWorkQueue = PartitionedWorkQueue(logger, newMainGSheetManager.number_of_event_workers, newMainGSheetManager.event_queue_size)
+                stopFunctions.append(newEventWorkQueue.stop)
+
+            newTenantRegistry = TenantRegistry()
+            newTenantRegistry.register(create_tenant(newMainGSheetManager, newTimerScheduler))
+            with time_startup_phase(STARTUPPHASE_TENANTSPREADSHEETS):
+                with ThreadPoolExecutor(max_workers=max(1, len(newMainGSheetManager.tenant_spreadsheets)), thread_name_prefix='TenantLoader') as tenantLoader:
+                    tenantLoads = [tenantLoader.submit(load_tenant_gsheet_manager, newCreds, newMainGSheetManager, newTimerScheduler, spreadsheetName) for spreadsheetName in newMainGSheetManager.tenant_spreadsheets]
+            # Tenants that loaded are stopped too if another one failed
+            for tenantLoad in tenantLoads:
+                if tenantLoad.exception() is None:
+                    stopFunctions.append(tenantLoad.result().stop)
+            for tenantLoad in tenantLoads:
+                newTenantRegistry.register(create_tenant(tenantLoad.result(), newTimerScheduler))
+
+            newTransitionJournal = TransitionJournal(logger, newMainGSheetManager.journal_path) if newMainGSheetManager.journal_path != '' else None
+        except:
+            for stopFunction in reversed(stopFunctions):
+                try:
+                    stopFunction()
+                except:
+                    logger.error("Error in stopping a failed start: " + traceback.format_exc())
+            startRetryBackoff = min(max(startRetryBackoff * 2, START_RETRY_MIN_BACKOFF), START_RETRY_MAX_BACKOFF)
+            nextStartTime = time.monotonic() + startRetryBackoff
+            raise
+
+        creds, mainGSheetManager, chatRateLimiter, restRequestHandler = newCreds, newMainGSheetManager, newChatRateLimiter, newRestRequestHandler
+        timerScheduler, bulkPingExecutor, idempotencyCache, eventWorkQueue = newTimerScheduler, newBulkPingExecutor, newIdempotencyCache, newEventWorkQueue
+        tenantRegistry, transitionJournal = newTenantRegistry, newTransitionJournal
+        for tenant in tenantRegistry.get_tenants():
+            reconcile_tenant_in_background(tenant)
+        metricsRegistry.gauge('rcabot_tickets_on_timer', 'Tickets waiting for their timeout', lambda: sum(tenant.timeout_handler.get_timer_count() for tenant in tenantRegistry.get_tenants()))
+        metricsRegistry.gauge('rcabot_tracker_queue_depth', 'Tracker rows waiting to be written to the Tracker sheet', lambda: sum(tenant.gsheet_manager.get_tracker_queue_depth() for tenant in tenantRegistry.get_tenants()))
+        metricsRegistry.gauge('rcabot_threads', 'Live threads of the process', active_count)
+
+        # The journal is closed before the tenants flush on exit and writes their last done markers right away
+        if transitionJournal is not None:
+            for tenant in tenantRegistry.get_tenants():
+                tenant.gsheet_manager.set_transition_journal(transitionJournal)
+            atexit.register(transitionJournal.close)
+            metricsRegistry.gauge('rcabot_journal_records_pending', 'Journaled transitions and tracker rows not applied yet', transitionJournal.get_pending_count)
+            # Transitions left behind by the previous process
+            Thread(target=replay_transitions, name='JournalReplay', daemon=True).start()
+        startupTimes[STARTUPPHASE_TOTAL] = time.perf_counter() - startTime
+        isStarted = True
+    logger.info(get_startup_report())
+
+def start_in_background():
+    """Start the application on another thread, unless it is started, being started or waiting for the backoff of a failed start"""
+    if not isStarted and not startLock.locked() and time.monotonic() >= nextStartTime:
+        Thread(target=start_logging_errors, name='ApplicationStart', daemon=True).start()
+
+def start_logging_errors():
+    try:
+        start()
+    except:
+        logger.error("Error in start: " + traceback.format_exc())
+
+def get_startup_report():
+    """Time spent in imports against loading the spreadsheets in the last start. Spreadsheets started from the local snapshot
+    are loaded from the sheets in the background, after start."""
+    importTime = startupTimes.get(STARTUPPHASE_MODULEIMPORT, 0.0) + startupTimes.get(STARTUPPHASE_CLIENTIMPORTS, 0.0)
+    loadTime = startupTimes.get(STARTUPPHASE_MAINSPREADSHEET, 0.0) + startupTimes.get(STARTUPPHASE_TENANTSPREADSHEETS, 0.0)
+    startTime = startupTimes.get(STARTUPPHASE_TOTAL, 0.0)
+    phaseTimes = ', '.join(f"{phase} {phaseTime:.3f} s" for phase, phaseTime in startupTimes.items() if phase != STARTUPPHASE_TOTAL)
+    return f"Startup: imports {importTime:.3f} s, spreadsheet loads {loadTime:.3f} s, start {startTime:.3f} s in total ({phaseTimes})"
+
+def create_tenant(gSheetManager, timerScheduler):
+    """Tenant of a loaded spreadsheet, with its timeouts scheduled on the shared timer scheduler"""
+    tenant = Tenant(gSheetManager)
+    if gSheetManager.cluster_store is not None:
+        tenant.timeout_handler = ClusteredTimeoutHandler(logger, gSheetManager.cluster_store, gSheetManager.node_id, gSheetManager.cluster_lease_duration, gSheetManager.cluster_timer_poll_interval, gSheetManager.ticket_timeout, gSheetManager.url_for_rest_request, gSheetManager.get_ticket_states_map(), gSheetManager.number_of_timeout_workers, lambda jiraId, isManagerTimeout, deadline: on_ticket_timeout(tenant, jiraId, isManagerTimeout, deadline), gSheetManager.timeout_dispatch_mode, timerScheduler, tenant.name)
+    else:
+        tenant.timeout_handler = TimeoutHandler(logger, gSheetManager.ticket_timeout, gSheetManager.url_for_rest_request, gSheetManager.get_ticket_states_map(), gSheetManager.number_of_timeout_workers, lambda jiraId, isManagerTimeout, deadline: on_ticket_timeout(tenant, jiraId, isManagerTimeout, deadline), gSheetManager.timeout_dispatch_mode, timerScheduler, tenant.name)
+    gSheetManager.set_on_managers_removed(lambda managerIds: on_managers_removed(tenant, managerIds))
+    return tenant
+
+def reconcile_tenant_in_background(tenant):
+    """Spreadsheet started from its snapshot is reconciled with the sheets once the application is started, as that updates the tenant routes"""
+    tenant.gsheet_manager.reconcile_in_background(lambda removedRecordsList, addedRecordsList: on_state_reconciled(tenant, removedRecordsList, addedRecordsList))
+
+def load_tenant_gsheet_manager(creds, mainGSheetManager, timerScheduler, spreadsheetName):
+    """Other tenants share the Sheets client and quota and the timer scheduler of the main spreadsheet"""
+    from GSheetManager import GSheetManager
+    return GSheetManager(logger, creds, timerScheduler, spreadsheetName, mainGSheetManager.client, mainGSheetManager.sheets_rate_limiter)
+
+@app.before_request
+def start_on_first_request():
+    """The first request that needs the application starts it. Heartbeats and metrics are answered right away,
+    a heartbeat starts the application in the background so it is ready for the events that follow."""
+    if isStarted or request.endpoint == 'on_metrics_request':
+        return None
+    if request.method == 'GET' and request.endpoint == 'on_event':
+        start_in_background()
+        return None
+    # After a failed start, requests are turned away till its backoff is over instead of each trying again
+    if time.monotonic() < nextStartTime:
+        return json.dumps({ "status": "Starting, retry later" }), 503
+    try:
+        start()
+    except:
+        logger.error("Error in start: " + traceback.format_exc())
+        return json.dumps({ "status": "Starting, retry later" }), 503
+    return None
 
 @app.route('/', methods=['POST', 'GET'])
 def on_event():
     """All requests land here. GET is only implemented for Heartbeat."""
+    startTime = time.perf_counter()
+    eventLabel = EVENTLABEL_HEARTBEAT
     try:
         if request.method == 'GET':
             return get_success_response()
+        eventLabel = EVENTLABEL_UNKNOWN
         event = request.get_json()
         if event is None or RESPONSEDATA_TYPE not in event:
+            eventLabel = EVENTLABEL_EMPTY
             return get_success_response()
         eventType = event[RESPONSEDATA_TYPE].strip().upper()
+        # Label is limited to known types so unknown requests cannot grow the metrics
+        eventLabel = eventType if eventType in EVENTTYPES else EVENTLABEL_UNKNOWN
+        tenant = get_tenant(event)
+        if tenant is None:
+            logger.warning("Request received for unknown tenant: " + eventType)
+            return json.dumps({ "status": "Unknown tenant" }), 404
         if (eventType == EVENTTYPE_MESSAGE):
-            return on_send_new_message(event)
+            return run_idempotent(tenant, get_message_idempotency_key(event), on_send_new_message, event)
+        elif(eventType == EVENTTYPE_BULKMESSAGE):
+            return run_idempotent(tenant, get_bulk_message_idempotency_key(event), on_bulk_message_request, event)
         elif(eventType == EVENTTYPE_CARDCLICKED):
-            return on_card_click_request(event)
+            return run_idempotent(tenant, get_card_click_idempotency_key(event), on_card_click_request, event)
         elif(eventType == EVENTTYPE_RELOADMANAGERDATA):
-            return on_reload_manager_data_request()
+            return on_reload_manager_data_request(tenant)
         elif(eventType == EVENTTYPE_RELOADTICKETSTATE):
-            return on_reload_ticket_state_request()
+            return on_reload_ticket_state_request(tenant)
         elif(eventType == EVENTTYPE_RELOADCONFIG):
-            return on_reload_config_request()
+            return on_reload_config_request(tenant)
 
         logger.warning("Unknown request type received: " + eventType)
         return json.dumps({ "status": "Unknown request Type: " + eventType }), 500
+    except DeadlineExceededError:
+        logger.warning("Request dropped, Google API quota exhausted till its deadline: " + traceback.format_exc())
+        return json.dumps({ "status": "Busy, retry later" }), 503
     except:
         errorFormat = "Unexpected error in rest request: " + traceback.format_exc()
         logger.error(errorFormat)
         return json.dumps({ "status": errorFormat }), 500
+    finally:
+        eventLatency.observe(time.perf_counter() - startTime, eventLabel)
+
+@app.route('/metrics', methods=['GET'])
+def on_metrics_request():
+    """Metrics in the Prometheus text format"""
+    response = make_response(metricsRegistry.render())
+    response.headers['content-type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@app.route('/analytics', methods=['GET'])
+def on_analytics_request():
+    """Aggregates of the tracker data since start, of the tenant named in the tenant query parameter or the main one"""
+    tenant = tenantRegistry.get_tenant(request.args.get(RESPONSEDATA_TENANT))
+    if tenant is None:
+        return json.dumps({ "status": "Unknown tenant" }), 404
+    return get_json_response(json.dumps(tenant.gsheet_manager.tracker_analytics.get_summary()))
+
+def get_tenant(event):
+    """Tenant of the event by its tenant field, the name of the tenant's spreadsheet, else by the Chat space it comes from.
+    Events with neither, and all events when no other spreadsheet is served, go to the main spreadsheet's tenant."""
+    space = event.get(RESPONSEDATA_SPACE)
+    return tenantRegistry.get_tenant(event.get(RESPONSEDATA_TENANT), space.get(RESPONSEDATA_NAME) if isinstance(space, dict) else None)
+
+def run_idempotent(tenant, key, function, event):
+    """Process the event once per idempotency key. Repeats, like Google Chat retrying a slow request, get the response of the
+    first request back without being processed again. Events without a key are always processed."""
+    if key is None:
+        return function(tenant, event)
+    def process_event():
+        response = make_response(function(tenant, event))
+        return response.get_data(), response.status_code, response.headers.get('content-type')
+    body, statusCode, contentType = idempotencyCache.run((tenant.name, ) + key, tenant.gsheet_manager.request_deadline, process_event)
+    response = make_response(body, statusCode)
+    response.headers['content-type'] = contentType
+    return response
+
+def get_message_idempotency_key(event):
+    """Key of a new ticket request is its jiraId and the eventId set by the sender. Requests without an eventId are not deduplicated,
+    as a ticket raised again after it was accepted looks the same as a retry. Neither are timeouts of the bot itself."""
+    if RESPONSEDATA_JIRAID not in event or RESPONSEDATA_EVENTID not in event or RESPONSEDATA_ISINTERNALRESTREQUEST in event:
+        return None
+    return (event[RESPONSEDATA_JIRAID].strip(), event[RESPONSEDATA_EVENTID], EVENTTYPE_MESSAGE)
+
+def get_bulk_message_idempotency_key(event):
+    """Key of a bulk request is the eventId set by the sender, requests without one are not deduplicated"""
+    if RESPONSEDATA_EVENTID not in event:
+        return None
+    return (event[RESPONSEDATA_EVENTID], EVENTTYPE_BULKMESSAGE)
 
-def on_reload_manager_data_request():
+def get_card_click_idempotency_key(event):
+    """Key of a card click is its jiraId, the event time set by Google Chat, the action and the user who clicked"""
+    eventAction = event[RESPONSEDATA_ACTION]
+    return (eventAction[RESPONSEDATA_PARAMETERS][0][RESPONSEDATA_VALUE], event.get(RESPONSEDATA_EVENTTIME), eventAction[RESPONSEDATA_ACTIONMETHODNAME], event[RESPONSEDATA_USER][RESPONSEDATA_NAME])
+
+def on_reload_manager_data_request(tenant):
     """Request to reload manager data during runtime."""
-    gSheetManager.reload_manager_data_during_runtime()
+    tenant.gsheet_manager.reload_manager_data_during_runtime()
     return get_success_response()
 
-def on_reload_ticket_state_request():
+def on_managers_removed(tenant, managerIds):
+    """Tickets of managers removed from the Managers sheet time out for them right away, so they are pinged to another manager"""
+    gSheetManager = tenant.gsheet_manager
+    for ticketState in gSheetManager.get_ticket_states_map().values():
+        if ticketState.manager_id in managerIds:
+            tenant.timeout_handler.expire_thread(ticketState.jira_id, ticketState.manager_id)
+
+def on_reload_ticket_state_request(tenant):
     """Request to reload ticket states during runtime.
         This is implemented only for unforeseen circumstances and should be avoided."""
-    removedRecordsList, allNewRecordsList = gSheetManager.reload_ticket_state_during_runtime()
-    timeoutHandler.update_ticket_states_during_runtime(removedRecordsList, allNewRecordsList)
+    removedRecordsList, allNewRecordsList = tenant.gsheet_manager.reload_ticket_state_during_runtime()
+    tenant.timeout_handler.update_ticket_states_during_runtime(removedRecordsList, allNewRecordsList)
     return get_success_response()
 
-def on_reload_config_request():
+def on_reload_config_request(tenant):
     """Request to reload configuration during runtime."""
-    gSheetManager.reload_configuration_during_runtime()
-    timeoutHandler.update_properties(gSheetManager.ticket_timeout, gSheetManager.url_for_rest_request)
+    tenant.gsheet_manager.reload_configuration_during_runtime()
+    update_tenant_properties(tenant)
     return get_success_response()
 
-def on_send_new_message(event):
+def update_tenant_properties(tenant):
+    """Apply the tenant's loaded configuration. Request limits are shared by all tenants and follow the main spreadsheet."""
+    gSheetManager = tenant.gsheet_manager
+    tenant.timeout_handler.update_properties(gSheetManager.ticket_timeout, gSheetManager.url_for_rest_request, gSheetManager.timeout_dispatch_mode)
+    tenantRegistry.update_space_routes()
+    if gSheetManager is mainGSheetManager:
+        chatRateLimiter.update_rate(gSheetManager.chat_requests_per_minute)
+        chatRateLimiter.max_attempts = gSheetManager.api_max_attempts
+        idempotencyCache.update_limits(gSheetManager.idempotency_ttl, gSheetManager.idempotency_cache_size)
+
+def on_state_reconciled(tenant, removedRecordsList, addedRecordsList):
+    """Called once the sheets are loaded in the background after a start from the local snapshot."""
+    update_tenant_properties(tenant)
+    tenant.timeout_handler.update_ticket_states_during_runtime(removedRecordsList, addedRecordsList)
+
+def on_send_new_message(tenant, event):
     """Request to send a message for a ticket. It could be in case of New, Timeout and Decline."""
     if RESPONSEDATA_JIRAID not in event:
         return {}, 500
     
     jiraId = event[RESPONSEDATA_JIRAID].strip()
-    ticketStatus = gSheetManager.get_ticket_status(jiraId)
-    if ticketStatus is not None and RESPONSEDATA_ISINTERNALRESTREQUEST not in event:
+    if eventWorkQueue is not None and RESPONSEDATA_ISINTERNALRESTREQUEST not in event:
+        # Duplicate requests are ignored by the background worker instead of returning an error
+        eventWorkQueue.submit((tenant.name, jiraId), process_new_message, tenant, jiraId, False, False)
+        return json.dumps({ "status": "Queued" }), 200
+    # Google Chat requests are retried till the caller would give up on this request
+    deadline = time.monotonic() + tenant.gsheet_manager.request_deadline
+    if RESPONSEDATA_TIMELEFT in event:
+        # Timeout of a clustered process, which only owns the ticket for the rest of its lease
+        deadline = min(deadline, time.monotonic() + float(event[RESPONSEDATA_TIMELEFT]))
+    responseData = process_new_message(tenant, jiraId, RESPONSEDATA_ISINTERNALRESTREQUEST in event, RESPONSEDATA_ISMANAGERTIMEOUT in event, deadline)
+    if responseData is None:
         return json.dumps({ "status": f"Request for {jiraId} already received" }), 500
-    
-    managerId,dndTimeoutForManager = gSheetManager.get_manager_id()
-    bot_message = get_new_bot_message(jiraId, managerId)
+
+    response = make_response(json.dumps(responseData))
+    response.headers['content-type'] = 'application/json'
+    return response
+
+def on_ticket_timeout(tenant, jiraId, isManagerTimeout, deadline):
+    """Called directly by TimeoutHandler when a ticket times out or is declined, instead of a rest request to the application."""
+    return process_new_message(tenant, jiraId, True, isManagerTimeout, deadline)
+
+def process_new_message(tenant, jiraId, isInternalRequest, isManagerTimeout, deadline=None):
+    """Selects a manager for the ticket and pings them. Returns the response data with managerId, and newTimeOut
+    when all managers are in dnd, or None if the ticket was already received. Google Chat requests are given up after the deadline."""
+    gSheetManager = tenant.gsheet_manager
+    if isInternalRequest:
+        return ping_manager(tenant, jiraId, gSheetManager.get_ticket_status(jiraId), isManagerTimeout, deadline)
+    # Only one request at a time takes in a new ticket, the others are duplicates
+    if not gSheetManager.begin_ticket_intake(jiraId):
+        return None
+    try:
+        return ping_manager(tenant, jiraId, None, isManagerTimeout, deadline)
+    finally:
+        gSheetManager.end_ticket_intake(jiraId)
+
+def ping_manager(tenant, jiraId, ticketStatus, isManagerTimeout, deadline):
+    """Pings the next manager for a new ticket, or for a ticket in the cycle (ticketStatus) that timed out or was declined"""
+    gSheetManager = tenant.gsheet_manager
+    with operationLatency.time('get_manager_id'):
+        managerId,dndTimeoutForManager = gSheetManager.get_manager_id()
 
     if ticketStatus:
-        isManagerTimeout = RESPONSEDATA_ISMANAGERTIMEOUT in event
-        if isManagerTimeout:
-            oldManagerName = ticketStatus[gSheetManager.MANAGER_NAME_COL]
-            message_updated = { "text": f"{jiraId} has timed out for {oldManagerName}" }
-            restRequestHandler.send_rest_request_chat(restRequestHandler.REQUEST_URL_UPDATE.format(ticketStatus[gSheetManager.MESSAGE_ID_COL], restRequestHandler.REQUEST_UPDATEMASK), restRequestHandler.REQUESTTYPE_PUT, message_updated)
-            gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, oldManagerName, TICKET_STATUS_TIMEDOUT)
         if dndTimeoutForManager > 0:
-            response = make_response(json.dumps({ "status": "Success", "managerId": 0, "newTimeOut": dndTimeoutForManager }))
-            response.headers['content-type'] = 'application/json'
-            return response
-        else:
-            responseOnMessageCreation = restRequestHandler.send_rest_request_chat(restRequestHandler.REQUEST_URL_CREATE_IN_THREAD.format(gSheetManager.space_id, ticketStatus[gSheetManager.THREAD_ID_COL]), restRequestHandler.REQUESTTYPE_POST, bot_message)
-            managerName = responseOnMessageCreation[RESPONSEDATA_TEXT][1:]
-            gSheetManager.update_ticket_status(jiraId, managerId, managerName, responseOnMessageCreation[RESPONSEDATA_NAME])
-            gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, managerName, TICKET_STATUS_PINGED)
+            if isManagerTimeout:
+                update_timed_out_message(tenant, jiraId, ticketStatus, deadline)
+                gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, ticketStatus.manager_name, TICKET_STATUS_TIMEDOUT)
+            return { "status": "Success", "managerId": 0, "newTimeOut": dndTimeoutForManager }
+        record = { 'type': TRANSITION_REASSIGNED, 'jiraId': jiraId, 'managerId': managerId, 'requestId': uuid.uuid4().hex, 'isManagerTimeout': isManagerTimeout, 'messageId': ticketStatus.message_id }
+        apply_transition(journal_transition(tenant, record), tenant, record, deadline)
     else:
         if dndTimeoutForManager > 0:
-            timeoutHandler.add_thread(jiraId, 0, dndTimeoutForManager)
+            tenant.timeout_handler.add_thread(jiraId, 0, dndTimeoutForManager)
         else:
-            responseOnMessageCreation = restRequestHandler.send_rest_request_chat(restRequestHandler.REQUEST_URL_CREATE.format(gSheetManager.space_id), restRequestHandler.REQUESTTYPE_POST, bot_message)
-            timeoutHandler.add_thread(jiraId, managerId)
-            managerName = responseOnMessageCreation[RESPONSEDATA_TEXT][1:]
-            gSheetManager.append_ticket_status(jiraId, managerId, managerName, responseOnMessageCreation[RESPONSEDATA_THREAD][RESPONSEDATA_NAME], responseOnMessageCreation[RESPONSEDATA_NAME])
-            gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, managerName, TICKET_STATUS_PINGED)
+            ping_manager_for_new_ticket(tenant, jiraId, managerId, deadline)
+
+    return { "status": "Success", "managerId": managerId }
+
+def ping_manager_for_new_ticket(tenant, jiraId, managerId, deadline):
+    """Post the card of a new ticket in a new thread, start its timeout and add it to the cycle"""
+    record = get_new_ticket_record(jiraId, managerId)
+    apply_transition(journal_transition(tenant, record), tenant, record, deadline)
+
+def get_new_ticket_record(jiraId, managerId):
+    return { 'type': TRANSITION_NEWTICKET, 'jiraId': jiraId, 'managerId': managerId, 'requestId': uuid.uuid4().hex }
+
+def update_timed_out_message(tenant, jiraId, ticketStatus, deadline):
+    """Mark the card of the manager the ticket timed out for"""
+    gSheetManager = tenant.gsheet_manager
+    message_updated = { "text": f"{jiraId} has timed out for {ticketStatus.manager_name}" }
+    restRequestHandler.send_rest_request_chat(restRequestHandler.REQUEST_URL_UPDATE.format(ticketStatus.message_id, restRequestHandler.REQUEST_UPDATEMASK), restRequestHandler.REQUESTTYPE_PUT, message_updated, jiraId, deadline)
+
+def journal_transition(tenant, record):
+    """Journal a transition before its side effects run. Returns its journal sequence, None without a journal."""
+    record['tenant'] = tenant.name
+    return transitionJournal.append(record) if transitionJournal is not None else None
+
+def apply_transition(journalSequence, tenant, record, deadline, isRetry=False):
+    """Run the side effects of a journaled transition and mark it done. If they fail the transition is retried in the
+    background till it is applied, and the error is raised to the request."""
+    try:
+        TRANSITION_APPLIERS[record['type']](tenant, record, deadline, isRetry)
+    except:
+        if not isRetry:
+            schedule_transition_retry(journalSequence, record)
+        raise
+    mark_transition_done(tenant, journalSequence)
+
+def schedule_transition_retry(journalSequence, record):
+    """Retry a failed transition in the background. Without a journal it is not retried."""
+    if journalSequence is not None:
+        timerScheduler.schedule((TRANSITION_RETRY_TIMER_KEY, journalSequence), TRANSITION_RETRY_MIN_BACKOFF, retry_transition, journalSequence, record, TRANSITION_RETRY_MIN_BACKOFF)
+
+def mark_transition_done(tenant, journalSequence):
+    """Ticket state and dnd writes of the transition may still be waiting to be sent, it is done once they are stored"""
+    if journalSequence is not None:
+        tenant.gsheet_manager.call_when_state_written(lambda: transitionJournal.mark_done(journalSequence))
+
+def retry_transition(journalSequence, record, backoffTime):
+    """Runs on the timer worker pool, for a failed transition or one left behind by the previous process"""
+    tenant = tenantRegistry.get_tenant(record['tenant'])
+    if tenant is None:
+        logger.warning(f"Journaled transition dropped, tenant no longer served: {record}")
+        transitionJournal.mark_done(journalSequence)
+        return
+    try:
+        apply_transition(journalSequence, tenant, record, None, True)
+    except:
+        backoffTime = min(backoffTime * 2, TRANSITION_RETRY_MAX_BACKOFF)
+        logger.error(f"Error in retry of transition {record}, retrying in {backoffTime} seconds: {traceback.format_exc()}")
+        timerScheduler.schedule((TRANSITION_RETRY_TIMER_KEY, journalSequence), backoffTime, retry_transition, journalSequence, record, backoffTime)
+
+def replay_transitions():
+    """Apply the transitions and requeue the tracker rows the previous process left behind, in the order they were journaled"""
+    for journalSequence, record in transitionJournal.get_records_to_replay():
+        tenant = tenantRegistry.get_tenant(record['tenant'])
+        if tenant is not None and record['type'] == tenant.gsheet_manager.JOURNALRECORD_TRACKER:
+            tenant.gsheet_manager.requeue_tracker_row(record['row'], journalSequence)
+        else:
+            retry_transition(journalSequence, record, TRANSITION_RETRY_MIN_BACKOFF)
+
+def apply_new_ticket(tenant, record, deadline, isRetry):
+    """A retried ticket is skipped if it was taken in again meanwhile, e.g. by a repeat of its request"""
+    gSheetManager = tenant.gsheet_manager
+    jiraId = record['jiraId']
+    managerId = record['managerId']
+    if isRetry and not gSheetManager.begin_ticket_intake(jiraId):
+        return
+    try:
+        add_new_ticket_to_cycle(tenant, record, post_new_ticket_card(tenant, record, deadline))
+    finally:
+        if isRetry:
+            gSheetManager.end_ticket_intake(jiraId)
+
+def post_new_ticket_card(tenant, record, deadline):
+    """Post the card of a new ticket in a new thread. Returns the created message."""
+    return restRequestHandler.send_rest_request_chat(restRequestHandler.REQUEST_URL_CREATE.format(tenant.gsheet_manager.space_id, record['requestId']), restRequestHandler.REQUESTTYPE_POST, render_new_bot_message(record['jiraId'], record['managerId']), record['jiraId'], deadline)
+
+def add_new_ticket_to_cycle(tenant, record, responseOnMessageCreation):
+    """Start the timeout of a new ticket whose card is posted and add its state"""
+    gSheetManager = tenant.gsheet_manager
+    jiraId = record['jiraId']
+    tenant.timeout_handler.add_thread(jiraId, record['managerId'])
+    managerName = responseOnMessageCreation[RESPONSEDATA_TEXT][1:]
+    gSheetManager.append_ticket_status(jiraId, record['managerId'], managerName, responseOnMessageCreation[RESPONSEDATA_THREAD][RESPONSEDATA_NAME], responseOnMessageCreation[RESPONSEDATA_NAME])
+    gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, managerName, TICKET_STATUS_PINGED)
+
+def apply_reassigned(tenant, record, deadline, isRetry):
+    """Skipped if the ticket moved on from the message it timed out or was declined on, or was accepted meanwhile.
+    A retry also moves the ticket's timeout to the new manager, as it is not run by the timeout itself."""
+    gSheetManager = tenant.gsheet_manager
+    jiraId = record['jiraId']
+    managerId = record['managerId']
+    ticketStatus = gSheetManager.get_ticket_status(jiraId)
+    if ticketStatus is None or ticketStatus.message_id != record['messageId']:
+        return
+    if record['isManagerTimeout']:
+        update_timed_out_message(tenant, jiraId, ticketStatus, deadline)
+    responseOnMessageCreation = restRequestHandler.send_rest_request_chat(restRequestHandler.REQUEST_URL_CREATE_IN_THREAD.format(gSheetManager.space_id, ticketStatus.thread_id, record['requestId']), restRequestHandler.REQUESTTYPE_POST, render_new_bot_message(jiraId, managerId), jiraId, deadline)
+    managerName = responseOnMessageCreation[RESPONSEDATA_TEXT][1:]
+    gSheetManager.update_ticket_status(jiraId, managerId, managerName, responseOnMessageCreation[RESPONSEDATA_NAME])
+    # Tracker rows are added once the ticket moved on, so a retry does not add them twice
+    if record['isManagerTimeout']:
+        gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, ticketStatus.manager_name, TICKET_STATUS_TIMEDOUT)
+    gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, managerName, TICKET_STATUS_PINGED)
+    if isRetry:
+        tenant.timeout_handler.update_ticket_states_during_runtime([ticketStatus], [gSheetManager.get_ticket_status(jiraId)])
+
+def on_bulk_message_request(tenant, event):
+    """Request to send messages for many new tickets at once. Tickets are taken in batches of BulkIntakeBatchSize,
+    each batch given RequestDeadline for its Google Chat requests. Returns a result for each ticket."""
+    if not isinstance(event.get(RESPONSEDATA_JIRAIDS), list) or not all(isinstance(jiraId, str) for jiraId in event[RESPONSEDATA_JIRAIDS]):
+        return json.dumps({ "status": "jiraIds should be a list of ticket ids" }), 400
 
-    response = make_response(json.dumps({ "status": "Success", "managerId": managerId }))
+    gSheetManager = tenant.gsheet_manager
+    jiraIds = list(dict.fromkeys(jiraId.strip() for jiraId in event[RESPONSEDATA_JIRAIDS]))
+    results = []
+    for batchStart in range(0, len(jiraIds), gSheetManager.bulk_intake_batch_size):
+        batchJiraIds = jiraIds[batchStart:batchStart + gSheetManager.bulk_intake_batch_size]
+        results.extend(process_new_messages(tenant, batchJiraIds, time.monotonic() + gSheetManager.request_deadline))
+    # Tracker rows of all tickets go to the sheet together right away
+    gSheetManager.request_tracker_flush()
+
+    response = make_response(json.dumps({ "status": "Success", "results": results }))
     response.headers['content-type'] = 'application/json'
     return response
 
-def on_card_click_request(event):
+def process_new_messages(tenant, jiraIds, deadline):
+    """process_new_message for a batch of new tickets. Managers are selected for all of them in one pass over the rotation
+    and pinged concurrently, their ticket states are written to GSheet together. Returns the result of each ticket in order."""
+    gSheetManager = tenant.gsheet_manager
+    resultsByJiraId = { jiraId: { "jiraId": jiraId, "status": "Already received" } for jiraId in jiraIds }
+    claimedJiraIds = [jiraId for jiraId in jiraIds if gSheetManager.begin_ticket_intake(jiraId)]
+    try:
+        process_claimed_new_messages(tenant, claimedJiraIds, deadline, resultsByJiraId)
+    finally:
+        for jiraId in claimedJiraIds:
+            gSheetManager.end_ticket_intake(jiraId)
+    return [resultsByJiraId[jiraId] for jiraId in jiraIds]
+
+def process_claimed_new_messages(tenant, claimedJiraIds, deadline, resultsByJiraId):
+    """Select managers for the claimed tickets and post their cards concurrently, then add the tickets whose card is posted
+    to the cycle together, filling in resultsByJiraId"""
+    with operationLatency.time('get_manager_ids'):
+        selectedManagers = tenant.gsheet_manager.get_manager_ids(len(claimedJiraIds))
+    pingsByJiraId = {}
+    for jiraId, (managerId, dndTimeoutForManager) in zip(claimedJiraIds, selectedManagers):
+        if dndTimeoutForManager > 0:
+            tenant.timeout_handler.add_thread(jiraId, 0, dndTimeoutForManager)
+            resultsByJiraId[jiraId] = { "jiraId": jiraId, "status": "Success", "managerId": 0, "newTimeOut": dndTimeoutForManager }
+        else:
+            record = get_new_ticket_record(jiraId, managerId)
+            pingsByJiraId[jiraId] = (record, bulkPingExecutor.submit(post_journaled_new_ticket_card, tenant, record, deadline))
+    postedCards = []
+    for jiraId, (record, ping) in pingsByJiraId.items():
+        try:
+            postedCards.append((record, *ping.result()))
+        except DeadlineExceededError:
+            resultsByJiraId[jiraId] = { "jiraId": jiraId, "status": "Busy, retry later" }
+        except:
+            logger.error(f"Error in bulk message for {jiraId}: {traceback.format_exc()}")
+            resultsByJiraId[jiraId] = { "jiraId": jiraId, "status": "Failed" }
+
+    # Ticket states of the batch are written to GSheet in one request, once all Google Chat requests are done
+    with tenant.gsheet_manager.hold_state_writes():
+        for record, journalSequence, responseOnMessageCreation in postedCards:
+            jiraId = record['jiraId']
+            try:
+                add_new_ticket_to_cycle(tenant, record, responseOnMessageCreation)
+                mark_transition_done(tenant, journalSequence)
+                resultsByJiraId[jiraId] = { "jiraId": jiraId, "status": "Success", "managerId": record['managerId'] }
+            except:
+                schedule_transition_retry(journalSequence, record)
+                logger.error(f"Error in bulk message for {jiraId}: {traceback.format_exc()}")
+                resultsByJiraId[jiraId] = { "jiraId": jiraId, "status": "Failed" }
+
+def post_journaled_new_ticket_card(tenant, record, deadline):
+    """Journal the transition of a new ticket of a bulk request and post its card, the ticket is added to the cycle after.
+    If the card cannot be posted, the transition is retried in the background. Returns the journal sequence and the created message."""
+    journalSequence = journal_transition(tenant, record)
+    try:
+        return journalSequence, post_new_ticket_card(tenant, record, deadline)
+    except:
+        schedule_transition_retry(journalSequence, record)
+        raise
+
+def on_card_click_request(tenant, event):
     """Request on any of the card buttons clicked."""
     managerName = event[RESPONSEDATA_MESSAGE][RESPONSEDATA_TEXT][1:]
     eventAction = event[RESPONSEDATA_ACTION]
@@ -157,187 +661,65 @@ def on_card_click_request(event):
     
     timestamp = datetime.utcnow()
     if (actionMethodName == ACTIONMETHOD_ACCEPT):
-        timeoutHandler.remove_thread_on_response(jiraId, managerId, False)
-        gSheetManager.remove_ticket_status(jiraId)
-        gSheetManager.add_data_to_tracker(timestamp, jiraId, managerName, TICKET_STATUS_ACCEPTED)
-        gSheetManager.record_manager_last_activity(timestamp, managerId)
-        return get_accept_bot_message(jiraId, managerId, managerName)
+        run_transition_work(tenant, { 'type': TRANSITION_ACCEPTED, 'timestamp': timestamp.isoformat(), 'jiraId': jiraId, 'managerId': managerId, 'managerName': managerName })
+        return get_json_response(render_accept_bot_message(jiraId, managerId, managerName))
     elif (actionMethodName == ACTIONMETHOD_DECLINE):
-        gSheetManager.record_manager_last_activity(timestamp, managerId)
-        timeoutHandler.remove_thread_on_response(jiraId, managerId, True)
-        gSheetManager.add_data_to_tracker(timestamp, jiraId, managerName, TICKET_STATUS_DECLINED)
-        return get_declined_bot_message(jiraId, managerName)
+        run_transition_work(tenant, { 'type': TRANSITION_DECLINED, 'timestamp': timestamp.isoformat(), 'jiraId': jiraId, 'managerId': managerId, 'managerName': managerName })
+        return get_json_response(render_declined_bot_message(jiraId, managerName))
+    else:
+        tenant.gsheet_manager.add_data_to_tracker(datetime.utcnow(), jiraId, managerName, TICKET_STATUS_COMPLETED)
+        return get_json_response(render_done_bot_message(jiraId, managerName))
+
+def run_transition_work(tenant, record):
+    """Journal the transition of a card click before the response, then apply it as ticket work"""
+    journalSequence = journal_transition(tenant, record)
+    run_ticket_work(tenant, record['jiraId'], apply_transition, journalSequence, tenant, record, None)
+
+def run_ticket_work(tenant, jiraId, function, *args):
+    """In Async mode work is queued to run in the background, in order for each ticket. Otherwise it runs right away."""
+    if eventWorkQueue is None:
+        function(*args)
     else:
-        gSheetManager.add_data_to_tracker(datetime.utcnow(), jiraId, managerName, TICKET_STATUS_COMPELTED)
-        return get_done_bot_message(jiraId, managerName)
-
-
-def get_new_bot_message(jiraId, managerId):
-    return {
-        "cards": [
-            {
-            "header": {
-                "title": "New RCA Notfication"
-            },
-            "sections": [
-                {
-                "widgets": [
-                    {
-                    "buttons": [
-                        {
-                        "textButton": {
-                            "text": jiraId,
-                            "onClick": {
-                            "openLink": {
-                                "url": f"https://jira.devfactory.com/browse/{jiraId}"
-                            }
-                            }
-                        }
-                        }
-                    ]
-                    }
-                ]
-                },
-                {
-                    "widgets": [
-                    {
-                        "buttons": [
-                        {
-                            "textButton": {
-                            "text": "Accept",
-                            "onClick": {
-                                "action": {
-                                "actionMethodName": ACTIONMETHOD_ACCEPT,
-                                "parameters": [
-                                    {
-                                    "key": "jiraId",
-                                    "value": jiraId
-                                    },
-                                    {
-                                    "key": "managerId",
-                                    "value": managerId
-                                    }
-                                ]
-                                }
-                            }
-                            }
-                        },
-                        {
-                            "textButton": {
-                            "text": "Decline",
-                            "onClick": {
-                                "action": {
-                                "actionMethodName": ACTIONMETHOD_DECLINE,
-                                "parameters": [
-                                    {
-                                    "key": "jiraId",
-                                    "value": jiraId
-                                    },
-                                    {
-                                    "key": "managerId",
-                                    "value": managerId
-                                    }
-                                ]
-                                }
-                            }
-                            }
-                        }
-                        ]
-                    }
-                ]
-                }
-            ]
-            }
-        ],
-        "text": f"<users/{managerId}>"
-    }
-
-def get_accept_bot_message(jiraId, managerId, managerName):
-    return {
-        "actionResponse":{
-            "type":"UPDATE_MESSAGE"
-        },
-        "cards": [
-            {
-            "header": {
-                "title": f"Assigned to {managerName}"
-            },
-            "sections": [
-                {
-                "widgets": [
-                    {
-                        "textParagraph": {
-                            "text": "Please work on"
-                        },
-                        "buttons": [
-                            {
-                            "textButton": {
-                                "text": jiraId,
-                                "onClick": {
-                                    "openLink": {
-                                        "url": f"https://jira.devfactory.com/browse/{jiraId}"
-                                    }
-                                }
-                            }
-                            }
-                        ]
-                    }
-                ]
-                },
-                {
-                    "widgets": [
-                    {
-                        "buttons": [
-                        {
-                            "textButton": {
-                            "text": "Done",
-                            "onClick": {
-                                "action": {
-                                "actionMethodName": ACTIONMETHOD_DONE,
-                                "parameters": [
-                                    {
-                                    "key": "jiraId",
-                                    "value": jiraId
-                                    },
-                                    {
-                                    "key": "managerId",
-                                    "value": managerId
-                                    }
-                                ]
-                                }
-                            }
-                            }
-                        }
-                        ]
-                    }
-                ]
-                }
-            ]
-            }
-        ],
-        "text": f"<users/{managerId}>"
-    }
-
-def get_declined_bot_message(jiraId, managerName):
-    return {
-        "actionResponse":{
-            "type":"UPDATE_MESSAGE"
-        },
-        "cards": [],
-        "text": f"{jiraId} was declined by {managerName}"
-    }
-
-def get_done_bot_message(jiraId, managerName):
-    return {
-        "actionResponse":{
-            "type":"UPDATE_MESSAGE"
-        },
-        "cards": [],
-        "text": f"{jiraId} was completed by {managerName}"
-    }
+        eventWorkQueue.submit((tenant.name, jiraId), function, *args)
+
+def apply_ticket_accepted(tenant, record, deadline, isRetry):
+    """Stop the ticket's timeout and remove it from the cycle. Manager goes into dnd."""
+    timestamp = datetime.fromisoformat(record['timestamp'])
+    tenant.timeout_handler.remove_thread_on_response(record['jiraId'], record['managerId'], False)
+    tenant.gsheet_manager.remove_ticket_status(record['jiraId'])
+    tenant.gsheet_manager.add_data_to_tracker(timestamp, record['jiraId'], record['managerName'], TICKET_STATUS_ACCEPTED)
+    tenant.gsheet_manager.record_manager_last_activity(timestamp, record['managerId'])
+
+def apply_ticket_declined(tenant, record, deadline, isRetry):
+    """Manager goes into dnd before the ticket's timeout is fired right away, so the next manager is pinged."""
+    timestamp = datetime.fromisoformat(record['timestamp'])
+    tenant.gsheet_manager.record_manager_last_activity(timestamp, record['managerId'])
+    tenant.timeout_handler.remove_thread_on_response(record['jiraId'], record['managerId'], True)
+    tenant.gsheet_manager.add_data_to_tracker(timestamp, record['jiraId'], record['managerName'], TICKET_STATUS_DECLINED)
+
+# Side effects of each type of transition, they may run again for a transition already applied in part and have to allow for it
+TRANSITION_APPLIERS = {
+    TRANSITION_NEWTICKET: apply_new_ticket,
+    TRANSITION_REASSIGNED: apply_reassigned,
+    TRANSITION_ACCEPTED: apply_ticket_accepted,
+    TRANSITION_DECLINED: apply_ticket_declined
+}
+
+
+def get_json_response(serializedBody):
+    response = make_response(serializedBody)
+    response.headers['content-type'] = 'application/json'
+    return response
 
 def get_success_response():
     return json.dumps({ "status": "Success" }), 200
 
+startupTimes[STARTUPPHASE_MODULEIMPORT] = time.perf_counter() - moduleImportStartTime
+
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    start()
+    # Profiling mode only starts the application and prints where the startup time went
+    if '--profile-startup' in sys.argv:
+        print(get_startup_report())
+    else:
+        app.run()
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""Micro-benchmark of card rendering: the dictionary builders plus json.dumps against the pre-compiled card templates.
+Run from the project folder: python benchmarks/CardRenderingBenchmark.py"""
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import BotMessages
+
+NUMBER_OF_ITERATIONS = 100000
+JIRA_ID = 'RCA-12345'
+MANAGER_ID = '112233445566778899'
+MANAGER_NAME = 'Jane Doe'
+
+CASES = [
+    ('new', lambda: json.dumps(BotMessages.get_new_bot_message(JIRA_ID, MANAGER_ID)),
+        lambda: BotMessages.render_new_bot_message(JIRA_ID, MANAGER_ID)),
+    ('accept', lambda: json.dumps(BotMessages.get_accept_bot_message(JIRA_ID, MANAGER_ID, MANAGER_NAME)),
+        lambda: BotMessages.render_accept_bot_message(JIRA_ID, MANAGER_ID, MANAGER_NAME)),
+    ('declined', lambda: json.dumps(BotMessages.get_declined_bot_message(JIRA_ID, MANAGER_NAME)),
+        lambda: BotMessages.render_declined_bot_message(JIRA_ID, MANAGER_NAME)),
+]
+
+def main():
+    print(f"{'card':<10}{'builder+dumps (us)':>20}{'template (us)':>16}{'speedup':>10}")
+    for name, builder, template in CASES:
+        # Both must produce the same card
+        assert json.loads(builder()) == json.loads(template()), name
+        builderTime = min(timeit.repeat(builder, number=NUMBER_OF_ITERATIONS, repeat=3)) / NUMBER_OF_ITERATIONS * 1e6
+        templateTime = min(timeit.repeat(template, number=NUMBER_OF_ITERATIONS, repeat=3)) / NUMBER_OF_ITERATIONS * 1e6
+        print(f"{name:<10}{builderTime:>20.2f}{templateTime:>16.2f}{builderTime / templateTime:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Local HTTP server standing in for the Google Chat messages API, with a fixed latency on every request.
+Created messages mention the manager as "@Manager <id>", like Google Chat resolves the <users/id> mention of the card.
+A create with the requestId of an earlier one returns the earlier message."""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import re
+import threading
+import time
+
+# Serves create and update message requests, counting them by kind
+class FakeChatServer():
+    MENTION_PATTERN = re.compile(r'<users/([^>]*)>')
+    REQUEST_ID_PATTERN = re.compile(r'[?&]requestId=([^&]*)')
+
+    latency = 0.0
+    server = None
+
+    def __init__(self, latency):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.request_counter = Counter()
+        self.message_numbers = itertools.count(1)
+        self.messages_by_request_id = {}
+        fakeChatServer = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            # Keep-alive, as the bot keeps its pooled connections open
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                fakeChatServer.handle_request(self)
+
+            def do_PUT(self):
+                fakeChatServer.handle_request(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='FakeChatServer', daemon=True).start()
+
+    def get_base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v1/'
+
+    def handle_request(self, requestHandler):
+        body = json.loads(requestHandler.rfile.read(int(requestHandler.headers['Content-Length'])))
+        time.sleep(self.latency)
+        if requestHandler.command == 'PUT':
+            requestKind = 'update'
+            content = { 'name': requestHandler.path.split('?')[0][len('/v1/'):], 'text': body.get('text', '') }
+        else:
+            requestKind = 'create_in_thread' if 'threadKey=' in requestHandler.path else 'create'
+            requestIdMatch = self.REQUEST_ID_PATTERN.search(requestHandler.path)
+            with self.lock:
+                content = self.messages_by_request_id.get(requestIdMatch.group(1)) if requestIdMatch else None
+            if content is None:
+                messageNumber = next(self.message_numbers)
+                mention = self.MENTION_PATTERN.search(body.get('text', ''))
+                content = {
+                    'name': f'spaces/LoadTest/messages/{messageNumber}',
+                    'text': f'@Manager {mention.group(1)}' if mention else body.get('text', ''),
+                    'thread': { 'name': f'spaces/LoadTest/threads/{messageNumber}' }
+                }
+                if requestIdMatch:
+                    with self.lock:
+                        self.messages_by_request_id[requestIdMatch.group(1)] = content
+        with self.lock:
+            self.request_counter[requestKind] += 1
+        responseBody = json.dumps(content).encode()
+        requestHandler.send_response(200)
+        requestHandler.send_header('Content-Type', 'application/json')
+        requestHandler.send_header('Content-Length', str(len(responseBody)))
+        requestHandler.end_headers()
+        requestHandler.wfile.write(responseBody)
+
+    def get_request_count(self):
+        with self.lock:
+            return sum(self.request_counter.values())
+
+    def shutdown(self):
+        self.server.shutdown()
+
+# Credentials of the patched ServiceAccountCredentials, connections are left unauthorized
+class FakeCredentials():
+    access_token = 'load-test'
+    access_token_expired = False
+
+    def authorize(self, http):
+        return http
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""In-memory stand-in for the parts of gspread used by the bot, with a fixed latency on every request.
+Requests are counted by method so a benchmark can report Sheets calls per ticket."""
+from collections import Counter
+from gspread.utils import a1_to_rowcol, numericise_all
+import re
+import threading
+import time
+
+# Worksheet backed by a list of rows of strings. Its grid has as many rows as it was created with, till it is resized or appended to.
+class FakeWorksheet():
+    title = ''
+    spreadsheet = None
+    row_count = 0
+
+    def __init__(self, spreadsheet, title, rows):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.rows = [[str(value) for value in row] for row in rows]
+        self.row_count = len(self.rows)
+
+    def get_all_values(self):
+        self.spreadsheet.on_request('get_all_values')
+        with self.spreadsheet.lock:
+            return [list(row) for row in self.rows]
+
+    def get_all_records(self):
+        self.spreadsheet.on_request('get_all_records')
+        with self.spreadsheet.lock:
+            keys = self.rows[0]
+            return [dict(zip(keys, numericise_all(row + [''] * (len(keys) - len(row))))) for row in self.rows[1:]]
+
+    def row_values(self, rowNumber):
+        self.spreadsheet.on_request('row_values')
+        with self.spreadsheet.lock:
+            return list(self.rows[rowNumber - 1]) if rowNumber <= len(self.rows) else []
+
+    def append_rows(self, rows, **kwargs):
+        self.spreadsheet.on_request('append_rows')
+        with self.spreadsheet.lock:
+            self.rows.extend([[str(value) for value in row] for row in rows])
+            self.row_count = max(self.row_count, len(self.rows))
+
+    def resize(self, rows=None, cols=None):
+        self.spreadsheet.on_request('resize')
+        with self.spreadsheet.lock:
+            self.row_count = rows
+
+    def set_cell(self, rowNumber, column, value):
+        """Should be called holding the spreadsheet lock"""
+        while len(self.rows) < rowNumber:
+            self.rows.append([])
+        row = self.rows[rowNumber - 1]
+        while len(row) < column:
+            row.append('')
+        row[column - 1] = str(value)
+
+# Error of a request GSheet rejects, with the status code where gspread's APIError has it
+class FakeAPIError(Exception):
+    def __init__(self, statusCode, message):
+        super().__init__(message)
+        self.response = type('FakeResponse', (), { 'status_code': statusCode })()
+
+# Spreadsheet holding the worksheets, every request sleeps for the latency before it is served
+class FakeSpreadsheet():
+    RANGE_PATTERN = re.compile(r"'(.*)'!([A-Z]+[0-9]+):([A-Z]+[0-9]+)")
+
+    latency = 0.0
+
+    def __init__(self, latency):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.request_counter = Counter()
+        self.worksheets_by_title = {}
+
+    def add_worksheet(self, title, rows):
+        self.worksheets_by_title[title] = FakeWorksheet(self, title, rows)
+
+    def on_request(self, method):
+        with self.lock:
+            self.request_counter[method] += 1
+        time.sleep(self.latency)
+
+    def worksheets(self):
+        self.on_request('worksheets')
+        return list(self.worksheets_by_title.values())
+
+    def values_batch_update(self, params=None, body=None):
+        self.on_request('values_batch_update')
+        with self.lock:
+            # Like GSheet, the whole request is rejected if any range is past the end of its grid
+            for valueRange in body['data']:
+                match = self.RANGE_PATTERN.match(valueRange['range'])
+                worksheet = self.worksheets_by_title[match.group(1).replace("''", "'")]
+                if a1_to_rowcol(match.group(3))[0] > worksheet.row_count:
+                    raise FakeAPIError(400, f"Range ({valueRange['range']}) exceeds grid limits. Max rows: {worksheet.row_count}")
+            for valueRange in body['data']:
+                match = self.RANGE_PATTERN.match(valueRange['range'])
+                worksheet = self.worksheets_by_title[match.group(1).replace("''", "'")]
+                firstRow, firstColumn = a1_to_rowcol(match.group(2))
+                for rowOffset, row in enumerate(valueRange['values']):
+                    for columnOffset, value in enumerate(row):
+                        worksheet.set_cell(firstRow + rowOffset, firstColumn + columnOffset, value)
+        return {}
+
+    def get_request_count(self):
+        with self.lock:
+            return sum(self.request_counter.values())
+
+# Returned by the patched gspread.authorize
+class FakeSheetsClient():
+    spreadsheet = None
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, title):
+        self.spreadsheet.on_request('open')
+        return self.spreadsheet
\ No newline at end of file
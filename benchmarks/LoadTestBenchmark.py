@@ -0,0 +1,200 @@
+"""Load test of the whole bot against local stand-ins for Google Sheets and Google Chat, both with configurable latency.
+Concurrent MESSAGE events open tickets, then a stream of CARD_CLICKED events declines some of them and accepts all of them.
+Reports latency percentiles and throughput per event type, peak thread count, peak memory and API calls per ticket lifecycle.
+With --max-p99 or --max-calls-per-ticket it exits with status 1 when a limit is exceeded, to be used as a regression gate
+for changes to TimeoutHandler, GSheetManager and RestRequestHandler.
+Run from the project folder: python benchmarks/LoadTestBenchmark.py --tickets 500 --concurrency 16"""
+import os
+import sys
+import argparse
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_FOLDER))
+sys.path.insert(0, BENCHMARKS_FOLDER)
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+from RestRequestHandler import RestRequestHandler
+from FakeSheetsClient import FakeSheetsClient, FakeSpreadsheet
+from FakeChatServer import FakeChatServer, FakeCredentials
+
+SPACE_ID = 'spaces/LoadTest'
+NUMBER_OF_SHIFTS = 4
+THREAD_COUNT_SAMPLE_INTERVAL = 0.01
+SETTLE_TIMEOUT = 60.0
+
+def parse_arguments():
+    argumentParser = argparse.ArgumentParser(description='Load test of the bot against fake Google Sheets and Google Chat.')
+    argumentParser.add_argument('--tickets', type=int, default=200, help='Number of tickets opened')
+    argumentParser.add_argument('--concurrency', type=int, default=8, help='Number of events sent at the same time')
+    argumentParser.add_argument('--managers', type=int, default=None, help='Number of managers, spread over the shifts. A manager holds one ticket at a time, '
+        + 'defaults to enough managers for every ticket and reassignment')
+    argumentParser.add_argument('--decline-ratio', type=float, default=0.3, help='Fraction of tickets declined once before they are accepted')
+    argumentParser.add_argument('--sheets-latency', type=float, default=0.05, help='Seconds each Sheets request takes')
+    argumentParser.add_argument('--chat-latency', type=float, default=0.05, help='Seconds each Chat request takes')
+    argumentParser.add_argument('--event-processing-mode', default='Sync', choices=['Sync', 'Async'])
+    argumentParser.add_argument('--requests-per-minute', type=int, default=100000, help='Sheets and Chat quota of the bot')
+    argumentParser.add_argument('--max-p99', type=float, default=None, help='Fail if p99 latency of any event type exceeds this many milliseconds')
+    argumentParser.add_argument('--max-calls-per-ticket', type=float, default=None, help='Fail if API calls per ticket lifecycle exceed this')
+    return argumentParser.parse_args()
+
+def create_spreadsheet(arguments):
+    """Spreadsheet with the configuration of the bot, the managers and empty state sheets"""
+    configuration = {
+        'SpaceId': SPACE_ID, 'URLForRestRequest': 'http://127.0.0.1/', 'TicketTimeout': 3600, 'TimeForDataFlush': 1,
+        'TimeForManagerDataReload': 3600, 'ManagerDNDTime': 7200, 'NumberOfItemsInBatch': 50,
+        'Shift2StartTime': 6, 'Shift3StartTime': 12, 'Shift4StartTime': 18,
+        'ManagersSheetName': 'Managers', 'StateManagementSheetName': 'StateManagement', 'TicketStateSheetName': 'TicketState',
+        'ManagerStateSheetName': 'ManagerState', 'TrackerSheetName': 'Tracker',
+        'EventProcessingMode': arguments.event_processing_mode,
+        'SheetsRequestsPerMinute': arguments.requests_per_minute, 'ChatRequestsPerMinute': arguments.requests_per_minute
+    }
+    managers = [['Name', 'Email', 'Team', 'Role', 'Shift', 'Id']]
+    numberOfManagers = arguments.managers if arguments.managers is not None else NUMBER_OF_SHIFTS * 2 * arguments.tickets
+    for managerNumber in range(numberOfManagers):
+        managers.append([f'Manager {managerNumber}', '', '', '', managerNumber % NUMBER_OF_SHIFTS + 1, 100000 + managerNumber])
+    spreadsheet = FakeSpreadsheet(arguments.sheets_latency)
+    spreadsheet.add_worksheet('Configuration', [list(configuration.keys()), list(configuration.values())])
+    spreadsheet.add_worksheet('Managers', managers)
+    spreadsheet.add_worksheet('StateManagement', [[''], [''], [''], ['Rotation'] + [0] * NUMBER_OF_SHIFTS])
+    spreadsheet.add_worksheet('TicketState', [['Ticket', 'Manager Name', 'Manager GChat ID', 'Message ID', 'Thread ID']])
+    spreadsheet.add_worksheet('ManagerState', [['Manager GChat ID', 'Last Activity']])
+    spreadsheet.add_worksheet('Tracker', [['Timestamp', 'Ticket', 'Manager Name', 'Status']])
+    return spreadsheet
+
+def load_application(spreadsheet, chatServer, workingFolder):
+    """Import and start the application with Google APIs pointed at the stand-ins. It runs in workingFolder, so no local snapshot is used or left behind."""
+    gspread.authorize = lambda credentials: FakeSheetsClient(spreadsheet)
+    ServiceAccountCredentials.from_json_keyfile_name = staticmethod(lambda *args, **kwargs: FakeCredentials())
+    RestRequestHandler.REQUEST_URL_CREATE = chatServer.get_base_url() + '{}/messages?requestId={}'
+    RestRequestHandler.REQUEST_URL_CREATE_IN_THREAD = chatServer.get_base_url() + '{}/messages?threadKey={}&requestId={}'
+    RestRequestHandler.REQUEST_URL_UPDATE = chatServer.get_base_url() + '{}?updateMask={}'
+    os.chdir(workingFolder)
+    import application
+    application.start()
+    return application
+
+def get_message_event(jiraId):
+    return { 'type': 'MESSAGE', 'jiraId': jiraId }
+
+def get_card_clicked_event(jiraId, managerId, actionMethodName):
+    return {
+        'type': 'CARD_CLICKED',
+        'user': { 'name': f'users/{managerId}' },
+        'message': { 'text': f'@Manager {managerId}' },
+        'action': { 'actionMethodName': actionMethodName, 'parameters': [{ 'value': jiraId }, { 'value': str(managerId) }] }
+    }
+
+def get_percentile(sortedValues, percentile):
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percentile / 100))]
+
+def wait_until(condition):
+    """Wait for background work of the bot, e.g. the reassignment of declined tickets in Async mode"""
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('Bot did not settle in time')
+        time.sleep(0.01)
+
+def get_assigned_manager_id(application, jiraId):
+    ticketStatus = application.mainGSheetManager.get_ticket_status(jiraId)
+    return None if ticketStatus is None else ticketStatus.manager_id
+
+# Samples the thread count of the process while the load test runs
+class ThreadCountSampler():
+    peak_thread_count = 0
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.peak_thread_count = threading.active_count()
+        threading.Thread(target=self.run, name='ThreadCountSampler', daemon=True).start()
+
+    def run(self):
+        while not self.stop_event.wait(THREAD_COUNT_SAMPLE_INTERVAL):
+            self.peak_thread_count = max(self.peak_thread_count, threading.active_count())
+
+    def stop(self):
+        self.stop_event.set()
+
+def run_phase(application, concurrency, events):
+    """Send the events with concurrency requests in flight. Returns sorted latencies in milliseconds and the wall time of the phase."""
+    threadLocal = threading.local()
+
+    def send_event(event):
+        if not hasattr(threadLocal, 'client'):
+            threadLocal.client = application.app.test_client()
+        startTime = time.perf_counter()
+        response = threadLocal.client.post('/', json=event)
+        latency = (time.perf_counter() - startTime) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"{event['type']} event failed with {response.status_code}: {response.get_data(as_text=True)}")
+        return latency
+
+    startTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='LoadTestClient') as executor:
+        latencies = list(executor.map(send_event, events))
+    return sorted(latencies), time.perf_counter() - startTime
+
+def main():
+    arguments = parse_arguments()
+    random.seed(0)
+    spreadsheet = create_spreadsheet(arguments)
+    chatServer = FakeChatServer(arguments.chat_latency)
+    workingFolder = tempfile.mkdtemp(prefix='rcabot-loadtest-')
+    application = load_application(spreadsheet, chatServer, workingFolder)
+    startupSheetsRequests = spreadsheet.get_request_count()
+    threadCountSampler = ThreadCountSampler()
+
+    jiraIds = [f'LOAD-{ticketNumber}' for ticketNumber in range(arguments.tickets)]
+    results = []
+    latencies, wallTime = run_phase(application, arguments.concurrency, [get_message_event(jiraId) for jiraId in jiraIds])
+    results.append(('MESSAGE', latencies, wallTime))
+    wait_until(lambda: all(get_assigned_manager_id(application, jiraId) not in (None, 0) for jiraId in jiraIds))
+
+    declinedJiraIds = random.sample(jiraIds, int(len(jiraIds) * arguments.decline_ratio))
+    managerIdsBeforeDecline = { jiraId: get_assigned_manager_id(application, jiraId) for jiraId in declinedJiraIds }
+    if len(declinedJiraIds) > 0:
+        latencies, wallTime = run_phase(application, arguments.concurrency, [get_card_clicked_event(jiraId, managerId, 'decline') for jiraId, managerId in managerIdsBeforeDecline.items()])
+        results.append(('DECLINE', latencies, wallTime))
+        # Declined tickets are reassigned in the background by the timeout handler
+        wait_until(lambda: all(get_assigned_manager_id(application, jiraId) not in (None, 0, managerId) for jiraId, managerId in managerIdsBeforeDecline.items()))
+
+    latencies, wallTime = run_phase(application, arguments.concurrency, [get_card_clicked_event(jiraId, get_assigned_manager_id(application, jiraId), 'accept') for jiraId in jiraIds])
+    results.append(('ACCEPT', latencies, wallTime))
+    wait_until(lambda: all(get_assigned_manager_id(application, jiraId) is None for jiraId in jiraIds))
+    threadCountSampler.stop()
+    # Send everything still waiting to be written, so its requests are counted
+    application.mainGSheetManager.flush_pending_writes()
+
+    print(f"{'event':<10}{'count':>8}{'p50 (ms)':>12}{'p99 (ms)':>12}{'max (ms)':>12}{'events/s':>12}")
+    for eventType, latencies, wallTime in results:
+        print(f"{eventType:<10}{len(latencies):>8}{get_percentile(latencies, 50):>12.2f}{get_percentile(latencies, 99):>12.2f}{latencies[-1]:>12.2f}{len(latencies) / wallTime:>12.1f}")
+    sheetsRequests = spreadsheet.get_request_count() - startupSheetsRequests
+    chatRequests = chatServer.get_request_count()
+    callsPerTicket = (sheetsRequests + chatRequests) / arguments.tickets
+    print(f"\npeak threads: {threadCountSampler.peak_thread_count}, peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    print(f"Sheets requests: {sheetsRequests} after {startupSheetsRequests} at startup, {dict(spreadsheet.request_counter)}")
+    print(f"Chat requests: {chatRequests}, {dict(chatServer.request_counter)}")
+    print(f"API calls per ticket lifecycle: {callsPerTicket:.2f} ({sheetsRequests / arguments.tickets:.2f} Sheets, {chatRequests / arguments.tickets:.2f} Chat)")
+
+    failures = []
+    if arguments.max_p99 is not None:
+        failures += [f'{eventType} p99 {get_percentile(latencies, 99):.2f} ms exceeds {arguments.max_p99} ms' for eventType, latencies, wallTime in results if get_percentile(latencies, 99) > arguments.max_p99]
+    if arguments.max_calls_per_ticket is not None and callsPerTicket > arguments.max_calls_per_ticket:
+        failures.append(f'{callsPerTicket:.2f} API calls per ticket exceeds {arguments.max_calls_per_ticket}')
+    chatServer.shutdown()
+    shutil.rmtree(workingFolder, ignore_errors=True)
+    for failure in failures:
+        print('FAILED: ' + failure)
+    # Background threads of the bot are not stopped, exit right away
+    sys.stdout.flush()
+    os._exit(1 if len(failures) > 0 else 0)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""Memory and CPU benchmark of the in-memory model of tickets, timers and managers: TicketState and ManagerRotationIndex records
+against the dictionaries keyed by TicketState sheet column headers, the TimerEventObjData objects and the scan of the raw Managers sheet rows
+with a dnd dictionary they replace. Memory is measured with tracemalloc, CPU as the best time of a few repeats.
+Run from the project folder: python benchmarks/StateModelBenchmark.py --tickets 10000 --managers 1000"""
+import os
+import sys
+import argparse
+import json
+import random
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from StateStore import StateStore
+from TicketState import TicketState
+from ManagerRotationIndex import ManagerRotationIndex
+
+NUMBER_OF_SHIFTS = 4
+MANAGER_DND_TIME = 3600.0
+NUMBER_OF_REPEATS = 3
+
+# Timer of a ticket as kept by TimeoutHandler before it was folded into TicketState
+class LegacyTimerEventObjData():
+    def __init__(self, jiraId, managerId):
+        self.jiraId = jiraId
+        self.managerId = int(managerId)
+        self.isDeclined = False
+        self.isFiring = False
+
+def parse_arguments():
+    argumentParser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentParser.add_argument('--tickets', type=int, default=10000, help='Number of tickets in the cycle')
+    argumentParser.add_argument('--managers', type=int, default=1000, help='Number of managers, spread over the shifts')
+    argumentParser.add_argument('--dnd-ratio', type=float, default=0.5, help='Fraction of managers in dnd')
+    return argumentParser.parse_args()
+
+def create_sheet_data(arguments):
+    """Rows as gspread returns them: TicketState records with numeric manager ids, and Managers sheet values as text"""
+    managers = [['Name', 'Email', 'Team', 'Role', 'Shift', 'Id']]
+    for managerNumber in range(arguments.managers):
+        managers.append([f'Manager {managerNumber}', '', '', '', str(managerNumber % NUMBER_OF_SHIFTS + 1), str(112233445566000000 + managerNumber)])
+    ticketRecords = []
+    for ticketNumber in range(arguments.tickets):
+        managerNumber = ticketNumber % arguments.managers
+        ticketRecords.append({
+            StateStore.TICKET_ID_COL: f'RCA-{100000 + ticketNumber}',
+            StateStore.MANAGER_NAME_COL: f'Manager {managerNumber}',
+            StateStore.MANAGER_ID_COL: 112233445566000000 + managerNumber,
+            StateStore.MESSAGE_ID_COL: f'spaces/AAAA/messages/{ticketNumber}.{ticketNumber}',
+            StateStore.THREAD_ID_COL: f'spaces/AAAA/threads/{ticketNumber}'
+        })
+    now = datetime.utcnow()
+    managerStates = { manager[5]: now - timedelta(seconds=random.uniform(0, MANAGER_DND_TIME / 2)) for manager in managers[1:] if random.random() < arguments.dnd_ratio }
+    return ticketRecords, managers, managerStates
+
+def load_legacy_tickets(ticketRecords):
+    ticketStates = { record[StateStore.TICKET_ID_COL]: dict(record) for record in ticketRecords }
+    timers = { jiraId: LegacyTimerEventObjData(jiraId, record[StateStore.MANAGER_ID_COL]) for jiraId, record in ticketStates.items() }
+    return ticketStates, timers
+
+def load_compact_tickets(ticketRecords):
+    ticketStates = { ticketState.jira_id: ticketState for ticketState in map(TicketState.from_sheet_record, ticketRecords) }
+    timers = { jiraId: TicketState(jiraId, ticketState.manager_id) for jiraId, ticketState in ticketStates.items() }
+    return ticketStates, timers
+
+def reassign_legacy_tickets(ticketStates, timers):
+    """What a decline of every ticket does to the ticket state and its timer"""
+    for jiraId, ticketState in list(ticketStates.items()):
+        timer = timers[jiraId]
+        if timer.managerId == int(ticketState[StateStore.MANAGER_ID_COL]):
+            ticketState = ticketState.copy()
+            ticketState[StateStore.MANAGER_ID_COL] = '112233445566999999'
+            ticketState[StateStore.MANAGER_NAME_COL] = 'Manager 999999'
+            ticketState[StateStore.MESSAGE_ID_COL] = 'spaces/AAAA/messages/next'
+            ticketStates[jiraId] = ticketState
+            timer.managerId = int(ticketState[StateStore.MANAGER_ID_COL])
+
+def reassign_compact_tickets(ticketStates, timers):
+    for jiraId, ticketState in list(ticketStates.items()):
+        timer = timers[jiraId]
+        if timer.manager_id == ticketState.manager_id:
+            ticketState = ticketStates[jiraId] = ticketState.with_manager('112233445566999999', 'Manager 999999', 'spaces/AAAA/messages/next')
+            timer.manager_id = ticketState.manager_id
+
+def get_legacy_dnd_timeout(managerStates, managerId, now):
+    if managerId in managerStates:
+        timeSinceLastActivity = (now - managerStates[managerId]).total_seconds()
+        if timeSinceLastActivity <= MANAGER_DND_TIME - 5:
+            return MANAGER_DND_TIME - timeSinceLastActivity
+    return 0
+
+def pick_legacy_managers(listOfManagers, managerStates, numberOfPicks, now):
+    """Round robin over the raw Managers sheet rows as GSheetManager.get_manager_id did, parsing the shift of every row it passes"""
+    rowNumberByShift = {}
+    for pick in range(numberOfPicks):
+        shift = pick % NUMBER_OF_SHIFTS + 1
+        rowNumber = rowNumberByShift.get(shift, 1)
+        for step in range(len(listOfManagers) - 1):
+            rowNumber = rowNumber + 1 if rowNumber < len(listOfManagers) else 2
+            manager = listOfManagers[rowNumber - 1]
+            if int(manager[4]) == shift and get_legacy_dnd_timeout(managerStates, manager[5], now) == 0:
+                break
+        rowNumberByShift[shift] = rowNumber
+
+def pick_compact_managers(managerRotationIndex, numberOfPicks, now):
+    rowNumberByShift = {}
+    for pick in range(numberOfPicks):
+        shift = pick % NUMBER_OF_SHIFTS + 1
+        rowNumberByShift[shift] = managerRotationIndex.get_next_manager(shift, rowNumberByShift.get(shift, 1), now)[0]
+
+def measure_memory(function):
+    """Bytes held by the result of function"""
+    tracemalloc.start()
+    result = function()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return memory
+
+def measure_time(function):
+    return min(timeit.repeat(function, number=1, repeat=NUMBER_OF_REPEATS))
+
+def main():
+    arguments = parse_arguments()
+    random.seed(0)
+    ticketRecords, listOfManagers, managerStates = create_sheet_data(arguments)
+    # Managers sheet as the Sheets API returns it, the rows are parsed from it on every load
+    managersResponse = json.dumps(listOfManagers)
+    now = datetime.utcnow()
+
+    legacyTickets = load_legacy_tickets(ticketRecords)
+    compactTickets = load_compact_tickets(ticketRecords)
+    # The legacy dnd dictionary is measured alongside the raw rows. The rotation index is built from the parsed rows, which are
+    # dropped once it is, so it is all that is kept of the managers.
+    cases = [
+        ('ticket states + timers: memory (KB)',
+            lambda: measure_memory(lambda: load_legacy_tickets(ticketRecords)) / 1024,
+            lambda: measure_memory(lambda: load_compact_tickets(ticketRecords)) / 1024),
+        ('managers + dnd: memory (KB)',
+            lambda: measure_memory(lambda: (json.loads(managersResponse), dict(managerStates))) / 1024,
+            lambda: measure_memory(lambda: ManagerRotationIndex(ManagerRotationIndex.parse_managers(json.loads(managersResponse)), managerStates, MANAGER_DND_TIME)) / 1024),
+        ('load ticket states (ms)',
+            lambda: measure_time(lambda: load_legacy_tickets(ticketRecords)) * 1000,
+            lambda: measure_time(lambda: load_compact_tickets(ticketRecords)) * 1000),
+        ('reassign every ticket (ms)',
+            lambda: measure_time(lambda: reassign_legacy_tickets(*legacyTickets)) * 1000,
+            lambda: measure_time(lambda: reassign_compact_tickets(*compactTickets)) * 1000),
+        (f'pick {arguments.tickets} managers (ms)',
+            lambda: measure_time(lambda: pick_legacy_managers(listOfManagers, managerStates, arguments.tickets, now)) * 1000,
+            lambda: measure_time(lambda: pick_compact_managers(ManagerRotationIndex(ManagerRotationIndex.parse_managers(listOfManagers), managerStates, MANAGER_DND_TIME), arguments.tickets, now)) * 1000),
+    ]
+
+    print(f"{arguments.tickets} tickets, {arguments.managers} managers, {len(managerStates)} in dnd")
+    print(f"{'case':<40}{'legacy':>12}{'compact':>12}{'ratio':>8}")
+    for name, legacy, compact in cases:
+        legacyValue = legacy()
+        compactValue = compact()
+        print(f"{name:<40}{legacyValue:>12.1f}{compactValue:>12.1f}{legacyValue / compactValue:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file